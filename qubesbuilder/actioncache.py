@@ -0,0 +1,217 @@
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# Copyright (C) 2025 Frédéric Pierret (fepitre) <frederic@invisiblethingslab.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+import urllib.error
+import urllib.request
+from abc import ABC, abstractmethod
+from pathlib import Path, PurePath
+from typing import BinaryIO, Optional
+
+from qubesbuilder.common import get_temporary_path
+from qubesbuilder.exc import QubesBuilderError
+from qubesbuilder.log import QubesBuilderLogger
+
+# Bumped when the content of keys or entries changes
+ACTION_CACHE_VERSION = 1
+
+
+class ActionCacheError(QubesBuilderError):
+    pass
+
+
+class ActionCache(ABC):
+    """
+    Cache of build outputs keyed by the hash of everything the build
+    depends on.
+
+    An entry is a tar archive of the artifacts directory of a build.
+    """
+
+    def __init__(self, upload: bool = True):
+        self.upload = upload
+        self.log = QubesBuilderLogger.getChild("action-cache")
+
+    @staticmethod
+    def check_key(key: str):
+        if not re.fullmatch(r"[0-9a-f]{64}", key):
+            raise ActionCacheError(f"Invalid action cache key '{key}'.")
+
+    @abstractmethod
+    def open(self, key: str) -> Optional[BinaryIO]:
+        """
+        Returns the content of the entry, or None if there is none.
+        """
+
+    @abstractmethod
+    def put(self, key: str, fileobj: BinaryIO, size: int):
+        """
+        Add or replace the entry with the content of fileobj.
+        """
+
+    def restore(self, key: str, directory: Path) -> bool:
+        """
+        Extract the entry into directory. Returns False if there is none.
+        """
+        self.check_key(key)
+        fileobj = self.open(key)
+        if not fileobj:
+            return False
+        directory.mkdir(parents=True, exist_ok=True)
+        with fileobj:
+            try:
+                with tarfile.open(fileobj=fileobj, mode="r|") as tar:
+                    if hasattr(tarfile, "fully_trusted_filter"):
+                        tar.extraction_filter = tarfile.fully_trusted_filter
+                    for member in tar:
+                        name = PurePath(member.name)
+                        if (
+                            name.is_absolute()
+                            or ".." in name.parts
+                            or not (
+                                member.isfile()
+                                or member.isdir()
+                                or (
+                                    member.islnk()
+                                    and not PurePath(
+                                        member.linkname
+                                    ).is_absolute()
+                                    and ".."
+                                    not in PurePath(member.linkname).parts
+                                )
+                            )
+                        ):
+                            raise ActionCacheError(
+                                f"Unexpected member '{member.name}' in entry '{key}'."
+                            )
+                        tar.extract(member, directory)
+            except (tarfile.TarError, OSError) as e:
+                raise ActionCacheError(
+                    f"Failed to extract entry '{key}': {str(e)}"
+                ) from e
+        return True
+
+    def save(self, key: str, directory: Path):
+        """
+        Add directory content as entry, if uploading is enabled.
+        """
+        self.check_key(key)
+        if not self.upload:
+            return
+        with tempfile.TemporaryFile() as archive:
+            try:
+                with tarfile.open(fileobj=archive, mode="w") as tar:
+                    for path in sorted(directory.iterdir()):
+                        tar.add(path, arcname=path.name)
+            except (tarfile.TarError, OSError) as e:
+                raise ActionCacheError(
+                    f"Failed to create entry '{key}': {str(e)}"
+                ) from e
+            size = archive.tell()
+            archive.seek(0)
+            self.put(key, archive, size)  # type: ignore
+
+
+class LocalActionCache(ActionCache):
+    """
+    Action cache in a local directory, which can be shared by builders on
+    the same host.
+    """
+
+    def __init__(self, directory: Path, **kwargs):
+        super().__init__(**kwargs)
+        self.directory = directory
+
+    def get_path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.tar"
+
+    def open(self, key: str) -> Optional[BinaryIO]:
+        try:
+            return open(self.get_path(key), "rb")
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            raise ActionCacheError(
+                f"Failed to read entry '{key}': {str(e)}"
+            ) from e
+
+    def put(self, key: str, fileobj: BinaryIO, size: int):
+        path = self.get_path(key)
+        tmp_path = get_temporary_path(path)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                shutil.copyfileobj(fileobj, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            tmp_path.unlink(missing_ok=True)
+            raise ActionCacheError(
+                f"Failed to write entry '{key}': {str(e)}"
+            ) from e
+
+
+class HTTPActionCache(ActionCache):
+    """
+    Action cache on an HTTP server, shared by several builders. Entries are
+    fetched with GET and added with PUT, as '<url>/<key>.tar'.
+    """
+
+    def __init__(self, url: str, timeout: int = 60, **kwargs):
+        super().__init__(**kwargs)
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def get_url(self, key: str) -> str:
+        return f"{self.url}/{key}.tar"
+
+    def open(self, key: str) -> Optional[BinaryIO]:
+        try:
+            return urllib.request.urlopen(
+                self.get_url(key), timeout=self.timeout
+            )
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return None
+            raise ActionCacheError(
+                f"Failed to get entry '{key}': {str(e)}"
+            ) from e
+        except (urllib.error.URLError, OSError) as e:
+            raise ActionCacheError(
+                f"Failed to get entry '{key}': {str(e)}"
+            ) from e
+
+    def put(self, key: str, fileobj: BinaryIO, size: int):
+        request = urllib.request.Request(
+            self.get_url(key),
+            data=fileobj,
+            method="PUT",
+            headers={
+                "Content-Length": str(size),
+                "Content-Type": "application/x-tar",
+            },
+        )
+        try:
+            urllib.request.urlopen(request, timeout=self.timeout).close()
+        except (urllib.error.URLError, OSError) as e:
+            raise ActionCacheError(
+                f"Failed to put entry '{key}': {str(e)}"
+            ) from e
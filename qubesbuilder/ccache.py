@@ -0,0 +1,143 @@
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# Copyright (C) 2025 Frédéric Pierret (fepitre) <frederic@invisiblethingslab.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Tuple, Union
+
+from qubesbuilder.common import get_temporary_path, size_to_bytes
+from qubesbuilder.log import QubesBuilderLogger
+
+# Indexes of ccache counters in 'stats' files
+CCACHE_STATS_CACHE_MISS = 4
+CCACHE_STATS_PREPROCESSED_CACHE_HIT = 8
+CCACHE_STATS_DIRECT_CACHE_HIT = 22
+
+# Files of ccache which are not cache entries
+CCACHE_METADATA_FILES = ("stats", "ccache.conf")
+
+
+class CompilerCache:
+    """
+    Compiler cache (ccache) directory kept between builds of a distribution.
+
+    A build gets a hardlinked copy of the cache and its updated copy replaces
+    the cache at the end, so that concurrent builds never use a partially
+    updated cache. The last build to finish wins.
+    """
+
+    def __init__(self, directory: Path, max_size: Union[str, int] = "5G"):
+        self.directory = directory
+        self.max_size = max_size
+        self.log = QubesBuilderLogger.getChild("ccache")
+
+    @contextmanager
+    def checkout(self) -> Iterator[Path]:
+        """
+        Yields a temporary directory containing a copy of the cache, named
+        like the cache, and next to it.
+        """
+        self.directory.parent.mkdir(parents=True, exist_ok=True)
+        temp_dir = Path(
+            tempfile.mkdtemp(
+                dir=self.directory.parent, prefix=f".{self.directory.name}."
+            )
+        )
+        try:
+            copy_dir = temp_dir / self.directory.name
+            if self.directory.exists():
+                try:
+                    shutil.copytree(
+                        self.directory, copy_dir, copy_function=os.link
+                    )
+                except (shutil.Error, OSError) as e:
+                    # Cache has been replaced meanwhile, start from scratch.
+                    self.log.debug(f"Failed to copy '{self.directory}': {e}")
+                    shutil.rmtree(copy_dir, ignore_errors=True)
+            copy_dir.mkdir(exist_ok=True)
+            yield copy_dir
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    @staticmethod
+    def get_stats(directory: Path) -> Tuple[int, int]:
+        """
+        Returns the number of cache hits and misses recorded in directory.
+        """
+        hits = misses = 0
+        for stats_file in directory.rglob("stats"):
+            try:
+                counters = [int(c) for c in stats_file.read_text().split()]
+            except (OSError, ValueError):
+                continue
+            counters += [0] * (CCACHE_STATS_DIRECT_CACHE_HIT + 1)
+            hits += counters[CCACHE_STATS_PREPROCESSED_CACHE_HIT]
+            hits += counters[CCACHE_STATS_DIRECT_CACHE_HIT]
+            misses += counters[CCACHE_STATS_CACHE_MISS]
+        return hits, misses
+
+    def evict(self, directory: Path) -> List[Path]:
+        """
+        Remove least recently used entries of directory if it is bigger than
+        the maximum size, like ccache does, down to 80% of the maximum size.
+        This bounds the cache even if ccache inside the build did not clean
+        it up.
+        """
+        max_size = size_to_bytes(self.max_size)
+        entries = []
+        total_size = 0
+        for path in directory.rglob("*"):
+            if path.name in CCACHE_METADATA_FILES or not path.is_file():
+                continue
+            st = path.stat()
+            entries.append((st.st_mtime, st.st_size, path))
+            total_size += st.st_size
+        removed: List[Path] = []
+        if total_size <= max_size:
+            return removed
+        for _, size, path in sorted(entries):
+            if total_size <= max_size * 0.8:
+                break
+            path.unlink()
+            total_size -= size
+            removed.append(path)
+        return removed
+
+    def commit(self, directory: Path):
+        """
+        Replace the cache by directory, coming from checkout().
+        """
+        removed = self.evict(directory)
+        if removed:
+            self.log.debug(
+                f"Removed {len(removed)} old entries from '{self.directory}'."
+            )
+        old_dir = get_temporary_path(self.directory, "old")
+        try:
+            os.rename(self.directory, old_dir)
+        except FileNotFoundError:
+            pass
+        try:
+            os.rename(directory, self.directory)
+        except OSError as e:
+            # Another build has replaced the cache meanwhile.
+            self.log.debug(f"Failed to update '{self.directory}': {e}")
+        shutil.rmtree(old_dir, ignore_errors=True)
@@ -7,6 +7,7 @@ import click
 from qubesbuilder.cli.cli_base import aliased_group, ContextObj
 from qubesbuilder.common import get_archive_name
 from qubesbuilder.component import QubesComponent, ComponentError, QubesVersion
+from qubesbuilder.store import ArtifactStore
 
 
 @aliased_group("cleanup", chain=True)
@@ -92,6 +93,19 @@ def build_artifacts(obj: ContextObj, keep_versions):
                 shutil.rmtree(version_path)
 
 
+@click.command()
+@click.pass_obj
+def store(obj: ContextObj):
+    """
+    Cleanup artifacts store files not used anymore.
+    """
+    for blob in ArtifactStore(obj.config.store_dir).gc(dry_run=obj.dry_run):
+        if obj.dry_run:
+            click.secho(f"DRY-RUN: {blob}")
+        else:
+            click.secho(blob)
+
+
 @click.command()
 @click.option(
     "--log-retention-days", default=30, help="Number of days to keep logs."
@@ -317,6 +331,7 @@ def all(
 
     ctx.invoke(distfiles)
     ctx.invoke(build_artifacts, keep_versions=keep_versions)
+    ctx.invoke(store)
     ctx.invoke(logs, log_retention_days=log_retention_days)
     ctx.invoke(tmp, force=force_tmp)
     ctx.invoke(
@@ -332,6 +347,7 @@ def all(
 
 cleanup.add_command(distfiles)
 cleanup.add_command(build_artifacts)
+cleanup.add_command(store)
 cleanup.add_command(logs)
 cleanup.add_command(tmp)
 cleanup.add_command(cache)
@@ -209,6 +209,13 @@ def init_context_obj(builder_conf: str, option: List = None):
     multiple=True,
     help="Set builder configuration value (can be repeated).",
 )
+@click.option(
+    "--jobs",
+    "-j",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Number of jobs to run in parallel (default: 1).",
+)
 @click.pass_context
 def main(
     ctx: click.Context,
@@ -220,6 +227,7 @@ def main(
     distribution: List,
     template: List,
     option: List,
+    jobs: int,
 ):
     """
     Main CLI
@@ -232,6 +240,8 @@ def main(
         "verbose", verbose if verbose is not None else obj.config.verbose
     )
     obj.config.set("debug", debug if debug is not None else obj.config.debug)
+    if jobs is not None:
+        obj.config.set("jobs", jobs)
 
     obj.components = obj.config.get_components(component)
     obj.distributions = obj.config.get_distributions(distribution)
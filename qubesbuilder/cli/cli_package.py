@@ -8,7 +8,8 @@ from qubesbuilder.common import STAGES_ALIAS
 from qubesbuilder.component import QubesComponent
 from qubesbuilder.config import Config
 from qubesbuilder.distribution import QubesDistribution
-from qubesbuilder.log import QubesBuilderLogger
+from qubesbuilder.log import QubesBuilderLogger, get_logger_name
+from qubesbuilder.scheduler import AdmissionController, JobScheduler
 
 
 @aliased_group("package", chain=True)
@@ -18,6 +19,58 @@ def package():
     """
 
 
+def _run_jobs(
+    config: Config,
+    root_group,
+    jobs: int,
+    components: List[QubesComponent],
+    distributions: List[QubesDistribution],
+    stages: List[str],
+    **kwargs,
+):
+    def run_job(job):
+        if (
+            hasattr(job, "executor")
+            and hasattr(job.executor, "cleanup")
+            and root_group
+        ):
+            root_group.add_cleanup(job.executor.cleanup)
+        job.run(**kwargs)
+
+    if jobs <= 1:
+        for job in config.get_jobs(
+            components=components,
+            distributions=distributions,
+            templates=[],
+            stages=stages,
+        ):
+            run_job(job)
+        return
+
+    scheduler = JobScheduler(
+        config.get_jobs_graph(
+            components=components,
+            distributions=distributions,
+            templates=[],
+            stages=stages,
+        ),
+        jobs=jobs,
+        describe=lambda job: get_logger_name(job.name, job),
+        limits=config.get_job_limits,
+        admit=AdmissionController(
+            max_load=config.max_load,
+            min_free_memory=config.get_job_min_free_memory,
+        ),
+    )
+    scheduler.run(run_job)
+    if scheduler.failed:
+        QubesBuilderLogger.error(
+            f"{len(scheduler.failed)} job(s) failed, "
+            f"{len(scheduler.cancelled)} job(s) cancelled."
+        )
+        raise next(iter(scheduler.failed.values()))
+
+
 def _component_stage(
     config: Config,
     components: List[QubesComponent],
@@ -43,36 +96,30 @@ def _component_stage(
     if config.get("skip-git-fetch", "default") == "default":
         config.set("skip-git-fetch", "fetch" not in stages)
 
-    for job in config.get_jobs(
+    # Fetch jobs are mostly waiting on network and GnuPG, they have their
+    # own number of workers. Each job verifies sources with its own keyring.
+    _run_jobs(
+        config,
+        root_group,
+        jobs=config.fetch_jobs,
         components=components,
         distributions=distributions,
-        templates=[],
         stages=["fetch"],
-    ):
-        if (
-            hasattr(job, "executor")
-            and hasattr(job.executor, "cleanup")
-            and root_group
-        ):
-            root_group.add_cleanup(job.executor.cleanup)
-        job.run(**kwargs)
+        **kwargs,
+    )
 
     if "fetch" in stages:
         stages.remove("fetch")
 
-    for job in config.get_jobs(
+    _run_jobs(
+        config,
+        root_group,
+        jobs=config.jobs,
         components=components,
         distributions=distributions,
-        templates=[],
         stages=stages,
-    ):
-        if (
-            hasattr(job, "executor")
-            and hasattr(job.executor, "cleanup")
-            and root_group
-        ):
-            root_group.add_cleanup(job.executor.cleanup)
-        job.run(**kwargs)
+        **kwargs,
+    )
 
 
 @click.command(name="all", short_help="Run all package stages.")
@@ -16,15 +16,17 @@
 # with this program. If not, see <https://www.gnu.org/licenses/>.
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
+import hashlib
 import os
 import re
 import shutil
 import subprocess
 import tempfile
+import threading
 from enum import Enum
 from pathlib import Path
 from string import digits, ascii_letters
-from typing import List
+from typing import Dict, List, Tuple, Union
 
 PROJECT_PATH = Path(__file__).resolve().parents[1]
 
@@ -99,17 +101,21 @@ def get_archive_name(file: dict):
 
 
 # Originally from QubesOS/qubes-builder/rpc-services/qubesbuilder.BuildLog
+# Printable ASCII characters are kept, windows newlines are replaced by
+# spaces and any other character by dots.
+SANITIZE_TABLE = bytes(
+    c if 0x20 <= c <= 0x7E else 0x20 if c == 0x0D else 0x2E for c in range(256)
+)
+# Same but newlines are kept, for sanitizing several lines at once.
+SANITIZE_LINES_TABLE = SANITIZE_TABLE[:0x0A] + b"\n" + SANITIZE_TABLE[0x0B:]
+
+
 def sanitize_line(untrusted_line: bytes):
-    line = bytearray(untrusted_line)
-    for i, c in enumerate(line):
-        if 0x20 <= c <= 0x7E:
-            pass
-        else:
-            if c == 0x0D:  # windows newline
-                line[i] = 0x20
-            else:
-                line[i] = 0x2E
-    return bytearray(line).decode("ascii")
+    return untrusted_line.translate(SANITIZE_TABLE).decode("ascii")
+
+
+def sanitize_lines(untrusted_lines: bytes):
+    return untrusted_lines.translate(SANITIZE_LINES_TABLE).decode("ascii")
 
 
 def str_to_bool(input_str: str) -> bool:
@@ -120,6 +126,70 @@ def str_to_bool(input_str: str) -> bool:
         return False
 
 
+def size_to_bytes(size: Union[str, int]) -> int:
+    """
+    Convert a size like '512M' or '4G' into bytes. Integers are bytes.
+    """
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+    size = str(size).strip().upper().removesuffix("B")
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def get_file_digest(path: Path, algorithm: str = "sha256") -> str:
+    """
+    Returns the hexadecimal digest of file content.
+    """
+    file_hash = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+# Digests of files by algorithm, device, inode, size and modification time
+_FILE_DIGESTS: Dict[Tuple[str, int, int, int, int], str] = {}
+_FILE_DIGESTS_LOCK = threading.Lock()
+
+
+def get_cached_file_digest(path: Path, algorithm: str = "sha256") -> str:
+    """
+    Same as get_file_digest(), but remembered for the lifetime of the
+    process as long as the file metadata does not change.
+    """
+    st = path.stat()
+    key = (algorithm, st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+    with _FILE_DIGESTS_LOCK:
+        digest = _FILE_DIGESTS.get(key)
+    if not digest:
+        digest = get_file_digest(path, algorithm)
+        with _FILE_DIGESTS_LOCK:
+            _FILE_DIGESTS[key] = digest
+    return digest
+
+
+def get_temporary_path(path: Path, suffix: str = "") -> Path:
+    """
+    Returns a hidden path next to path, unique to the calling thread, where
+    a file or directory can be prepared before being renamed to path.
+    """
+    name = f".{path.name}.{suffix}" if suffix else f".{path.name}"
+    return path.with_name(f"{name}.{os.getpid()}.{threading.get_ident()}")
+
+
+def remove_file(path: Union[str, Path]):
+    """
+    Remove path if it is a file or a symlink. Destination files must be
+    replaced instead of being written into, as they may be hardlinked
+    elsewhere (e.g. local repository or artifacts store).
+    """
+    if os.path.islink(path) or (
+        os.path.lexists(path) and not os.path.isdir(path)
+    ):
+        os.unlink(path)
+
+
 def deep_check(data):
     if isinstance(data, dict):
         for k, v in data.items():
@@ -18,10 +18,15 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import hashlib
+import json
+import os
 import re
+import stat
 import subprocess
+import time
+from functools import lru_cache
 from pathlib import Path
-from typing import Union, List, TYPE_CHECKING
+from typing import Iterator, Union, List, TYPE_CHECKING
 
 if TYPE_CHECKING:
     try:
@@ -35,7 +40,12 @@ import yaml
 # pylint: disable=protected-access
 from packaging.version import Version, InvalidVersion, VERSION_PATTERN, _Version
 
-from qubesbuilder.common import sanitize_line, deep_check, VerificationMode
+from qubesbuilder.common import (
+    sanitize_line,
+    deep_check,
+    get_temporary_path,
+    VerificationMode,
+)
 from qubesbuilder.exc import ComponentError, NoQubesBuilderFileError
 
 # allow fractional post-release (like 1.0-0.1)
@@ -85,6 +95,7 @@ class QubesComponent:
         is_plugin: bool = False,
         has_packages: bool = True,
         min_distinct_maintainers: int = 1,
+        source_hash_cache_dir: Path = None,
         **kwargs,
     ):
         self.source_dir: Path = (
@@ -104,6 +115,7 @@ class QubesComponent:
         self.is_plugin = is_plugin
         self.has_packages = has_packages
         self._source_hash = ""
+        self._source_hash_cache_dir = source_hash_cache_dir
         self._devel_path = devel_path
         self.kwargs = kwargs
 
@@ -260,15 +272,28 @@ class QubesComponent:
                 hash.update(chunk)
         return hash
 
-    def _update_hash_from_dir(self, directory: Path, hash: "HASH"):
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def _get_gitignore_spec(gitignore: Path, mtime_ns: int, size: int):
+        lines = gitignore.read_text().splitlines()
+        return pathspec.PathSpec.from_lines("gitwildmatch", lines)
+
+    def _iter_source_paths(self, directory: Path) -> Iterator[Path]:
+        """
+        Yield paths contributing to source hash, in hashing order. Content
+        of a directory is yielded right after the directory itself.
+        """
         if not directory.exists() or not directory.is_dir():
             raise ComponentError(f"Cannot find '{directory}'.")
         paths = [name for name in Path(directory).iterdir()]
         excluded_paths = [directory / ".git"]
         # We ignore .git and content defined by .gitignore
-        if (directory / ".gitignore").exists():
-            lines = (directory / ".gitignore").read_text().splitlines()
-            spec = pathspec.PathSpec.from_lines("gitwildmatch", lines)
+        gitignore = directory / ".gitignore"
+        if gitignore.exists():
+            gitignore_stat = gitignore.stat()
+            spec = self._get_gitignore_spec(
+                gitignore, gitignore_stat.st_mtime_ns, gitignore_stat.st_size
+            )
             excluded_paths += [
                 name for name in paths if spec.match_file(str(name))
             ]
@@ -276,19 +301,86 @@ class QubesComponent:
         # We ensure to compute hash always in a sorted order
         sorted_paths = sorted(sorted_paths, key=lambda p: str(p).lower())
         for path in sorted_paths:
+            yield path
+            if not path.is_file() and path.is_dir():
+                yield from self._iter_source_paths(path)
+
+    def _update_hash_from_dir(self, directory: Path, hash: "HASH"):
+        for path in self._iter_source_paths(directory):
             hash.update(path.name.encode())
             if path.is_file():
                 hash = self._update_hash_from_file(path, hash)
-            elif path.is_dir():
-                hash = self._update_hash_from_dir(path, hash)
         return hash
 
-    def get_source_hash(self, force_update=True):
-        if not self._source_hash or force_update:
-            source_dir_hash = self._update_hash_from_dir(
+    def _get_source_fingerprint(self, directory: Path):
+        """
+        Returns a fingerprint of source tree from files metadata only, and
+        the most recent modification time seen.
+        """
+        fingerprint = hashlib.sha256()
+        latest_mtime_ns = 0
+        for path in self._iter_source_paths(directory):
+            try:
+                st = path.stat()
+            except OSError:
+                # e.g. broken symlink, only its name is hashed
+                fingerprint.update(f"{path}\0\n".encode())
+                continue
+            if stat.S_ISREG(st.st_mode):
+                fingerprint.update(
+                    f"{path}\0{st.st_size}\0{st.st_mtime_ns}\0"
+                    f"{st.st_ctime_ns}\0{st.st_ino}\0{st.st_dev}\n".encode()
+                )
+                latest_mtime_ns = max(latest_mtime_ns, st.st_mtime_ns)
+            else:
+                fingerprint.update(
+                    f"{path}\0{stat.S_IFMT(st.st_mode)}\n".encode()
+                )
+        return fingerprint.hexdigest(), latest_mtime_ns
+
+    def _get_source_hash(self) -> str:
+        if not self._source_hash_cache_dir:
+            return self._update_hash_from_dir(
                 self.source_dir, hashlib.sha512()
             ).hexdigest()
-            self._source_hash = str(source_dir_hash)
+
+        # Source hash is reused as long as no file has been changed, based
+        # on files size, modification time and inode.
+        cache_file = self._source_hash_cache_dir / f"{self.name}.json"
+        start_ns = time.time_ns()
+        fingerprint, latest_mtime_ns = self._get_source_fingerprint(
+            self.source_dir
+        )
+        try:
+            cache = json.loads(cache_file.read_text())
+            if cache.get("fingerprint") == fingerprint:
+                return str(cache["hash"])
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+
+        source_hash = self._update_hash_from_dir(
+            self.source_dir, hashlib.sha512()
+        ).hexdigest()
+
+        # A file modified right before fingerprinting may be modified again
+        # with the same size and timestamp, depending on the filesystem
+        # timestamp granularity. Do not cache such source tree.
+        if latest_mtime_ns >= start_ns - 2 * 10**9:
+            return source_hash
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = get_temporary_path(cache_file)
+            tmp_file.write_text(
+                json.dumps({"fingerprint": fingerprint, "hash": source_hash})
+            )
+            os.replace(tmp_file, cache_file)
+        except OSError:
+            pass
+        return source_hash
+
+    def get_source_hash(self, force_update=True):
+        if not self._source_hash or force_update:
+            self._source_hash = self._get_source_hash()
         return self._source_hash
 
     def get_source_commit_hash(self):
@@ -20,11 +20,20 @@ import re
 from copy import deepcopy
 from graphlib import TopologicalSorter
 from pathlib import Path
-from typing import Union, List, Dict, Any
+from typing import Union, List, Dict, Any, Optional
 
 import yaml
 
-from qubesbuilder.common import PROJECT_PATH, VerificationMode
+from qubesbuilder.actioncache import (
+    ActionCache,
+    HTTPActionCache,
+    LocalActionCache,
+)
+from qubesbuilder.common import (
+    PROJECT_PATH,
+    VerificationMode,
+    size_to_bytes,
+)
 from qubesbuilder.component import QubesComponent
 from qubesbuilder.distribution import QubesDistribution
 from qubesbuilder.exc import ConfigError
@@ -35,6 +44,7 @@ from qubesbuilder.executors.qubes import (
     LinuxQubesExecutor,
     WindowsQubesExecutor,
 )
+from qubesbuilder.executors.remote import RemoteLinuxExecutor
 from qubesbuilder.executors.windows import SSHWindowsExecutor
 from qubesbuilder.pluginmanager import PluginManager
 from qubesbuilder.plugins import (
@@ -137,6 +147,13 @@ class Config:
     iso_is_final: Union[bool, property]                  = property(lambda self: self.get("iso", {}).get("is-final", False))
     increment_devel_versions: Union[bool, property]      = property(lambda self: self.get("increment-devel-versions", False))
     automatic_upload_on_publish: Union[bool, property]   = property(lambda self: self.get("automatic-upload-on-publish", False))
+    jobs: Union[int, property]                           = property(lambda self: int(self.get("jobs", 1)))
+    fetch_jobs: Union[int, property]                     = property(lambda self: int(self.get("fetch-jobs", self.jobs)))
+    max_load: Union[float, property]                     = property(lambda self: float(self.get("max-load")) if self.get("max-load") is not None else None)
+    independent_builds: Union[bool, property]            = property(lambda self: self.get("independent-builds", False))
+    artifacts_store: Union[bool, property]               = property(lambda self: self.get("artifacts-store", False))
+    ccache: Union[bool, property]                        = property(lambda self: self.get("ccache", {}).get("enabled", False))
+    ccache_max_size: Union[str, property]                = property(lambda self: self.get("ccache", {}).get("max-size", "5G"))
     session: Union[Any, property]                        = property(lambda self: self.get("session", None))
     # fmt: on
 
@@ -412,6 +429,35 @@ class Config:
     def logs_dir(self):
         return self.artifacts_dir / "logs"
 
+    @property
+    def store_dir(self):
+        return self.artifacts_dir / "store"
+
+    @property
+    def distfiles_cache_dir(self) -> Optional[Path]:
+        cache_dir = self.get("distfiles-cache-dir", None)
+        if not cache_dir:
+            return None
+        return self.get_absolute_path_from_config(
+            cache_dir, relative_to=self.artifacts_dir
+        )
+
+    def get_action_cache(self) -> Optional[ActionCache]:
+        options = self.get("action-cache", {})
+        if not options:
+            return None
+        upload = options.get("upload", True)
+        if options.get("url", None):
+            return HTTPActionCache(options["url"], upload=upload)
+        if options.get("directory", None):
+            return LocalActionCache(
+                self.get_absolute_path_from_config(
+                    options["directory"], relative_to=self.artifacts_dir
+                ),
+                upload=upload,
+            )
+        raise ConfigError("Action cache requires 'url' or 'directory'.")
+
     def get_plugins_dirs(self):
         plugins_dirs = self._conf.get("plugins-dirs", [])
         # We call get_components in order to ensure that plugin ones are added
@@ -438,7 +484,6 @@ class Config:
         distribution_executor_options = {}
         component_executor_options: Dict[Any, Any] = {}
         default_executor_options = self._conf.get("executor", {}) or {}
-        stage_executor_options = {}
         executor_options: Dict[Any, Any] = {}
 
         if plugin:
@@ -491,16 +536,9 @@ class Config:
                                 stage[stage_name].get("executor", {}),
                             )
 
-        for stage in self._conf.get("stages", []):
-            if isinstance(stage, str):
-                continue
-            if (
-                isinstance(stage, dict)
-                and next(iter(stage)) == stage_name
-                and isinstance(stage[stage_name], dict)
-            ):
-                stage_executor_options = stage[stage_name].get("executor", {})
-                break
+        stage_executor_options = self.get_stage_options(stage_name).get(
+            "executor", {}
+        )
 
         for options in [
             default_executor_options,
@@ -532,8 +570,51 @@ class Config:
             )
         if plugin:
             executor.log = plugin.log.getChild(stage_name)
+            dist = getattr(plugin, "dist", None)
+            if dist:
+                executor.distribution = dist.distribution
         return executor
 
+    def get_stage_options(self, stage_name: str) -> Dict[str, Any]:
+        """
+        Returns options of a stage defined in the top level stages.
+        """
+        for stage in self._conf.get("stages", []):
+            if (
+                isinstance(stage, dict)
+                and next(iter(stage)) == stage_name
+                and isinstance(stage[stage_name], dict)
+            ):
+                return stage[stage_name]
+        return {}
+
+    def get_job_limits(self, job: Plugin) -> Dict[str, int]:
+        """
+        Returns the maximum number of jobs allowed to run in parallel with
+        the given one, per executor type and per stage.
+        """
+        limits = {}
+        executor_options = self.get_executor_options_from_config(
+            job.stage, job  # type: ignore
+        )
+        if executor_options.get("max-parallel", None):
+            limits[f"executor:{executor_options['type']}"] = int(
+                executor_options["max-parallel"]
+            )
+        stage_options = self.get_stage_options(job.stage)
+        if stage_options.get("max-parallel", None):
+            limits[f"stage:{job.stage}"] = int(stage_options["max-parallel"])
+        return limits
+
+    def get_job_min_free_memory(self, job: Plugin) -> int:
+        """
+        Returns the free memory needed on the host for starting the job.
+        """
+        executor_options = self.get_executor_options_from_config(
+            job.stage, job  # type: ignore
+        )
+        return size_to_bytes(executor_options.get("min-free-memory", 0))
+
     def get_component_from_dict_or_string(
         self, component_name: Union[str, Dict]
     ) -> QubesComponent:
@@ -577,6 +658,7 @@ class Config:
             "min_distinct_maintainers": options.get(
                 "min-distinct-maintainers", min_distinct_maintainers
             ),
+            "source_hash_cache_dir": self.cache_dir / "source-hash",
             **options,
         }
         if self.increment_devel_versions:
@@ -603,6 +685,8 @@ class Config:
             executor = LocalExecutor(**executor_options)  # type: ignore
         elif executor_type == "qubes":
             executor = LinuxQubesExecutor(**executor_options)  # type: ignore
+        elif executor_type == "ssh":
+            executor = RemoteLinuxExecutor(**executor_options)  # type: ignore
         elif executor_type == "windows":
             executor = WindowsQubesExecutor(**executor_options)  # type: ignore
         elif executor_type == "windows-ssh":
@@ -780,19 +864,16 @@ class Config:
 
         return None
 
-    def get_jobs(
+    def _collect_jobs(
         self,
         components: List[QubesComponent],
         distributions: List[QubesDistribution],
         templates: List[QubesTemplate],
         stages: List[str],
-        with_dependencies: bool = True,
     ):
         """
-        Collects jobs related to given constraints.
-        First collect jobs according to stage orders. But then,
-        apply topological sorting based on defined dependencies that will
-        possibly reorder jobs to satisfy dependencies.
+        Collects jobs related to given constraints according to stage orders,
+        along with the jobs they depend on.
         """
         manager = self.get_plugin_manager()
         plugins = manager.get_plugins()
@@ -851,11 +932,10 @@ class Config:
             for tmpl in templates:
                 add_job(JobReference(None, None, tmpl, stage, None))
 
-        # If we don't want dependencies, just return in collection order.
-        if not with_dependencies:
-            return jobs
+        return jobs, jobs_by_ref
 
-        # build DAG and apply topological sort
+    @staticmethod
+    def _get_jobs_dependency_graph(jobs, jobs_by_ref):
         graph = {}
         for job in jobs:
             deps = []
@@ -879,7 +959,120 @@ class Config:
                     if dep_job:
                         deps.append(dep_job)
             graph[job] = deps
+        return graph
 
+    def get_jobs(
+        self,
+        components: List[QubesComponent],
+        distributions: List[QubesDistribution],
+        templates: List[QubesTemplate],
+        stages: List[str],
+        with_dependencies: bool = True,
+    ):
+        """
+        Collects jobs related to given constraints.
+        First collect jobs according to stage orders. But then,
+        apply topological sorting based on defined dependencies that will
+        possibly reorder jobs to satisfy dependencies.
+        """
+        jobs, jobs_by_ref = self._collect_jobs(
+            components=components,
+            distributions=distributions,
+            templates=templates,
+            stages=stages,
+        )
+
+        # If we don't want dependencies, just return in collection order.
+        if not with_dependencies:
+            return jobs
+
+        # build DAG and apply topological sort
+        graph = self._get_jobs_dependency_graph(jobs, jobs_by_ref)
         ts = TopologicalSorter(graph)
         jobs = list(ts.static_order())
         return jobs
+
+    def get_jobs_graph(
+        self,
+        components: List[QubesComponent],
+        distributions: List[QubesDistribution],
+        templates: List[QubesTemplate],
+        stages: List[str],
+    ) -> Dict[Plugin, List[Plugin]]:
+        """
+        Collects jobs related to given constraints and returns the graph
+        of their dependencies, suitable for running them concurrently.
+
+        On top of the defined dependencies, the graph holds the ordering
+        that get_jobs only gets from collection order: a job depends on the
+        related jobs of the closest previous stage, and on the more
+        specific related jobs of the same stage. Two jobs are related if
+        they do not refer to different components, distributions or
+        templates. Unless independent-builds is set, the build of a
+        component also depends on the build of the previous component of the
+        same distribution in serial order, as it may need its packages from
+        the local builder repository.
+        """
+        jobs, jobs_by_ref = self._collect_jobs(
+            components=components,
+            distributions=distributions,
+            templates=templates,
+            stages=stages,
+        )
+        graph = self._get_jobs_dependency_graph(jobs, jobs_by_ref)
+        # Same order as get_jobs
+        serial_jobs = list(TopologicalSorter(graph).static_order())
+
+        refs = {job: ref for ref, job in jobs_by_ref.items()}
+        stage_index = {stage: idx for idx, stage in enumerate(stages)}
+        jobs_by_stage: Dict[int, List[Plugin]] = {}
+        for job in jobs:
+            idx = stage_index.get(refs[job].stage)
+            if idx is not None:
+                jobs_by_stage.setdefault(idx, []).append(job)
+
+        def fields(job):
+            return (refs[job].component, refs[job].dist, refs[job].template)
+
+        def related(job, other):
+            return all(
+                a is None or b is None or a == b
+                for a, b in zip(fields(job), fields(other))
+            )
+
+        def specificity(job):
+            return sum(field is not None for field in fields(job))
+
+        for job in jobs:
+            idx = stage_index.get(refs[job].stage)
+            if idx is None:
+                continue
+            deps = [
+                other
+                for other in jobs_by_stage[idx]
+                if other is not job
+                and related(job, other)
+                and specificity(other) > specificity(job)
+            ]
+            for previous_idx in range(idx - 1, -1, -1):
+                previous_deps = [
+                    other
+                    for other in jobs_by_stage.get(previous_idx, [])
+                    if related(job, other)
+                ]
+                if previous_deps:
+                    deps += previous_deps
+                    break
+            graph[job] += [dep for dep in deps if dep not in graph[job]]
+
+        if not self.independent_builds:
+            previous_builds: Dict[QubesDistribution, Plugin] = {}
+            for job in serial_jobs:
+                ref = refs[job]
+                if ref.stage != "build" or not ref.component or not ref.dist:
+                    continue
+                previous = previous_builds.get(ref.dist)
+                if previous and previous not in graph[job]:
+                    graph[job].append(previous)
+                previous_builds[ref.dist] = job
+        return graph
@@ -19,12 +19,18 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 import asyncio
 import logging
+import os
+import shutil
+import tarfile
 from abc import ABC, abstractmethod
-from pathlib import Path
-from typing import Tuple, Union
+from contextlib import contextmanager
+from pathlib import Path, PurePath
+from shlex import quote
+from typing import Iterable, List, Optional, Sequence, Set, Tuple, Union
 
-from qubesbuilder.common import sanitize_line, str_to_bool
+from qubesbuilder.common import remove_file, sanitize_lines, str_to_bool
 from qubesbuilder.exc import QubesBuilderError
+from qubesbuilder.log import QubesBuilderLogWriter
 
 
 class ExecutorError(QubesBuilderError):
@@ -35,6 +41,99 @@ class ExecutorError(QubesBuilderError):
     pass
 
 
+def extract_member(
+    tar: tarfile.TarFile, member: tarfile.TarInfo, dst: Path, name=None
+):
+    """
+    Extract a member of an archive coming from a cage into dst.
+
+    Members escaping dst, devices and unsafe hardlinks are refused. Symlinks
+    are kept as they are, so hardlink targets are checked once resolved as
+    they may go through a previously extracted symlink. Existing files are
+    replaced, see remove_file().
+    """
+    dst = dst.resolve()
+    path = dst / member.name
+    if (
+        PurePath(member.name).is_absolute()
+        or ".." in PurePath(member.name).parts
+        or (
+            member.islnk()
+            and (
+                PurePath(member.linkname).is_absolute()
+                or ".." in PurePath(member.linkname).parts
+                or not (dst / member.linkname).resolve().is_relative_to(dst)
+            )
+        )
+        or member.isdev()
+        or not path.parent.resolve().is_relative_to(dst)
+    ):
+        raise ExecutorError(
+            f"Failed to copy-out: unsafe path '{member.name}'.",
+            name=name,
+        )
+    if not member.isdir():
+        remove_file(path)
+    tar.extract(member, dst)
+
+
+def extract_archive(tar: tarfile.TarFile, dst: Path, name=None):
+    """
+    Extract an archive coming from a cage into dst, see extract_member().
+    Works with streamed archives too.
+    """
+    # Members are checked, keep symlinks as they are like docker cp does.
+    if hasattr(tarfile, "fully_trusted_filter"):
+        tar.extraction_filter = tarfile.fully_trusted_filter
+    for member in tar:
+        extract_member(tar, member, dst, name=name)
+
+
+def extract_indexed_archive(
+    tar: tarfile.TarFile,
+    copy_out: List[Tuple[PurePath, Path]],
+    name=None,
+) -> Set[int]:
+    """
+    Extract an archive having the source of the n-th (source, destination
+    directory) pair of copy_out under the 'n' directory, see
+    extract_member(). Destinations are replaced. Returns the indexes of the
+    sources found in the archive.
+    """
+    if hasattr(tarfile, "fully_trusted_filter"):
+        tar.extraction_filter = tarfile.fully_trusted_filter
+    copied: Set[int] = set()
+    for member in tar:
+        index, _, member.name = member.name.partition("/")
+        if member.islnk():
+            link_index, _, member.linkname = member.linkname.partition("/")
+        else:
+            link_index = index
+        if (
+            not index.isdigit()
+            or int(index) >= len(copy_out)
+            or link_index != index
+            or PurePath(member.name).parts[:1]
+            != (copy_out[int(index)][0].name,)
+        ):
+            raise ExecutorError(
+                f"Failed to copy-out: unexpected path '{index}/{member.name}'.",
+                name=name,
+            )
+        src, dst = copy_out[int(index)]
+        dst = dst.resolve()
+        if int(index) not in copied:
+            dst_path = dst / src.name
+            if dst_path.is_dir() and not dst_path.is_symlink():
+                shutil.rmtree(dst_path)
+            elif os.path.lexists(dst_path):
+                dst_path.unlink()
+            dst.mkdir(parents=True, exist_ok=True)
+            copied.add(int(index))
+        extract_member(tar, member, dst, name=name)
+    return copied
+
+
 class Executor(ABC):
     """
     Base executor class
@@ -43,6 +142,16 @@ class Executor(ABC):
     _builder_dir = Path("/builder")
     log = logging.getLogger("executor")
 
+    # Distribution of the job the executor is created for, if any
+    distribution: Optional[str] = None
+
+    # Whether the executor can keep its cage alive across several runs
+    supports_session = False
+
+    # Whether the executor can expose host directories with a copy-on-write
+    # overlay instead of copying them, see can_mount_in()
+    supports_mount_in = False
+
     def __init__(self, **kwargs):
         self._kwargs = kwargs
 
@@ -58,6 +167,19 @@ class Executor(ABC):
             else str_to_bool(clean_on_error)
         )
 
+        overlay_mounts: Union[str, bool] = self._kwargs.get(
+            "overlay_mounts", False
+        )
+        self._overlay_mounts = (
+            overlay_mounts
+            if isinstance(overlay_mounts, bool)
+            else str_to_bool(overlay_mounts)
+        )
+
+        # Session state: see session()
+        self._in_session = False
+        self._session_files: Set[Tuple[Path, PurePath]] = set()
+
     def get_builder_dir(self):
         return self._builder_dir
 
@@ -94,6 +216,107 @@ class Executor(ABC):
     def run(self, *args, **kwargs):
         pass
 
+    async def run_async(self, *args, **kwargs):
+        """
+        Asynchronous variant of run(), so that a single event loop can drive
+        several cages. Executors not implementing it natively call run() in
+        a thread.
+        """
+        return await asyncio.to_thread(self.run, *args, **kwargs)
+
+    def cleanup(self):
+        pass
+
+    @contextmanager
+    def session(self):
+        """
+        Keep the cage alive across the run() calls made within the context.
+
+        Files copied in during the session stay in place and are not copied
+        again by later runs, and neither are files that have been copied
+        out of the cage. The cage is cleaned up when leaving the context,
+        according to 'clean' and 'clean-on-error' options. Executors not
+        supporting sessions keep using a new cage for each run.
+        """
+        if not self.supports_session or self._in_session:
+            yield self
+            return
+
+        self._in_session = True
+        try:
+            yield self
+        except BaseException:
+            self._in_session = False
+            if self._clean_on_error:
+                self.cleanup()
+            raise
+        self._in_session = False
+        if self._clean:
+            self.cleanup()
+
+    def get_session_copy_in(
+        self, copy_in: Iterable[Tuple[Path, PurePath]] = None
+    ) -> List[Tuple[Path, PurePath]]:
+        """
+        Returns copy-in pairs sorted by destination, without the ones
+        already in the cage of the current session.
+        """
+        return [
+            (src, dst)
+            for src, dst in sorted(set(copy_in or []), key=lambda x: x[1])
+            if (Path(src).resolve(), dst) not in self._session_files
+        ]
+
+    def add_session_file(self, host_path: Path, executor_dir: PurePath):
+        """
+        Record that host_path is available in the cage under executor_dir.
+        """
+        if self._in_session:
+            self._session_files.add((Path(host_path).resolve(), executor_dir))
+
+    def can_mount_in(self) -> bool:
+        """
+        Whether read-only inputs, like chroot caches, can be given to run()
+        with 'mount_in' instead of 'copy_in'. They are then exposed at the
+        same location as if copied in, with a copy-on-write overlay on top
+        of the host directory, for the duration of the commands.
+        """
+        return self.supports_mount_in and self._overlay_mounts
+
+    @staticmethod
+    def get_mount_in_cmd(
+        mount_in: Sequence[Tuple[Path, PurePath]],
+        lower_dirs: Sequence[PurePath],
+        overlays_dir: PurePath,
+    ) -> List[str]:
+        """
+        Commands mounting an overlay of each lower directory, the source
+        directory as seen in the cage, at destination directory / source
+        name. Changes are written under overlays_dir. Overlays are unmounted
+        when the shell running the commands exits.
+        """
+        targets = [quote(str(dst / src.name)) for src, dst in mount_in]
+        cmd = [
+            "trap "
+            + quote("; ".join(f"sudo umount -- {t}" for t in targets))
+            + " EXIT"
+        ]
+        for index, (target, lower_dir) in enumerate(zip(targets, lower_dirs)):
+            upper_dir = overlays_dir / str(index) / "upper"
+            work_dir = overlays_dir / str(index) / "work"
+            options = (
+                f"lowerdir={lower_dir},upperdir={upper_dir},workdir={work_dir}"
+            )
+            cmd += [
+                f"mkdir -p -- {target}",
+                f"sudo mkdir -p -- {quote(str(upper_dir))} {quote(str(work_dir))}",
+                # Metadata-only copy up, if supported, avoids copying whole
+                # files on chown.
+                f"{{ sudo mount -t overlay overlay -o {quote(options + ',metacopy=on')} {target} 2>/dev/null "
+                f"|| sudo mount -t overlay overlay -o {quote(options)} {target}; }}",
+            ]
+        return cmd
+
     def get_user(self):
         raise NotImplementedError
 
@@ -118,35 +341,38 @@ class Executor(ABC):
     async def _read_stream(
         stream, callback, collect=False, max_length=10000
     ) -> bytes:
-        remaining_line = b""
-        if collect:
-            buffer = b""
+        """
+        Read stream until its end, giving complete lines to callback by
+        batches. Lines longer than max_length are cut.
+        """
+        chunks: List[bytes] = []
+        remaining_line = ""
 
         while True:
-            chunk = await stream.read(4096)
+            chunk = await stream.read(65536)
             if not chunk:
                 if remaining_line and callback:
-                    callback(sanitize_line(remaining_line).rstrip())
+                    callback([remaining_line.rstrip()])
                 break
 
             if collect:
-                buffer += chunk
-            lines = chunk.split(b"\n")
+                chunks.append(chunk)
+            if not callback:
+                continue
 
+            # Sanitizing is done per character, whole chunks are sanitized
+            # at once.
+            lines = sanitize_lines(chunk).split("\n")
             lines[0] = remaining_line + lines[0]
-
-            if callback:
-                for line in lines[:-1]:
-                    callback(sanitize_line(line).rstrip())
-
-            remaining_line = lines[-1]
+            remaining_line = lines.pop()
+            lines = [line.rstrip() for line in lines]
             if len(remaining_line) > max_length:
-                line = remaining_line[:max_length]
+                lines.append(remaining_line[:max_length].rstrip() + "\u2026")
                 remaining_line = remaining_line[max_length:]
-                if callback:
-                    callback(sanitize_line(line).rstrip() + "\u2026")
+            if lines:
+                callback(lines)
 
-        return buffer if collect else b""
+        return b"".join(chunks)
 
     async def _stream_subprocess(
         self, cmd, stdout_cb, stderr_cb, stdin=b"", collect=False, **kwargs
@@ -175,25 +401,46 @@ class Executor(ABC):
         rc = await process.wait()
         return rc, results[0], results[1]
 
-    def execute(self, cmd, collect=False, stdin=b"", echo=True, **kwargs):
+    @staticmethod
+    def _run_coroutine(coroutine):
+        """
+        Run coroutine until completion in the event loop of the thread.
+        """
         try:
             loop = asyncio.get_event_loop()
         except RuntimeError:
             loop = asyncio.new_event_loop()
             asyncio.set_event_loop(loop)
+        return loop.run_until_complete(coroutine)
 
-        rc, stdout, stderr = loop.run_until_complete(
-            self._stream_subprocess(
+    async def execute_async(
+        self, cmd, collect=False, stdin=b"", echo=True, **kwargs
+    ):
+        def log_lines(lines):
+            QubesBuilderLogWriter.write(self.log, lines)
+
+        try:
+            rc, stdout, stderr = await self._stream_subprocess(
                 cmd=cmd,
-                stdout_cb=self.log.debug if echo else None,
-                stderr_cb=self.log.debug if echo else None,
+                stdout_cb=log_lines if echo else None,
+                stderr_cb=log_lines if echo else None,
                 stdin=stdin,
                 collect=collect,
                 **kwargs,
             )
-        )
+        finally:
+            # Command output is logged before anything logged afterwards
+            if echo:
+                await asyncio.to_thread(QubesBuilderLogWriter.flush)
 
         if collect:
             return rc, stdout, stderr
 
         return rc
+
+    def execute(self, cmd, collect=False, stdin=b"", echo=True, **kwargs):
+        return self._run_coroutine(
+            self.execute_async(
+                cmd, collect=collect, stdin=stdin, echo=echo, **kwargs
+            )
+        )
@@ -16,15 +16,22 @@
 # with this program. If not, see <https://www.gnu.org/licenses/>.
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
-import subprocess
-import tempfile
+import asyncio
+import atexit
+import io
+import os
+import tarfile
+import threading
+import time
+import uuid
 from contextlib import contextmanager
 from pathlib import Path, PurePath
 from shlex import quote
-from typing import List, Tuple, Union
+from typing import Any, Dict, Hashable, List, Optional, Set, Tuple, Union
 
-from qubesbuilder.common import sanitize_line
-from qubesbuilder.executors import Executor, ExecutorError
+from qubesbuilder.common import str_to_bool
+from qubesbuilder.executors import Executor, ExecutorError, extract_archive
+from qubesbuilder.log import QubesBuilderLogger
 
 try:
     from docker import DockerClient
@@ -41,13 +48,67 @@ except ImportError:
     PodmanError = ExecutorError
 
 
+class ChunksReader(io.RawIOBase):
+    """
+    Read-only file object over an iterable of bytes chunks, like the
+    archive stream given by container clients.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._chunk = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._chunk:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._chunk = memoryview(chunk)
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+
+# Seconds during which image attributes are reused without asking the
+# container client again.
+IMAGE_CACHE_TTL = 60
+
+# Directories emptied in persistent containers after each job, in addition
+# to the builder directory of the job.
+PERSISTENT_RESET_DIRS = [
+    PurePath("/tmp"),
+    PurePath("/var/tmp"),
+    PurePath("/var/lib/mock"),
+    PurePath("/var/cache/mock"),
+    PurePath("/var/cache/pbuilder"),
+]
+
+# Directories in which jobs may leave changes in persistent containers.
+# A container changed anywhere else is not reused.
+PERSISTENT_JOB_DIRS = [
+    PurePath("/builds"),
+    PurePath("/run"),
+] + PERSISTENT_RESET_DIRS
+
+
 class ContainerExecutor(Executor):
+    # Clients and image attributes shared by all executors of the process,
+    # as an executor is created for every job.
+    _clients: Dict[Hashable, Any] = {}
+    _images: Dict[Hashable, Tuple[float, Dict[str, Any]]] = {}
+    _cache_lock = threading.Lock()
+
     def __init__(
         self,
         container_client,
         image,
         user: str = "user",
         group: str = "user",
+        persistent: Union[str, bool] = False,
         **kwargs,
     ):
         super().__init__(**kwargs)
@@ -55,6 +116,11 @@ class ContainerExecutor(Executor):
         self._container_client = container_client
         self._user = user
         self._group = group
+        self._persistent = (
+            persistent
+            if isinstance(persistent, bool)
+            else str_to_bool(persistent)
+        )
 
         if self._container_client == "podman":
             if PodmanClient is None:
@@ -68,24 +134,27 @@ class ContainerExecutor(Executor):
             raise ExecutorError(
                 f"Unknown container client '{self._container_client}'."
             )
-        with self.get_client() as client:
-            try:
-                # Check if we have the image locally
-                docker_image = client.images.get(image)
-            except (PodmanError, DockerException):
-                # Try to pull the image
-                try:
-                    docker_image = client.images.pull(image)
-                except (PodmanError, DockerException) as e:
-                    raise ExecutorError(f"Cannot find {image}.") from e
-
-        self._attrs = docker_image.attrs
+        self._attrs = self._get_image_attrs(image)
 
+        self._image = image
         self.container: Container = None  # type: ignore
 
-    @contextmanager
-    def get_client(self):
-        kwargs = {
+        # In persistent mode, runs are executed in a long-lived container
+        # taken from a pool, each executor in its own builder directory.
+        # Pool is only known once the executor distribution is set.
+        self._pool: Optional[ContainerPool] = None
+        self._owner: Optional[Tuple[int, int]] = None
+        # Directories known to exist in the container
+        self._directories: Set[PurePath] = set()
+        self._failed = False
+        # Mounts of persistent containers are fixed at their creation
+        self.supports_mount_in = not self._persistent
+        if self._persistent:
+            self.supports_session = True
+            self._builder_dir = Path("/builds") / uuid.uuid4().hex / "builder"
+
+    def _get_client_kwargs(self):
+        return {
             k: v
             for k, v in self._kwargs.items()
             if k
@@ -97,71 +166,317 @@ class ContainerExecutor(Executor):
                 "max_pool_size",
             )
         }
+
+    def _get_client_key(self):
+        return (self._client, tuple(sorted(self._get_client_kwargs().items())))
+
+    @contextmanager
+    def get_client(self):
         try:
-            yield self._client(**kwargs)
+            key = self._get_client_key()
+            with self._cache_lock:
+                client = self._clients.get(key, None)
+                if client is None:
+                    client = self._client(**self._get_client_kwargs())
+                    self._clients[key] = client
+            yield client
         except (PodmanError, DockerException, ValueError) as e:
+            # Do not keep a client which may not be connected anymore
+            with self._cache_lock:
+                self._clients.pop(key, None)
             raise ExecutorError("Cannot connect to container client.") from e
 
+    def _get_image_attrs(self, image: str) -> Dict[str, Any]:
+        key = (self._get_client_key(), image)
+        with self._cache_lock:
+            cached = self._images.get(key, None)
+        if cached and time.monotonic() - cached[0] < IMAGE_CACHE_TTL:
+            return cached[1]
+
+        with self.get_client() as client:
+            try:
+                # Check if we have the image locally
+                docker_image = client.images.get(image)
+            except (PodmanError, DockerException):
+                # Try to pull the image
+                try:
+                    docker_image = client.images.pull(image)
+                except (PodmanError, DockerException) as e:
+                    raise ExecutorError(f"Cannot find {image}.") from e
+
+        with self._cache_lock:
+            self._images[key] = (time.monotonic(), docker_image.attrs)
+        return docker_image.attrs
+
     def get_user(self):
         return self._user
 
     def get_group(self):
         return self._group
 
-    def copy_in(self, source_path: Path, destination_dir: PurePath):  # type: ignore
-        src = source_path.resolve()
-        dst = destination_dir.as_posix()
+    def _stream_archive(
+        self, copy_in: List[Tuple[Path, PurePath]], directories: List[PurePath]
+    ):
+        """
+        Generate chunks of a tar archive of the given directories and every
+        (source, destination directory) pair, written by another thread as
+        they are read.
+        """
+        read_fd, write_fd = os.pipe()
+        errors = []
+
+        def write_archive():
+            try:
+                with open(write_fd, "wb") as f, tarfile.open(
+                    fileobj=f, mode="w|"
+                ) as tar:
+                    for directory in directories:
+                        tarinfo = tarfile.TarInfo(
+                            directory.as_posix().lstrip("/")
+                        )
+                        tarinfo.type = tarfile.DIRTYPE
+                        tarinfo.mode = 0o755
+                        tar.addfile(self._set_owner(tarinfo))
+                    for src, dst in copy_in:
+                        src = src.resolve()
+                        tar.add(
+                            str(src),
+                            arcname=(dst / src.name).as_posix().lstrip("/"),
+                            filter=self._set_owner,
+                        )
+            except (tarfile.TarError, OSError) as e:
+                errors.append(e)
 
+        thread = threading.Thread(target=write_archive, daemon=True)
+        thread.start()
         try:
-            # docker doesn't create parent target dirs on copy (similar to `cp`), do that first
-            with tempfile.TemporaryDirectory() as empty_dir:
-                for parent in list(reversed(destination_dir.parents)) + [
-                    destination_dir
-                ]:
-                    cmd = [
-                        self._container_client,
-                        "cp",
-                        f"{empty_dir!s}/.",
-                        f"{self.container.id}:{parent}",
-                    ]
-                    self.log.debug(f"copy-in (cmd): {' '.join(cmd)}")
-                    subprocess.run(cmd, check=True, capture_output=True)
-            cmd = [
-                self._container_client,
-                "cp",
-                str(src),
-                f"{self.container.id}:{dst}",
-            ]
-            self.log.debug(f"copy-in (cmd): {' '.join(cmd)}")
-            subprocess.run(cmd, check=True, capture_output=True)
-        except subprocess.CalledProcessError as e:
-            content = sanitize_line(e.stderr.rstrip(b"\n")).rstrip()
-            msg = f"Failed to copy-in: {content}"
-            raise ExecutorError(msg, name=self.container.id)
+            # Closing the pipe stops the writer if the stream is not fully
+            # consumed
+            with open(read_fd, "rb") as f:
+                for chunk in iter(lambda: f.read(64 * 1024), b""):
+                    yield chunk
+        finally:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def _put_archive(self, copy_in: List[Tuple[Path, PurePath]]):
+        """
+        Copy every (source, destination directory) pair into the container
+        with a single archive.
+        """
+        # docker doesn't create parent target dirs on copy (similar to
+        # `cp`), add the ones not known to exist. Existing ones are left
+        # untouched as they may be shared with other jobs.
+        directories = set()
+        for _, dst in copy_in:
+            directories.update([dst] + list(dst.parents))
+        directories -= self._directories
+        directories.discard(PurePath("/"))
+        self.log.debug(
+            f"copy-in (archive): {', '.join(f'{s} -> {d}' for s, d in copy_in)}"
+        )
+        try:
+            archive = self._stream_archive(copy_in, sorted(directories))
+            if not self.container.put_archive("/", archive):
+                raise ExecutorError(
+                    "Failed to copy-in: cannot put archive.",
+                    name=self.container.id,
+                )
+        except (PodmanError, DockerException, tarfile.TarError, OSError) as e:
+            msg = f"Failed to copy-in: {str(e)}"
+            raise ExecutorError(msg, name=self.container.id) from e
+        self._directories.update(directories)
+
+    def _set_owner(self, tarinfo: tarfile.TarInfo):
+        if self._owner:
+            # Persistent container: copied files are directly given to the
+            # executor user, instead of changing owner of the whole builder
+            # directory at each run.
+            tarinfo.uid, tarinfo.gid = self._owner
+            tarinfo.uname, tarinfo.gname = self._user, self._group
+        else:
+            # Same as docker cp, copied files are owned by root. Builder
+            # directory is given to the executor user before running
+            # commands.
+            tarinfo.uid = tarinfo.gid = 0
+            tarinfo.uname = tarinfo.gname = "root"
+        return tarinfo
+
+    def copy_in(self, source_path: Path, destination_dir: PurePath):  # type: ignore
+        self._put_archive([(source_path, destination_dir)])
 
     def copy_out(self, source_path: PurePath, destination_dir: Path):  # type: ignore
         src = source_path.as_posix()
         dst = destination_dir.resolve()
 
-        cmd = [
-            self._container_client,
-            "cp",
-            f"{self.container.id}:{src}",
-            str(dst),
+        self.log.debug(f"copy-out (archive): {src} -> {dst}")
+        dst.mkdir(parents=True, exist_ok=True)
+        try:
+            # Extract the archive while it is received
+            stream, _ = self.container.get_archive(src)
+            with tarfile.open(fileobj=ChunksReader(stream), mode="r|") as tar:
+                extract_archive(tar, dst, name=self.container.id)
+        except ExecutorError:
+            raise
+        except (PodmanError, DockerException, tarfile.TarError, OSError) as e:
+            msg = f"Failed to copy-out: {str(e)}"
+            raise ExecutorError(msg, name=self.container.id) from e
+
+    async def _exec_async(self, cmd: str, environment=None, collect=False):
+        """
+        Run a command in the persistent container.
+        """
+        # Environment is given to the client process and only variable
+        # names are put on its command line.
+        env = os.environ.copy()
+        exec_cmd = [self._container_client, "exec"]
+        for key, val in (environment or {}).items():
+            env[key] = str(val)
+            exec_cmd += ["--env", key]
+        exec_cmd += [self.container.id, "bash", "-c", cmd]
+        return await self.execute_async(exec_cmd, collect=collect, env=env)
+
+    def _exec(self, cmd: str, environment=None, collect=False):
+        return self._run_coroutine(
+            self._exec_async(cmd, environment=environment, collect=collect)
+        )
+
+    def _start_persistent_container(self, client):
+        """
+        Take a container from the pool, or start a new one, and prepare
+        the builder directory of this executor into it.
+        """
+        if self.container:
+            return
+        if not self._pool:
+            # Containers are only shared between jobs of the same
+            # distribution, as build roots are kept from one to another.
+            self._pool = ContainerPool.get(
+                (self._get_client_key(), self._attrs["Id"], self.distribution),
+                name=f"{self._container_client}.{self._image}.{self.distribution}",
+            )
+        container = self._pool.acquire()
+        if not container:
+            container = client.containers.create(
+                client.images.get(self._attrs["Id"]),
+                ["sleep", "infinity"],
+                privileged=True,
+                mounts=self._get_mounts(),
+                init=True,
+            )
+            container.start()
+            self.log.debug(
+                f"Started persistent container {self._container_client}:{container.short_id}."
+            )
+        self.container = container
+        self._failed = False
+
+        builder_dir = self.get_builder_dir()
+        directories = " ".join(
+            quote(str(d))
+            for d in (
+                builder_dir,
+                builder_dir / "build",
+                builder_dir / "plugins",
+                builder_dir / "distfiles",
+            )
+        )
+        owner = f"{quote(self._user)}:{quote(self._group)}"
+        rc, stdout, _ = self._exec(
+            f"sudo mkdir -p -- {directories} && "
+            f"sudo chown -- {owner} {directories} && "
+            f"id -u -- {quote(self._user)} && "
+            f"getent group -- {quote(self._group)} | cut -d: -f3",
+            collect=True,
+        )
+        try:
+            uid, gid = stdout.decode().split()
+            self._owner = (int(uid), int(gid))
+        except ValueError:
+            rc = rc or 1
+        self._directories = {
+            builder_dir,
+            builder_dir / "build",
+            builder_dir / "plugins",
+            builder_dir / "distfiles",
+            *builder_dir.parents,
+        }
+        if rc != 0:
+            self._failed = True
+            raise ExecutorError(
+                f"Failed to prepare builder directory (status={rc}).",
+                name=self.container.id,
+            )
+
+    @staticmethod
+    def _get_mounts():
+        return [
+            {
+                "type": "bind",
+                "source": "/dev/loop-control",
+                "target": "/dev/loop-control",
+            },
         ]
+
+    def _is_container_reset(self) -> bool:
+        """
+        Check that the persistent container has no changes from its image
+        outside the directories used by jobs.
+        """
         try:
-            self.log.debug(f"copy-out (cmd): {' '.join(cmd)}")
-            dst.mkdir(parents=True, exist_ok=True)
-            subprocess.run(cmd, check=True, capture_output=True)
-        except subprocess.CalledProcessError as e:
-            content = sanitize_line(e.stderr.rstrip(b"\n")).rstrip()
-            msg = f"Failed to copy-out: {content}"
-            raise ExecutorError(msg, name=self.container.id)
+            changes = self.container.diff() or []
+        except (PodmanError, DockerException) as e:
+            self.log.debug(
+                f"Cannot get changes of {self.container.short_id}: {str(e)}"
+            )
+            return False
+        for change in changes:
+            path = PurePath(change["Path"])
+            if not any(
+                path == d or d in path.parents or path in d.parents
+                for d in PERSISTENT_JOB_DIRS
+            ):
+                self.log.debug(
+                    f"Not reusing {self.container.short_id}: {path} has been changed."
+                )
+                return False
+        return True
 
     def cleanup(self):
-        if self.container:
-            self.container.wait()
-            self.container.remove()
+        if not self._persistent:
+            if self.container:
+                self.container.wait()
+                self.container.remove()
+            return
+
+        self._session_files.clear()
+        if not self.container:
+            return
+        assert self._pool
+        container = self.container
+        # Reset container state for the next job by removing the builder
+        # directory and the content of build roots and temporary
+        # directories. Containers in which a run failed, or changed
+        # elsewhere, are not reused.
+        if not self._failed:
+            reset_cmd = " ".join(
+                [
+                    "shopt -s dotglob nullglob;",
+                    "rm -rf --",
+                    quote(str(self.get_builder_dir().parent)),
+                ]
+                + [f"{quote(str(d))}/*" for d in PERSISTENT_RESET_DIRS]
+            )
+            rc = self._exec(f"sudo bash -c {quote(reset_cmd)}")
+            self._failed = rc != 0 or not self._is_container_reset()
+        self.container = None  # type: ignore
+        self._owner = None
+        self._directories = set()
+        if self._failed:
+            self._pool.remove(container)
+        else:
+            self._pool.release(container)
 
     def run(  # type: ignore
         self,
@@ -171,18 +486,46 @@ class ContainerExecutor(Executor):
         files_inside_executor_with_placeholders: List[Union[Path, str]] = None,
         environment=None,
         no_fail_copy_out_allowed_patterns=None,
+        mount_in: List[Tuple[Path, PurePath]] = None,
+        **kwargs,
+    ):
+        return self._run_coroutine(
+            self.run_async(
+                cmd,
+                copy_in=copy_in,
+                copy_out=copy_out,
+                files_inside_executor_with_placeholders=files_inside_executor_with_placeholders,
+                environment=environment,
+                no_fail_copy_out_allowed_patterns=no_fail_copy_out_allowed_patterns,
+                mount_in=mount_in,
+                **kwargs,
+            )
+        )
+
+    async def run_async(  # type: ignore
+        self,
+        cmd: List[str],
+        copy_in: List[Tuple[Path, PurePath]] = None,
+        copy_out: List[Tuple[PurePath, Path]] = None,
+        files_inside_executor_with_placeholders: List[Union[Path, str]] = None,
+        environment=None,
+        no_fail_copy_out_allowed_patterns=None,
+        mount_in: List[Tuple[Path, PurePath]] = None,
         **kwargs,
     ):
         try:
             with self.get_client() as client:
-                # prepare container for given image and command
-                image = client.images.get(self._attrs["Id"])
-
-                # fix permissions and user group
-                permissions_cmd = [
-                    f"sudo mkdir -p -- {quote(str(self.get_builder_dir()))} {quote(str(self.get_builder_dir()/'build'))} {quote(str(self.get_builder_dir()/'plugins'))} {quote(str(self.get_builder_dir()/'distfiles'))}",
-                    f"sudo chown -R -- {quote(self._user)}:{quote(self._group)} {quote(str(self.get_builder_dir()))}",
-                ]
+                if self._persistent:
+                    await asyncio.to_thread(
+                        self._start_persistent_container, client
+                    )
+                    permissions_cmd = []
+                else:
+                    # fix permissions and user group
+                    permissions_cmd = [
+                        f"sudo mkdir -p -- {quote(str(self.get_builder_dir()))} {quote(str(self.get_builder_dir()/'build'))} {quote(str(self.get_builder_dir()/'plugins'))} {quote(str(self.get_builder_dir()/'distfiles'))}",
+                        f"sudo chown -R -- {quote(self._user)}:{quote(self._group)} {quote(str(self.get_builder_dir()))}",
+                    ]
 
                 # replace placeholders
                 sed_cmd = []
@@ -197,49 +540,94 @@ class ContainerExecutor(Executor):
                         f"sed -i 's#@BUILDER_DIR@#{self.get_builder_dir()}#g' {' '.join(files)}"
                     ]
 
-                final_cmd = "&&".join(permissions_cmd + sed_cmd + cmd)
-                container_cmd = ["bash", "-c", final_cmd]
-
-                # FIXME: Ensure podman client can parse non str value
-                #  https://github.com/containers/podman/issues/11984
-                if self._container_client == "podman":
-                    for k, v in environment.copy().items():
-                        environment[k] = str(v)
-                mounts = [
-                    {
-                        "type": "bind",
-                        "source": "/dev/loop-control",
-                        "target": "/dev/loop-control",
-                    },
-                ]
-                self.container = client.containers.create(
-                    image,
-                    container_cmd,
-                    privileged=True,
-                    environment=environment,
-                    mounts=mounts,
-                    init=True,
+                # read-only inputs are bind mounted with an overlay on top
+                # instead of copied
+                mounts = self._get_mounts()
+                mount_cmd = []
+                if mount_in and self.supports_mount_in:
+                    mount_in = sorted(set(mount_in), key=lambda x: x[1])
+                    lower_dirs = [
+                        PurePath("/overlays/lower") / str(index)
+                        for index in range(len(mount_in))
+                    ]
+                    for (src, _), lower_dir in zip(mount_in, lower_dirs):
+                        mounts.append(
+                            {
+                                "type": "bind",
+                                "source": str(src.resolve()),
+                                "target": str(lower_dir),
+                                "read_only": True,
+                            }
+                        )
+                    # overlayfs cannot be the upper layer of another overlay
+                    mounts.append(
+                        {"type": "tmpfs", "target": "/overlays/upper"}
+                    )
+                    mount_cmd = self.get_mount_in_cmd(
+                        mount_in, lower_dirs, PurePath("/overlays/upper")
+                    )
+
+                final_cmd = "&&".join(
+                    permissions_cmd + sed_cmd + mount_cmd + cmd
                 )
 
-                # copy-in hook
-                for src_in, dst_in in sorted(
-                    set(copy_in or []), key=lambda x: x[1]
-                ):
-                    self.copy_in(source_path=src_in, destination_dir=dst_in)
+                if self._persistent:
+                    # copy-in hook
+                    session_copy_in = self.get_session_copy_in(copy_in)
+                    if session_copy_in:
+                        await asyncio.to_thread(
+                            self._put_archive, session_copy_in
+                        )
+                        for src, dst in session_copy_in:
+                            self.add_session_file(src, dst)
 
-                self.log.debug(
-                    f"Using executor {self._container_client}:{self.container.short_id} to run '{final_cmd}'."
-                )
+                    self.log.debug(
+                        f"Using executor {self._container_client}:{self.container.short_id} to run '{final_cmd}'."
+                    )
+                    rc = await self._exec_async(
+                        final_cmd, environment=environment
+                    )
+                else:
+                    container_cmd = ["bash", "-c", final_cmd]
 
-                # FIXME: Use attach method when podman-py will implement.
-                #  It is for starting and streaming output directly with python.
-                cmd = [
-                    self._container_client,
-                    "start",
-                    "--attach",
-                    self.container.id,
-                ]
-                rc = self.execute(cmd)
+                    # FIXME: Ensure podman client can parse non str value
+                    #  https://github.com/containers/podman/issues/11984
+                    if self._container_client == "podman":
+                        for k, v in environment.copy().items():
+                            environment[k] = str(v)
+                    self.container = await asyncio.to_thread(
+                        client.containers.create,
+                        client.images.get(self._attrs["Id"]),
+                        container_cmd,
+                        privileged=True,
+                        environment=environment,
+                        mounts=mounts,
+                        init=True,
+                    )
+                    # Builder directory is given to the executor user
+                    # before running commands, its parents are untouched
+                    self._directories = set(self.get_builder_dir().parents)
+
+                    # copy-in hook
+                    if copy_in:
+                        await asyncio.to_thread(
+                            self._put_archive,
+                            sorted(set(copy_in), key=lambda x: x[1]),
+                        )
+
+                    self.log.debug(
+                        f"Using executor {self._container_client}:{self.container.short_id} to run '{final_cmd}'."
+                    )
+
+                    # FIXME: Use attach method when podman-py will implement.
+                    #  It is for starting and streaming output directly with python.
+                    start_cmd = [
+                        self._container_client,
+                        "start",
+                        "--attach",
+                        self.container.id,
+                    ]
+                    rc = await self.execute_async(start_cmd)
                 if rc != 0:
                     msg = f"Failed to run '{final_cmd}' (status={rc})."
                     raise ExecutorError(msg, name=self.container.id)
@@ -249,10 +637,14 @@ class ContainerExecutor(Executor):
                     set(copy_out or []), key=lambda x: x[1]
                 ):
                     try:
-                        self.copy_out(
+                        await asyncio.to_thread(
+                            self.copy_out,
                             source_path=src_out,
                             destination_dir=dst_out,
                         )
+                        self.add_session_file(
+                            dst_out / src_out.name, src_out.parent
+                        )
                     except ExecutorError as e:
                         # Ignore copy-out failure if requested
                         if isinstance(
@@ -269,9 +661,76 @@ class ContainerExecutor(Executor):
                             continue
                         raise e
         except ExecutorError as e:
+            self._failed = True
             if self.container and self._clean_on_error:
-                self.cleanup()
+                await asyncio.to_thread(self.cleanup)
             raise e
         else:
-            if self.container and self._clean:
-                self.cleanup()
+            if self.container and self._clean and not self._in_session:
+                await asyncio.to_thread(self.cleanup)
+
+
+class ContainerPool:
+    """
+    Keep idle persistent containers of a given image and distribution,
+    ready to be taken by ContainerExecutor.
+
+    Containers are given back after each job once they have been reset.
+    Idle ones are removed when the builder exits.
+    """
+
+    _pools: Dict[Hashable, "ContainerPool"] = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(self, name: str):
+        self.log = QubesBuilderLogger.getChild(f"container-pool.{name}")
+        self._idle: List = []
+        self._stopped = False
+        self._lock = threading.Lock()
+        atexit.register(self.shutdown)
+
+    @classmethod
+    def get(cls, key: Hashable, name: str) -> "ContainerPool":
+        with cls._pools_lock:
+            pool = cls._pools.get(key, None)
+            if not pool:
+                pool = cls(name)
+                cls._pools[key] = pool
+            return pool
+
+    def acquire(self):
+        """
+        Take an idle and still running container if one is available.
+        """
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                container = self._idle.pop()
+            try:
+                container.reload()
+                if container.status == "running":
+                    return container
+            except (PodmanError, DockerException) as e:
+                self.log.debug(f"Cannot reuse {container.id}: {str(e)}")
+            self.remove(container)
+
+    def release(self, container):
+        with self._lock:
+            if not self._stopped:
+                self._idle.append(container)
+                return
+        self.remove(container)
+
+    def remove(self, container):
+        try:
+            container.remove(force=True)
+        except (PodmanError, DockerException) as e:
+            self.log.warning(f"Failed to remove {container.id}: {str(e)}")
+
+    def shutdown(self):
+        with self._lock:
+            self._stopped = True
+            idle, self._idle = self._idle, []
+        for container in idle:
+            self.remove(container)
@@ -16,6 +16,9 @@
 # with this program. If not, see <https://www.gnu.org/licenses/>.
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
+import asyncio
+import fcntl
+import functools
 import getpass
 import grp
 import os
@@ -26,14 +29,74 @@ import uuid
 from pathlib import Path
 from typing import List, Tuple
 
+from qubesbuilder.common import remove_file
 from qubesbuilder.executors import Executor, ExecutorError
 
+# ioctl sharing the extents of a file with another one (reflink), supported
+# by btrfs, xfs and some other filesystems.
+FICLONE = 0x40049409
+
+
+def copy_file(src, dst, follow_symlinks=True, hardlink=False):
+    """
+    Copy a file with its metadata, as cheaply as possible.
+
+    The file is reflinked if the filesystem supports it. Otherwise, with
+    hardlink, read-only files are hardlinked and others are copied in kernel
+    with copy_file_range, falling back to a regular copy. Hardlinks must not
+    be used for files going into a cage, as they would share their inode
+    with host files, like the ones of the artifacts store. Destination is
+    replaced if it exists. This can be used as copy function of
+    shutil.copytree.
+    """
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    remove_file(dst)
+    if not follow_symlinks and os.path.islink(src):
+        os.symlink(os.readlink(src), dst)
+        return dst
+
+    st = os.stat(src)
+    with open(src, "rb") as fsrc:
+        with open(dst, "wb") as fdst:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                cloned = True
+            except OSError:
+                cloned = False
+        if not cloned and hardlink and not st.st_mode & 0o222:
+            try:
+                os.unlink(dst)
+                os.link(src, dst)
+                return dst
+            except OSError:
+                pass
+        if not cloned:
+            with open(dst, "wb") as fdst:
+                try:
+                    while os.copy_file_range(
+                        fsrc.fileno(), fdst.fileno(), 1 << 30
+                    ):
+                        pass
+                except OSError:
+                    # Not supported, for example across filesystems on old
+                    # kernels.
+                    fsrc.seek(0)
+                    fdst.seek(0)
+                    fdst.truncate()
+                    shutil.copyfileobj(fsrc, fdst)
+    shutil.copystat(src, dst)
+    return dst
+
 
 class LocalExecutor(Executor):
     """
     Local executor
     """
 
+    supports_session = True
+    supports_mount_in = True
+
     def __init__(
         self,
         directory: Path = Path("/tmp"),
@@ -63,23 +126,36 @@ class LocalExecutor(Executor):
     def copy_in(self, source_path: Path, destination_dir: Path, action="copy-in"):  # type: ignore
         src = source_path.resolve()
         dst = destination_dir.resolve()
+        # Files copied out of the cage are not used by it anymore
+        copy_function = functools.partial(
+            copy_file, hardlink=action == "copy-out"
+        )
         try:
             if src.is_dir():
                 dst = dst / src.name
                 if dst.exists():
                     shutil.rmtree(str(dst))
-                shutil.copytree(str(src), str(dst), symlinks=True)
+                shutil.copytree(
+                    str(src),
+                    str(dst),
+                    symlinks=True,
+                    copy_function=copy_function,
+                )
             else:
                 dst.mkdir(parents=True, exist_ok=True)
-                shutil.copy2(str(src), str(dst))
+                copy_function(str(src), str(dst))
         except (shutil.Error, FileExistsError, FileNotFoundError) as e:
             msg = f"Failed to {action}: {e!s}"
             raise ExecutorError(msg) from e
 
     def copy_out(self, source_path: Path, destination_dir: Path):  # type: ignore
+        remove_file(destination_dir / source_path.name)
         self.copy_in(source_path, destination_dir, action="copy-out")
 
     def cleanup(self):
+        self._session_files.clear()
+        if not self._temporary_dir.exists():
+            return
         try:
             shutil.rmtree(self._temporary_dir)
         except PermissionError:
@@ -113,6 +189,31 @@ class LocalExecutor(Executor):
         files_inside_executor_with_placeholders: List[Path] = None,
         environment=None,
         no_fail_copy_out_allowed_patterns=None,
+        mount_in: List[Tuple[Path, Path]] = None,
+        **kwargs,
+    ):
+        return self._run_coroutine(
+            self.run_async(
+                cmd,
+                copy_in=copy_in,
+                copy_out=copy_out,
+                files_inside_executor_with_placeholders=files_inside_executor_with_placeholders,
+                environment=environment,
+                no_fail_copy_out_allowed_patterns=no_fail_copy_out_allowed_patterns,
+                mount_in=mount_in,
+                **kwargs,
+            )
+        )
+
+    async def run_async(  # type: ignore
+        self,
+        cmd: List[str],
+        copy_in: List[Tuple[Path, Path]] = None,
+        copy_out: List[Tuple[Path, Path]] = None,
+        files_inside_executor_with_placeholders: List[Path] = None,
+        environment=None,
+        no_fail_copy_out_allowed_patterns=None,
+        mount_in: List[Tuple[Path, Path]] = None,
         **kwargs,
     ):
         # Create temporary builder directory. In an unlikely case of conflict,
@@ -129,11 +230,13 @@ class LocalExecutor(Executor):
 
         try:
             # copy-in hook
-            for src, dst in sorted(set(copy_in or []), key=lambda x: x[1]):
-                self.copy_in(
+            for src, dst in self.get_session_copy_in(copy_in):
+                await asyncio.to_thread(
+                    self.copy_in,
                     source_path=src,
-                    destination_dir=dst,
+                    destination_dir=Path(dst),
                 )
+                self.add_session_file(src, dst)
 
             # replace placeholders
             sed_cmd = ""
@@ -146,10 +249,20 @@ class LocalExecutor(Executor):
                 ]
                 sed_cmd = f"sed -i 's#@BUILDER_DIR@#{self.get_builder_dir()}#g' {' '.join(files)};"
 
+            # read-only inputs are mounted with an overlay instead of copied
+            mount_cmd = []
+            if mount_in:
+                mount_in = sorted(set(mount_in), key=lambda x: x[1])
+                mount_cmd = self.get_mount_in_cmd(
+                    mount_in,
+                    [src.resolve() for src, _ in mount_in],
+                    self._temporary_dir / "overlays",
+                )
+
             final_cmd = [
                 "bash",
                 "-c",
-                sed_cmd + "&&".join(cmd),
+                sed_cmd + "&&".join(mount_cmd + cmd),
             ]
 
             self.log.debug(
@@ -162,7 +275,7 @@ class LocalExecutor(Executor):
                 environment_new.update(environment)
                 environment = environment_new
 
-            rc = self.execute(final_cmd, env=environment)
+            rc = await self.execute_async(final_cmd, env=environment)
             if rc != 0:
                 msg = f"Failed to run '{final_cmd}' (status={rc})."
                 raise ExecutorError(msg)
@@ -170,7 +283,10 @@ class LocalExecutor(Executor):
             # copy-out hook
             for src, dst in sorted(set(copy_out or []), key=lambda x: x[1]):
                 try:
-                    self.copy_out(source_path=src, destination_dir=dst)
+                    await asyncio.to_thread(
+                        self.copy_out, source_path=src, destination_dir=dst
+                    )
+                    self.add_session_file(dst / src.name, src.parent)
                 except ExecutorError as e:
                     # Ignore copy-out failure if requested
                     if isinstance(
@@ -188,8 +304,12 @@ class LocalExecutor(Executor):
                     raise e
         except ExecutorError as e:
             if self._temporary_dir.exists() and self._clean_on_error:
-                self.cleanup()
+                await asyncio.to_thread(self.cleanup)
             raise e
         else:
-            if self._temporary_dir.exists() and self._clean:
-                self.cleanup()
+            if (
+                self._temporary_dir.exists()
+                and self._clean
+                and not self._in_session
+            ):
+                await asyncio.to_thread(self.cleanup)
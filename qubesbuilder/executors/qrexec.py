@@ -24,6 +24,8 @@ from typing import List, Optional
 from qubesbuilder.common import sanitize_line
 from qubesbuilder.executors import Executor, ExecutorError
 
+QREXEC_CLIENT = "/usr/lib/qubes/qrexec-client-vm"
+
 
 def qrexec_call(
     executor: Executor,
@@ -36,9 +38,7 @@ def qrexec_call(
     echo: bool = True,
     ignore_errors: bool = False,
 ) -> bytes:
-    cmd = [
-        "/usr/lib/qubes/qrexec-client-vm",
-    ]
+    cmd = [QREXEC_CLIENT]
 
     if options:
         cmd += options
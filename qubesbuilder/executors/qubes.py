@@ -17,18 +17,30 @@
 # with this program. If not, see <https://www.gnu.org/licenses/>.
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
+import asyncio
+import atexit
+import json
 import os
 import re
 import shutil
 import subprocess
+import tarfile
+import tempfile
+import threading
+from contextlib import contextmanager
 from pathlib import Path, PurePath
 from shlex import quote
-from time import sleep
-from typing import List, Optional, Tuple, Union
-
-from qubesbuilder.common import sanitize_line, PROJECT_PATH
-from qubesbuilder.executors import Executor, ExecutorError
+from time import sleep, time
+from typing import Dict, List, Optional, Tuple, Union
+
+from qubesbuilder.common import sanitize_line, str_to_bool, PROJECT_PATH
+from qubesbuilder.executors import (
+    Executor,
+    ExecutorError,
+    extract_indexed_archive,
+)
 from qubesbuilder.executors.qrexec import (
+    QREXEC_CLIENT,
     create_dispvm,
     kill_vm,
     qrexec_call,
@@ -37,6 +49,7 @@ from qubesbuilder.executors.qrexec import (
     vm_state,
 )
 from qubesbuilder.executors.windows import BaseWindowsExecutor
+from qubesbuilder.log import QubesBuilderLogger
 
 
 # From https://github.com/QubesOS/qubes-core-admin-client/blob/main/qubesadmin/utils.py#L159-L173
@@ -80,6 +93,11 @@ class QubesExecutor(Executor):
         self.dispvm: Optional[str] = None  # actual dispvm name
         self.copy_in_service = "qubesbuilder.FileCopyIn"
         self.copy_out_service = "qubesbuilder.FileCopyOut"
+        # Services streaming a zstd compressed and sparse tar archive, for
+        # several files at once
+        self.archive_copy_in_service = "qubesbuilder.ArchiveCopyIn"
+        self.archive_copy_out_service = "qubesbuilder.ArchiveCopyOut"
+        self._compressed_copy = False
 
     def get_user(self):
         return "user"
@@ -87,10 +105,193 @@ class QubesExecutor(Executor):
     def get_group(self):
         return "user"
 
+    @contextmanager
+    def _pipeline(
+        self,
+        what: str,
+        cmds: List[List[str]],
+        input: Optional[bytes] = None,
+        output=False,
+    ):
+        """
+        Run commands with the output of each one given to the next one.
+
+        Input is given to the first command. Yields the output of the last
+        command if requested.
+        """
+        with tempfile.TemporaryFile() as stderr:
+            processes: List[subprocess.Popen] = []
+            try:
+                for cmd in cmds:
+                    last = len(processes) == len(cmds) - 1
+                    processes.append(
+                        subprocess.Popen(
+                            cmd,
+                            stdin=(
+                                processes[-1].stdout
+                                if processes
+                                else (
+                                    subprocess.PIPE
+                                    if input is not None
+                                    else subprocess.DEVNULL
+                                )
+                            ),
+                            stdout=(
+                                subprocess.PIPE
+                                if output or not last
+                                else subprocess.DEVNULL
+                            ),
+                            stderr=stderr,
+                        )
+                    )
+                    if len(processes) > 1:
+                        processes[-2].stdout.close()  # type: ignore
+            except OSError as e:
+                for process in processes:
+                    process.kill()
+                    process.wait()
+                raise ExecutorError(f"Failed to {what}: {str(e)}") from e
+            try:
+                if input is not None:
+                    assert processes[0].stdin
+                    with processes[0].stdin:
+                        processes[0].stdin.write(input)
+                yield processes[-1].stdout
+            finally:
+                if processes[-1].stdout:
+                    processes[-1].stdout.close()
+                status = [process.wait() for process in processes]
+            if any(status):
+                stderr.seek(0)
+                content = sanitize_line(stderr.read().rstrip(b"\n")).rstrip()
+                msg = f"Failed to {what}: {content} (status={status})."
+                raise ExecutorError(msg, name=self.dispvm)
+
+    def _archive_copy_in(self, copy_in: List[Tuple[Path, PurePath]]):
+        """
+        Copy every (source, destination directory) pair into the disposable
+        qube with a single qrexec call.
+
+        The archive starts with a manifest listing destination paths. The
+        source of the n-th destination is under the 'n' directory.
+        """
+        assert self.dispvm
+        self.log.debug(
+            f"copy-in (archive): {', '.join(f'{s} -> {d}' for s, d in copy_in)}"
+        )
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Each source is archived through a symlink to its parent
+            # directory named after its index. Hardlinks are archived as
+            # files, as sources are extracted in different places.
+            manifest = []
+            names = ["MANIFEST"]
+            for index, (src, dst) in enumerate(copy_in):
+                src = Path(src).expanduser().resolve()
+                os.symlink(src.parent, Path(tmp_dir) / str(index))
+                manifest.append((dst / src.name).as_posix())
+                names.append(f"{index}/{src.name}")
+            (Path(tmp_dir) / "MANIFEST").write_text(json.dumps(manifest))
+            (Path(tmp_dir) / "FILES").write_text("\0".join(names))
+            with self._pipeline(
+                "copy-in",
+                [
+                    [
+                        "tar",
+                        "--sparse",
+                        "--hard-dereference",
+                        "-C",
+                        tmp_dir,
+                        "--null",
+                        "-T",
+                        str(Path(tmp_dir) / "FILES"),
+                        "-cf",
+                        "-",
+                    ],
+                    ["zstd", "-q", "-T0", "-c"],
+                    [
+                        QREXEC_CLIENT,
+                        "--",
+                        self.dispvm,
+                        self.archive_copy_in_service,
+                    ],
+                ],
+            ):
+                pass
+
+    def _archive_copy_out(
+        self, copy_out: List[Tuple[PurePath, Path]], dig_holes=False
+    ) -> List[Tuple[PurePath, Path]]:
+        """
+        Copy every (source, destination directory) pair out of the
+        disposable qube with a single qrexec call.
+
+        The list of sources is sent to the service, which answers with an
+        archive having the n-th source under the 'n' directory. Missing
+        sources are skipped and returned.
+        """
+        assert self.dispvm
+        self.log.debug(
+            f"copy-out (archive): {', '.join(f'{s} -> {d}' for s, d in copy_out)}"
+        )
+        with self._pipeline(
+            "copy-out",
+            [
+                [
+                    QREXEC_CLIENT,
+                    "--",
+                    self.dispvm,
+                    self.archive_copy_out_service,
+                ],
+                ["zstd", "-q", "-d", "-c"],
+            ],
+            input=json.dumps([str(src) for src, _ in copy_out]).encode(),
+            output=True,
+        ) as stream:
+            try:
+                with tarfile.open(fileobj=stream, mode="r|") as tar:
+                    copied = extract_indexed_archive(
+                        tar, copy_out, name=self.dispvm
+                    )
+            except (tarfile.TarError, OSError) as e:
+                msg = f"Failed to copy-out: {str(e)}"
+                raise ExecutorError(msg, name=self.dispvm) from e
+
+        if dig_holes:
+            for src, dst in (copy_out[i] for i in sorted(copied)):
+                self._dig_holes(dst.resolve() / src.name)
+        return [pair for i, pair in enumerate(copy_out) if i not in copied]
+
+    @staticmethod
+    def _remove_destination(dst_path: Path):
+        if os.path.exists(dst_path):
+            if dst_path.is_dir():
+                shutil.rmtree(dst_path)
+            else:
+                os.remove(dst_path)
+
+    def _dig_holes(self, dst_path: Path):
+        if dst_path.is_dir():
+            return
+        try:
+            self.log.debug("copy-out (detect zeroes and replace with holes)")
+            subprocess.run(
+                ["/usr/bin/fallocate", "-d", str(dst_path)], check=True
+            )
+        except subprocess.CalledProcessError as e:
+            if e.stderr is not None:
+                content = sanitize_line(e.stderr.rstrip(b"\n")).rstrip()
+            else:
+                content = str(e)
+            msg = f"Failed to dig holes in copy-out: {content}"
+            raise ExecutorError(msg, name=self.dispvm)
+
     def copy_in(self, source_path: Path, destination_dir: PurePath, ignore_symlinks: bool = False):  # type: ignore
         assert self.dispvm
         src = source_path.expanduser().resolve()
         dst = destination_dir
+        if self._compressed_copy and not ignore_symlinks:
+            self._archive_copy_in([(src, dst)])
+            return
         encoded_dst_path = encode_for_vmexec(str((dst / src.name).as_posix()))
 
         args = ["/usr/lib/qubes/qfile-agent"]
@@ -116,13 +317,17 @@ class QubesExecutor(Executor):
         src = source_path
         dst = destination_dir.resolve()
 
+        if self._compressed_copy:
+            if self._archive_copy_out([(src, dst)], dig_holes=dig_holes):
+                raise ExecutorError(
+                    f"Failed to copy-out: cannot find '{src}'.",
+                    name=self.dispvm,
+                )
+            return
+
         # Remove local file or directory if exists
         dst_path = dst / src.name
-        if os.path.exists(dst_path):
-            if dst_path.is_dir():
-                shutil.rmtree(dst / src.name)
-            else:
-                os.remove(dst_path)
+        self._remove_destination(dst_path)
 
         dst.mkdir(parents=True, exist_ok=True)
 
@@ -145,21 +350,8 @@ class QubesExecutor(Executor):
             ],
         )
 
-        if dig_holes and not dst_path.is_dir():
-            try:
-                self.log.debug(
-                    "copy-out (detect zeroes and replace with holes)"
-                )
-                subprocess.run(
-                    ["/usr/bin/fallocate", "-d", str(dst_path)], check=True
-                )
-            except subprocess.CalledProcessError as e:
-                if e.stderr is not None:
-                    content = sanitize_line(e.stderr.rstrip(b"\n")).rstrip()
-                else:
-                    content = str(e)
-                msg = f"Failed to dig holes in copy-out: {content}"
-                raise ExecutorError(msg, name=self.dispvm)
+        if dig_holes:
+            self._dig_holes(dst_path)
 
     def copy_rpc_services(self):
         assert self.dispvm
@@ -172,11 +364,14 @@ class QubesExecutor(Executor):
                 "/usr/lib/qubes/qfile-agent",
                 str(PROJECT_PATH / "rpc" / self.copy_in_service),
                 str(PROJECT_PATH / "rpc" / self.copy_out_service),
+                str(PROJECT_PATH / "rpc" / self.archive_copy_in_service),
+                str(PROJECT_PATH / "rpc" / self.archive_copy_out_service),
             ],
             options=["--filter-escape-chars-stderr"],
         )
 
     def cleanup(self):
+        self._session_files.clear()
         if self.dispvm is None:
             return
 
@@ -186,13 +381,111 @@ class QubesExecutor(Executor):
             kill_vm(self, self.dispvm)
         else:
             remove_vm(self, self.dispvm)
+        self.dispvm = None
 
 
 class LinuxQubesExecutor(QubesExecutor):
+    supports_session = True
+
     def __init__(
-        self, dispvm: str = "dom0", clean: Union[str, bool] = True, **kwargs
+        self,
+        dispvm: str = "dom0",
+        clean: Union[str, bool] = True,
+        warm_pool: Union[str, int] = 0,
+        compressed_copy: Union[str, bool] = False,
+        **kwargs,
     ):
         super().__init__(dispvm=dispvm, clean=clean, **kwargs)
+        self._compressed_copy = (
+            compressed_copy
+            if isinstance(compressed_copy, bool)
+            else str_to_bool(compressed_copy)
+        )
+        # The pool is started on first run, see get_pool()
+        self._warm_pool = int(warm_pool)
+        self._pool: Optional[DispVMPool] = None
+
+    def get_pool(self) -> Optional["DispVMPool"]:
+        """
+        Returns the pool of disposable qubes of the template, if enabled.
+        """
+        if self._warm_pool > 0 and not self._pool:
+            self._pool = DispVMPool.get(self._dispvm_template, self._warm_pool)
+        return self._pool
+
+    def _prepare_dispvm(self):
+        """
+        Create and start a disposable qube, and install builder RPC
+        services into it.
+        """
+        self.dispvm = create_dispvm(self, self._dispvm_template)
+        start_vm(self, self.dispvm)
+        self.copy_rpc_services()
+
+        assert self.dispvm
+        services = [
+            self.copy_in_service,
+            self.copy_out_service,
+            self.archive_copy_in_service,
+            self.archive_copy_out_service,
+        ]
+        prep_cmd = build_run_cmd_and_list(
+            self.dispvm,
+            [
+                [
+                    "sudo",
+                    "mkdir",
+                    "-p",
+                    "--",
+                    str(self.get_builder_dir()),
+                    str(self.get_builder_dir() / "build"),
+                    str(self.get_builder_dir() / "plugins"),
+                    str(self.get_builder_dir() / "distfiles"),
+                    "/usr/local/etc/qubes-rpc",
+                ],
+                [
+                    "sudo",
+                    "mv",
+                    "-f",
+                    "--",
+                    *[
+                        f"/home/{self.get_user()}/QubesIncoming/{self.name}/{service}"
+                        for service in services
+                    ],
+                    "/usr/local/etc/qubes-rpc/",
+                ],
+                [
+                    "sudo",
+                    "chmod",
+                    "+x",
+                    "--",
+                    *[
+                        f"/usr/local/etc/qubes-rpc/{service}"
+                        for service in services
+                    ],
+                ],
+                [
+                    "sudo",
+                    "bash",
+                    "-c",
+                    "if [ -x /usr/sbin/restorecon ]; then restorecon -R /usr/local/etc/qubes-rpc/; fi;",
+                ],
+                [
+                    "sudo",
+                    "chown",
+                    "-R",
+                    "--",
+                    f"{self.get_user()}:{self.get_group()}",
+                    str(self.get_builder_dir()),
+                ],
+            ],
+        )
+        rc = subprocess.run(prep_cmd, stdin=subprocess.DEVNULL).returncode
+        if rc != 0:
+            raise ExecutorError(
+                f"Failed to prepare disposable qube (status={rc}).",
+                name=self.dispvm,
+            )
 
     def run(  # type: ignore
         self,
@@ -204,66 +497,51 @@ class LinuxQubesExecutor(QubesExecutor):
         no_fail_copy_out_allowed_patterns=None,
         dig_holes: bool = False,
     ):
-        try:
-            self.dispvm = create_dispvm(self, self._dispvm_template)
-            start_vm(self, self.dispvm)
-            self.copy_rpc_services()
+        return self._run_coroutine(
+            self.run_async(
+                cmd,
+                copy_in=copy_in,
+                copy_out=copy_out,
+                files_inside_executor_with_placeholders=files_inside_executor_with_placeholders,
+                environment=environment,
+                no_fail_copy_out_allowed_patterns=no_fail_copy_out_allowed_patterns,
+                dig_holes=dig_holes,
+            )
+        )
 
+    async def run_async(  # type: ignore
+        self,
+        cmd: List[str],
+        copy_in: List[Tuple[Path, PurePath]] = None,
+        copy_out: List[Tuple[PurePath, Path]] = None,
+        files_inside_executor_with_placeholders: List[Path] = None,
+        environment: dict = None,
+        no_fail_copy_out_allowed_patterns=None,
+        dig_holes: bool = False,
+    ):
+        try:
+            # Within a session, keep using the same disposable qube
+            if not (self._in_session and self.dispvm):
+                pool = self.get_pool()
+                self.dispvm = (
+                    await asyncio.to_thread(pool.acquire) if pool else None
+                )
+                if not self.dispvm:
+                    await asyncio.to_thread(self._prepare_dispvm)
             assert self.dispvm
-            prep_cmd = build_run_cmd_and_list(
-                self.dispvm,
-                [
-                    [
-                        "sudo",
-                        "mkdir",
-                        "-p",
-                        "--",
-                        str(self.get_builder_dir()),
-                        str(self.get_builder_dir() / "build"),
-                        str(self.get_builder_dir() / "plugins"),
-                        str(self.get_builder_dir() / "distfiles"),
-                        "/usr/local/etc/qubes-rpc",
-                    ],
-                    [
-                        "sudo",
-                        "mv",
-                        "-f",
-                        "--",
-                        f"/home/{self.get_user()}/QubesIncoming/{self.name}/qubesbuilder.FileCopyIn",
-                        f"/home/{self.get_user()}/QubesIncoming/{self.name}/qubesbuilder.FileCopyOut",
-                        "/usr/local/etc/qubes-rpc/",
-                    ],
-                    [
-                        "sudo",
-                        "chmod",
-                        "+x",
-                        "--",
-                        "/usr/local/etc/qubes-rpc/qubesbuilder.FileCopyIn",
-                        "/usr/local/etc/qubes-rpc/qubesbuilder.FileCopyOut",
-                    ],
-                    [
-                        "sudo",
-                        "bash",
-                        "-c",
-                        "if [ -x /usr/sbin/restorecon ]; then restorecon -R /usr/local/etc/qubes-rpc/; fi;",
-                    ],
-                    [
-                        "sudo",
-                        "chown",
-                        "-R",
-                        "--",
-                        f"{self.get_user()}:{self.get_group()}",
-                        str(self.get_builder_dir()),
-                    ],
-                ],
-            )
-            subprocess.run(prep_cmd, stdin=subprocess.DEVNULL)
 
             # copy-in hook
-            for src_in, dst_in in sorted(
-                set(copy_in or []), key=lambda x: x[1]
-            ):
-                self.copy_in(source_path=src_in, destination_dir=dst_in)
+            session_copy_in = self.get_session_copy_in(copy_in)
+            if self._compressed_copy and session_copy_in:
+                await asyncio.to_thread(self._archive_copy_in, session_copy_in)
+            for src_in, dst_in in session_copy_in:
+                if not self._compressed_copy:
+                    await asyncio.to_thread(
+                        self.copy_in,
+                        source_path=src_in,
+                        destination_dir=dst_in,
+                    )
+                self.add_session_file(src_in, dst_in)
 
             # replace placeholders
             if files_inside_executor_with_placeholders and isinstance(
@@ -294,7 +572,12 @@ class LinuxQubesExecutor(QubesExecutor):
                     ]
                     + files,
                 )
-                subprocess.run(sed_cmd, stdin=subprocess.DEVNULL, check=True)
+                await asyncio.to_thread(
+                    subprocess.run,
+                    sed_cmd,
+                    stdin=subprocess.DEVNULL,
+                    check=True,
+                )
 
             bash_env = []
             if environment:
@@ -321,20 +604,34 @@ class LinuxQubesExecutor(QubesExecutor):
             self.log.debug(" ".join(qvm_run_cmd))
 
             # stream output for command
-            rc = self.execute(qvm_run_cmd)
+            rc = await self.execute_async(qvm_run_cmd)
             if rc != 0:
                 msg = f"Failed to run '{' '.join(qvm_run_cmd)}' (status={rc})."
                 raise ExecutorError(msg, name=self.dispvm)
 
             # copy-out hook
-            for src_out, dst_out in sorted(
-                set(copy_out or []), key=lambda x: x[1]
-            ):
+            copy_out = sorted(set(copy_out or []), key=lambda x: x[1])
+            missing = []
+            if self._compressed_copy and copy_out:
+                missing = await asyncio.to_thread(
+                    self._archive_copy_out, copy_out, dig_holes=dig_holes
+                )
+            for src_out, dst_out in copy_out:
                 try:
-                    self.copy_out(
-                        source_path=src_out,
-                        destination_dir=dst_out,
-                        dig_holes=dig_holes,
+                    if not self._compressed_copy:
+                        await asyncio.to_thread(
+                            self.copy_out,
+                            source_path=src_out,
+                            destination_dir=dst_out,
+                            dig_holes=dig_holes,
+                        )
+                    elif (src_out, dst_out) in missing:
+                        raise ExecutorError(
+                            f"Failed to copy-out: cannot find '{src_out}'.",
+                            name=self.dispvm,
+                        )
+                    self.add_session_file(
+                        dst_out / src_out.name, src_out.parent
                     )
                 except ExecutorError as e:
                     # Ignore copy-out failure if requested
@@ -353,11 +650,145 @@ class LinuxQubesExecutor(QubesExecutor):
                     raise e
         except (subprocess.CalledProcessError, ExecutorError) as e:
             if self.dispvm and self._clean_on_error:
-                self.cleanup()
+                await asyncio.to_thread(self.cleanup)
             raise e
         else:
-            if self.dispvm and self._clean:
-                self.cleanup()
+            if self.dispvm and self._clean and not self._in_session:
+                await asyncio.to_thread(self.cleanup)
+
+
+# Maximum time to wait for disposable qubes being provisioned at exit
+DISPVM_POOL_SHUTDOWN_TIMEOUT = 60
+
+
+class DispVMPool:
+    """
+    Keep disposable qubes of a given template started and provisioned with
+    builder RPC services, ready to be taken by LinuxQubesExecutor.
+
+    Taken qubes are replaced in background. Remaining ones are killed
+    when the builder exits, once the ones being provisioned are done, for
+    at most DISPVM_POOL_SHUTDOWN_TIMEOUT seconds.
+    """
+
+    _pools: Dict[str, "DispVMPool"] = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(self, template: str, size: int):
+        self.template = template
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.log = QubesBuilderLogger.getChild(f"dispvm-pool.{template}")
+        self._ready: List[str] = []
+        self._provisioning = 0
+        self._threads: List[threading.Thread] = []
+        self._stopped = False
+        self._lock = threading.Lock()
+        atexit.register(self.shutdown)
+        self._refill()
+
+    @classmethod
+    def get(cls, template: str, size: int) -> "DispVMPool":
+        with cls._pools_lock:
+            pool = cls._pools.get(template, None)
+            if not pool:
+                pool = cls(template, size)
+                cls._pools[template] = pool
+            elif size > pool.size:
+                pool.size = size
+                pool._refill()
+            return pool
+
+    def _new_executor(self, dispvm: Optional[str] = None):
+        executor = LinuxQubesExecutor(dispvm=self.template)
+        executor.log = self.log
+        executor.dispvm = dispvm
+        return executor
+
+    def _provision(self):
+        executor = None
+        provisioned = False
+        try:
+            executor = self._new_executor()
+            executor._prepare_dispvm()
+            provisioned = True
+        except (subprocess.CalledProcessError, ExecutorError) as e:
+            self.log.warning(f"Failed to provision disposable qube: {e}")
+        finally:
+            with self._lock:
+                self._provisioning -= 1
+                if provisioned and executor and not self._stopped:
+                    self._ready.append(executor.dispvm)
+                    executor = None
+            # Qubes which failed to be provisioned, or which are not needed
+            # anymore, are discarded
+            if executor and executor.dispvm:
+                try:
+                    executor.cleanup()
+                except (subprocess.CalledProcessError, ExecutorError) as e:
+                    self.log.warning(f"Failed to clean {executor.dispvm}: {e}")
+
+    def _refill(self):
+        with self._lock:
+            if self._stopped:
+                return
+            missing = self.size - len(self._ready) - self._provisioning
+            self._provisioning += max(0, missing)
+            self._threads = [t for t in self._threads if t.is_alive()]
+            for _ in range(missing):
+                thread = threading.Thread(target=self._provision, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def acquire(self) -> Optional[str]:
+        """
+        Take a started and provisioned disposable qube if one is available.
+        """
+        dispvm = None
+        while not dispvm:
+            with self._lock:
+                if not self._ready:
+                    break
+                dispvm = self._ready.pop(0)
+            # It may have been shut down in the meantime.
+            executor = self._new_executor(dispvm)
+            try:
+                if vm_state(executor, dispvm) != "Running":
+                    executor.cleanup()
+                    dispvm = None
+            except ExecutorError:
+                dispvm = None
+        with self._lock:
+            if dispvm:
+                self.hits += 1
+            else:
+                self.misses += 1
+        self.log.debug(
+            f"{'hit' if dispvm else 'miss'} ({self.hits} hits, {self.misses} misses)"
+        )
+        self._refill()
+        return dispvm
+
+    def shutdown(self):
+        with self._lock:
+            self._stopped = True
+            threads = list(self._threads)
+        # Qubes being provisioned are cleaned by their thread
+        deadline = time() + DISPVM_POOL_SHUTDOWN_TIMEOUT
+        for thread in threads:
+            thread.join(max(0, deadline - time()))
+        with self._lock:
+            ready, self._ready = self._ready, []
+        for dispvm in ready:
+            try:
+                self._new_executor(dispvm).cleanup()
+            except ExecutorError as e:
+                self.log.warning(f"Failed to clean {dispvm}: {e}")
+        if self.hits or self.misses:
+            self.log.info(
+                f"Disposable qubes pool: {self.hits} hits, {self.misses} misses."
+            )
 
 
 class WindowsQubesExecutor(BaseWindowsExecutor, QubesExecutor):
@@ -0,0 +1,606 @@
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# Copyright (C) 2025 Frédéric Pierret (fepitre) <frederic@invisiblethingslab.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+import asyncio
+import getpass
+import hashlib
+import io
+import os
+import subprocess
+import tarfile
+import tempfile
+import threading
+import uuid
+from pathlib import Path, PurePath, PurePosixPath
+from shlex import quote
+from typing import Dict, List, Optional, Tuple, Union
+
+from qubesbuilder.common import (
+    get_cached_file_digest,
+    sanitize_line,
+    size_to_bytes,
+)
+from qubesbuilder.executors import (
+    Executor,
+    ExecutorError,
+    extract_indexed_archive,
+)
+
+SSH = "ssh"
+
+HOST_SELECTION_POLICIES = ("least-loaded", "sticky")
+
+
+class RemoteLinuxExecutor(Executor):
+    """
+    Executor running cages in temporary directories of remote Linux build
+    hosts over SSH.
+
+    Connections to a host are multiplexed over a master connection kept
+    alive between runs. Files are copied in and out as tar streams. Large
+    files copied in are also kept in a content-addressed cache on the
+    build host, so that they are sent only once. Least recently used files
+    of the cache are removed once it is bigger than 'cache-max-size'.
+    """
+
+    supports_session = True
+
+    # Number of runs of this process currently using each host
+    _host_usage: Dict[str, int] = {}
+    _lock = threading.Lock()
+
+    def __init__(
+        self,
+        hosts: List[str],
+        directory: str = "/tmp",
+        cache_dir: Optional[str] = None,
+        cache_min_size: Union[int, str] = "1M",
+        cache_max_size: Union[int, str] = "10G",
+        host_selection: str = "least-loaded",
+        ssh_key_path: Optional[str] = None,
+        ssh_options: Optional[List[str]] = None,
+        control_persist: str = "10m",
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        if isinstance(hosts, str):
+            hosts = [hosts]
+        if not hosts:
+            raise ExecutorError("No remote host provided.")
+        if host_selection not in HOST_SELECTION_POLICIES:
+            raise ExecutorError(
+                f"Unknown host selection policy '{host_selection}'."
+            )
+        self._hosts = list(hosts)
+        self._host_selection = host_selection
+        self._directory = PurePosixPath(directory)
+        # Relative to the home directory of the user on build hosts
+        self._cache_dir = PurePosixPath(cache_dir or ".cache/qubes-builder")
+        self._cache_min_size = size_to_bytes(cache_min_size)
+        self._cache_max_size = size_to_bytes(cache_max_size)
+        self._ssh_key_path = ssh_key_path
+        self._ssh_options = ssh_options or []
+        self._control_persist = control_persist
+
+        self._temporary_dir = self._directory / str(uuid.uuid4())
+        self._builder_dir = self._temporary_dir / "builder"  # type: ignore
+        self.host: Optional[str] = None
+        self._host_acquired = False
+
+    def get_user(self):
+        return self._kwargs.get("user", getpass.getuser())
+
+    def get_group(self):
+        return self._kwargs.get("group", self.get_user())
+
+    @staticmethod
+    def get_control_dir() -> Path:
+        control_dir = Path(tempfile.gettempdir()) / f"qb-ssh-{os.getuid()}"
+        control_dir.mkdir(mode=0o700, exist_ok=True)
+        return control_dir
+
+    def get_ssh_cmd(self, host: str, cmd: List[str]) -> List[str]:
+        """
+        Returns the command running cmd on host. Connections share a master
+        connection which stays open for 'control-persist' after last use.
+        """
+        ssh_cmd = [
+            SSH,
+            "-o",
+            "BatchMode=yes",
+            "-o",
+            "ConnectTimeout=60",
+            "-o",
+            "ServerAliveInterval=30",
+            "-o",
+            "ControlMaster=auto",
+            "-o",
+            f"ControlPath={self.get_control_dir()}/%C",
+            "-o",
+            f"ControlPersist={self._control_persist}",
+        ]
+        if self._ssh_key_path:
+            ssh_cmd += ["-i", str(Path(self._ssh_key_path).expanduser())]
+        for option in self._ssh_options:
+            ssh_cmd += ["-o", option]
+        ssh_cmd += ["-l", self.get_user(), "--", host, " ".join(cmd)]
+        return ssh_cmd
+
+    def _ssh(
+        self, what: str, host: str, script: str, input: bytes = None
+    ) -> bytes:
+        """
+        Run a bash script on host and return its output.
+        """
+        try:
+            proc = subprocess.run(
+                self.get_ssh_cmd(host, ["bash", "-c", quote(script)]),
+                input=input,
+                stdin=None if input is not None else subprocess.DEVNULL,
+                capture_output=True,
+            )
+        except OSError as e:
+            raise ExecutorError(f"Failed to {what}: {str(e)}") from e
+        if proc.returncode != 0:
+            content = sanitize_line(proc.stderr.rstrip(b"\n")).rstrip()
+            msg = f"Failed to {what}: {content} (status={proc.returncode})."
+            raise ExecutorError(msg, name=host)
+        return proc.stdout
+
+    def get_host_load(self, host: str) -> Optional[float]:
+        """
+        Returns load average of host per CPU, counting runs of this process
+        not yet reflected by it. None is returned if host is not reachable.
+        """
+        try:
+            output = self._ssh(
+                "get host load", host, "nproc && cat /proc/loadavg"
+            )
+            cpus, load = output.decode().split()[:2]
+        except (ExecutorError, ValueError) as e:
+            self.log.warning(f"Cannot use host '{host}': {str(e)}")
+            return None
+        with self._lock:
+            usage = self._host_usage.get(host, 0)
+        return (float(load) + usage) / max(1, int(cpus))
+
+    def select_host(self, key: Optional[str] = None) -> str:
+        """
+        Select the host to run on.
+
+        With 'sticky' policy, a given key (e.g. the distribution) is always
+        run on the same host as long as it is reachable, so that its caches
+        stay warm. Hosts are ranked by rendezvous hashing: adding or removing
+        a host only moves the keys of that host. Otherwise, and without key,
+        the least loaded host is used.
+        """
+        if self._host_selection == "sticky" and key:
+            hosts = sorted(
+                self._hosts,
+                key=lambda h: hashlib.sha256(f"{key}:{h}".encode()).digest(),
+                reverse=True,
+            )
+            for host in hosts:
+                if self.get_host_load(host) is not None:
+                    return host
+        else:
+            loads = {}
+            for host in self._hosts:
+                load = self.get_host_load(host)
+                if load is not None:
+                    loads[host] = load
+            if loads:
+                return min(loads, key=lambda h: loads[h])
+        raise ExecutorError(f"No remote host available among {self._hosts}.")
+
+    def _acquire_host(self, key: Optional[str] = None) -> str:
+        host = self.select_host(key)
+        with self._lock:
+            self._host_usage[host] = self._host_usage.get(host, 0) + 1
+        self.host = host
+        self._host_acquired = True
+        return host
+
+    def _release_host(self):
+        if not self._host_acquired:
+            return
+        with self._lock:
+            self._host_usage[self.host] -= 1  # type: ignore
+        self._host_acquired = False
+
+    def _get_missing_digests(self, digests: List[str]) -> List[str]:
+        """
+        Returns digests of files not in the cache of the host. Files of the
+        cache not matching their digest are removed and returned too.
+        """
+        assert self.host
+        output = self._ssh(
+            "query remote cache",
+            self.host,
+            f"cache={quote(str(self._cache_dir))}\n"
+            "while IFS= read -r digest; do\n"
+            '    if [ -e "$cache/$digest" ] && printf "%s  %s\\n" '
+            '"$digest" "$cache/$digest" | sha256sum -c --status; then\n'
+            "        continue\n"
+            "    fi\n"
+            '    rm -f -- "$cache/$digest"\n'
+            '    printf "%s\\n" "$digest"\n'
+            "done",
+            input="".join(f"{d}\n" for d in digests).encode(),
+        )
+        return output.decode().split()
+
+    def _archive_copy_in(self, copy_in: List[Tuple[Path, PurePath]]):
+        """
+        Copy every (source, destination directory) pair to the host with a
+        single tar stream.
+
+        The source of the n-th pair is under the 'n' directory. Regular files
+        bigger than 'cache-min-size' are not sent as part of it: they are
+        copied from the cache of the host, where the ones not already there
+        are added under their sha256 digest. Files of the cache are touched
+        when used, and the least recently used ones are removed once it is
+        bigger than 'cache-max-size', keeping the ones used within the last
+        hour as other runs may be about to use them.
+        """
+        assert self.host
+        self.log.debug(
+            f"copy-in (archive): {', '.join(f'{s} -> {d}' for s, d in copy_in)}"
+        )
+        # (digest, mode, modification time, destination) of cached files
+        links: List[Tuple[str, int, float, PurePath]] = []
+        blobs: Dict[str, Path] = {}
+        script = [
+            "set -e",
+            f"cache={quote(str(self._cache_dir))}",
+            f'mkdir -p -- {quote(str(self._directory))} "$cache"',
+            f"tmp=$(mktemp -d -p {quote(str(self._directory))})",
+            "trap 'rm -rf -- \"$tmp\"' EXIT",
+            'tar -x --no-same-owner -C "$tmp"',
+            # Add new blobs to the cache. Linking is atomic, in case another
+            # run is adding the same blob.
+            'for blob in "$tmp"/.blobs/*; do',
+            '    [ -e "$blob" ] || continue',
+            '    digest="${blob##*/}"',
+            '    ln -- "$blob" "$cache/$digest" 2>/dev/null || '
+            '[ -e "$cache/$digest" ] || {',
+            '        cp -- "$blob" "$cache/.$digest.$$"',
+            '        mv -f -- "$cache/.$digest.$$" "$cache/$digest"',
+            "    }",
+            "done",
+        ]
+        for index, (src, dst) in enumerate(copy_in):
+            src = Path(src).expanduser().resolve()
+            dst_path = quote(str(dst / src.name))
+            member = f'"$tmp"/{index}/{quote(src.name)}'
+            script += [
+                f"rm -rf -- {dst_path}",
+                f"mkdir -p -- {quote(str(dst))}",
+                f"if [ -e {member} ] || [ -L {member} ]; then",
+                f"    mv -- {member} {dst_path}",
+                "fi",
+            ]
+        script += [
+            '[ -e "$tmp/.links" ] || exit 0',
+            "while IFS= read -r -d '' digest && IFS= read -r -d '' mode &&",
+            "        IFS= read -r -d '' mtime && IFS= read -r -d '' path; do",
+            '    cp --reflink=auto -- "$cache/$digest" "$path"',
+            '    chmod "$mode" -- "$path"',
+            '    touch -m -d "@$mtime" -- "$path"',
+            '    touch -c -- "$cache/$digest"',
+            'done < "$tmp/.links"',
+            'cd -- "$cache"',
+            "find . -maxdepth 1 -type f -regex './[0-9a-f]*' "
+            "-printf '%T@ %s %f\\n' | sort -n | "
+            f'awk -v max={self._cache_max_size} -v now="$(date +%s)" '
+            "'{ total += $2; t[NR] = $1; s[NR] = $2; f[NR] = $3 } "
+            "END { for (i = 1; i <= NR && total > max; i++) "
+            "if (now - t[i] > 3600) { print f[i]; total -= s[i] } }' | "
+            "xargs -r rm -f --",
+        ]
+
+        def get_filter(src: Path, dst: PurePath):
+            def divert(tarinfo: tarfile.TarInfo):
+                # Hardlinks are looked at too, as the file they link to may
+                # have been diverted.
+                if not (tarinfo.isreg() or tarinfo.islnk()):
+                    return tarinfo
+                name = tarinfo.name.partition("/")[2]
+                path = src.parent / name
+                if path.stat().st_size < self._cache_min_size:
+                    return tarinfo
+                digest = get_cached_file_digest(path)
+                blobs.setdefault(digest, path)
+                links.append(
+                    (digest, tarinfo.mode & 0o7777, tarinfo.mtime, dst / name)
+                )
+                return None
+
+            return divert
+
+        with tempfile.TemporaryFile() as stderr:
+            try:
+                proc = subprocess.Popen(
+                    self.get_ssh_cmd(
+                        self.host, ["bash", "-c", quote("\n".join(script))]
+                    ),
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.DEVNULL,
+                    stderr=stderr,
+                )
+            except OSError as e:
+                raise ExecutorError(f"Failed to copy-in: {str(e)}") from e
+            error = None
+            try:
+                assert proc.stdin
+                with tarfile.open(fileobj=proc.stdin, mode="w|") as tar:
+                    for index, (src, dst) in enumerate(copy_in):
+                        src = Path(src).expanduser().resolve()
+                        tar.add(
+                            src,
+                            arcname=f"{index}/{src.name}",
+                            filter=get_filter(src, dst),
+                        )
+                    if blobs:
+                        # Blobs are files, not hardlinks to diverted ones
+                        tar.inodes.clear()  # type: ignore
+                        for digest in self._get_missing_digests(list(blobs)):
+                            tar.add(blobs[digest], arcname=f".blobs/{digest}")
+                    if links:
+                        content = b"".join(
+                            f"{d}\0{m:o}\0{t}\0{p}\0".encode()
+                            for d, m, t, p in links
+                        )
+                        tarinfo = tarfile.TarInfo(".links")
+                        tarinfo.size = len(content)
+                        tar.addfile(tarinfo, io.BytesIO(content))
+            except (tarfile.TarError, OSError, ExecutorError) as e:
+                error = e
+            finally:
+                if proc.stdin:
+                    try:
+                        proc.stdin.close()
+                    except OSError:
+                        pass
+            rc = proc.wait()
+            if rc != 0 or error:
+                stderr.seek(0)
+                content = sanitize_line(stderr.read().rstrip(b"\n")).rstrip()
+                msg = f"Failed to copy-in: {content or str(error)} (status={rc})."
+                raise ExecutorError(msg, name=self.host) from error
+
+    def _archive_copy_out(
+        self, copy_out: List[Tuple[PurePath, Path]]
+    ) -> List[Tuple[PurePath, Path]]:
+        """
+        Copy every (source, destination directory) pair out of the host with
+        a single tar stream, having the n-th source under the 'n' directory.
+        Missing sources are skipped and returned.
+        """
+        assert self.host
+        self.log.debug(
+            f"copy-out (archive): {', '.join(f'{s} -> {d}' for s, d in copy_out)}"
+        )
+        # Each source is archived through a symlink to its parent directory
+        # named after its index. Hardlinks are archived as files, as sources
+        # are extracted in different places.
+        script = [
+            "set -e",
+            f"tmp=$(mktemp -d -p {quote(str(self._directory))})",
+            "trap 'rm -rf -- \"$tmp\"' EXIT",
+            ': > "$tmp/.files"',
+        ]
+        for index, (src, _) in enumerate(copy_out):
+            script += [
+                f"if [ -e {quote(str(src))} ] || [ -L {quote(str(src))} ]; then",
+                f'    ln -s -- {quote(str(src.parent))} "$tmp/{index}"',
+                f"    printf '%s\\0' {quote(f'{index}/{src.name}')} "
+                '>> "$tmp/.files"',
+                "fi",
+            ]
+        script.append(
+            'tar --sparse --hard-dereference -C "$tmp" --null '
+            '-T "$tmp/.files" -cf -'
+        )
+        with tempfile.TemporaryFile() as stderr:
+            try:
+                proc = subprocess.Popen(
+                    self.get_ssh_cmd(
+                        self.host, ["bash", "-c", quote("\n".join(script))]
+                    ),
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.PIPE,
+                    stderr=stderr,
+                )
+            except OSError as e:
+                raise ExecutorError(f"Failed to copy-out: {str(e)}") from e
+            error = None
+            try:
+                assert proc.stdout
+                with tarfile.open(fileobj=proc.stdout, mode="r|") as tar:
+                    copied = extract_indexed_archive(
+                        tar, copy_out, name=self.host
+                    )
+            except (tarfile.TarError, OSError) as e:
+                error = e
+            finally:
+                if proc.stdout:
+                    proc.stdout.close()
+            rc = proc.wait()
+            if rc != 0 or error:
+                stderr.seek(0)
+                content = sanitize_line(stderr.read().rstrip(b"\n")).rstrip()
+                msg = f"Failed to copy-out: {content or str(error)} (status={rc})."
+                raise ExecutorError(msg, name=self.host) from error
+        return [pair for i, pair in enumerate(copy_out) if i not in copied]
+
+    def copy_in(self, source_path: Path, destination_dir: PurePath):  # type: ignore
+        self._archive_copy_in([(source_path, destination_dir)])
+
+    def copy_out(self, source_path: PurePath, destination_dir: Path):  # type: ignore
+        if self._archive_copy_out([(source_path, destination_dir)]):
+            raise ExecutorError(
+                f"Failed to copy-out: cannot find '{source_path}'.",
+                name=self.host,
+            )
+
+    def cleanup(self):
+        self._session_files.clear()
+        if not self.host:
+            return
+        try:
+            tmp_dir = quote(str(self._temporary_dir))
+            self._ssh(
+                "clean remote temporary directory",
+                self.host,
+                f"rm -rf -- {tmp_dir} 2>/dev/null || "
+                f"sudo --non-interactive rm -rf -- {tmp_dir}",
+            )
+        finally:
+            self._release_host()
+            self.host = None
+
+    def run(  # type: ignore
+        self,
+        cmd: List[str],
+        copy_in: List[Tuple[Path, PurePath]] = None,
+        copy_out: List[Tuple[PurePath, Path]] = None,
+        files_inside_executor_with_placeholders: List[Path] = None,
+        environment=None,
+        no_fail_copy_out_allowed_patterns=None,
+        **kwargs,
+    ):
+        return self._run_coroutine(
+            self.run_async(
+                cmd,
+                copy_in=copy_in,
+                copy_out=copy_out,
+                files_inside_executor_with_placeholders=files_inside_executor_with_placeholders,
+                environment=environment,
+                no_fail_copy_out_allowed_patterns=no_fail_copy_out_allowed_patterns,
+                **kwargs,
+            )
+        )
+
+    async def run_async(  # type: ignore
+        self,
+        cmd: List[str],
+        copy_in: List[Tuple[Path, PurePath]] = None,
+        copy_out: List[Tuple[PurePath, Path]] = None,
+        files_inside_executor_with_placeholders: List[Path] = None,
+        environment=None,
+        no_fail_copy_out_allowed_patterns=None,
+        **kwargs,
+    ):
+        environment = environment or {}
+        try:
+            # Within a session, keep using the same host
+            if not (self._in_session and self.host):
+                host = await asyncio.to_thread(
+                    self._acquire_host, self.distribution
+                )
+                await asyncio.to_thread(
+                    self._ssh,
+                    "create remote builder directory",
+                    host,
+                    f"mkdir -p -- {quote(str(self._builder_dir))}",
+                )
+            assert self.host
+
+            # copy-in hook
+            session_copy_in = self.get_session_copy_in(copy_in)
+            if session_copy_in:
+                await asyncio.to_thread(self._archive_copy_in, session_copy_in)
+            for src, dst in session_copy_in:
+                self.add_session_file(src, dst)
+
+            # replace placeholders
+            sed_cmd = ""
+            if files_inside_executor_with_placeholders and isinstance(
+                files_inside_executor_with_placeholders, list
+            ):
+                files = [
+                    quote(self.replace_placeholders(str(f)))
+                    for f in files_inside_executor_with_placeholders
+                ]
+                sed_cmd = f"sed -i 's#@BUILDER_DIR@#{self.get_builder_dir()}#g' {' '.join(files)};"
+
+            bash_env = []
+            for key, val in environment.items():
+                if "=" in str(key):
+                    raise ExecutorError(
+                        "Environment variable name cannot contain '='"
+                    )
+                bash_env.append(quote(f"{str(key)}={str(val)}"))
+
+            ssh_cmd = self.get_ssh_cmd(
+                self.host,
+                ["env", "--", *bash_env]
+                + ["bash", "-c", quote(sed_cmd + " && ".join(cmd))],
+            )
+
+            self.log.info(f"Using executor ssh:{self.host}.")
+            self.log.debug(
+                f"Using executor ssh:{self.host}:{self._builder_dir} to run '{cmd}'."
+            )
+
+            rc = await self.execute_async(ssh_cmd)
+            if rc != 0:
+                msg = f"Failed to run '{cmd}' (status={rc})."
+                raise ExecutorError(msg, name=self.host)
+
+            # copy-out hook
+            copy_out = sorted(set(copy_out or []), key=lambda x: x[1])
+            missing = []
+            if copy_out:
+                missing = await asyncio.to_thread(
+                    self._archive_copy_out, copy_out
+                )
+            for src_out, dst_out in copy_out:
+                if (src_out, dst_out) not in missing:
+                    self.add_session_file(
+                        dst_out / src_out.name, src_out.parent
+                    )
+                    continue
+                # Ignore copy-out failure if requested
+                if isinstance(no_fail_copy_out_allowed_patterns, list) and any(
+                    [
+                        p in src_out.name
+                        for p in no_fail_copy_out_allowed_patterns
+                    ]
+                ):
+                    self.log.debug(
+                        f"File not found on remote host: {src_out}."
+                    )
+                    continue
+                raise ExecutorError(
+                    f"Failed to copy-out: cannot find '{src_out}'.",
+                    name=self.host,
+                )
+        except ExecutorError as e:
+            if self.host and self._clean_on_error:
+                await asyncio.to_thread(self.cleanup)
+            else:
+                self._release_host()
+            raise e
+        else:
+            if self.host and not self._in_session:
+                if self._clean:
+                    await asyncio.to_thread(self.cleanup)
+                else:
+                    self._release_host()
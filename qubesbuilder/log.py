@@ -1,4 +1,7 @@
 import datetime
+import queue
+import threading
+import traceback
 from logging import (
     Formatter,
     StreamHandler,
@@ -9,6 +12,7 @@ from logging import (
     NOTSET,
     INFO,
 )
+from typing import List, Optional
 
 from qubesbuilder.exc import QubesBuilderError
 
@@ -164,9 +168,73 @@ class QBLogger(Logger):
         return self._log_file
 
 
+class LogWriter:
+    """
+    Log lines from a background thread.
+
+    Commands may output millions of lines. They are queued by batches and
+    logged by a thread, so that reading command output is not slowed down
+    by handlers. Records are created directly, without looking for the
+    caller of each logging call. Errors logging a batch are reported on
+    stderr and do not stop the thread.
+    """
+
+    def __init__(self):
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def write(self, logger: Logger, lines: List[str], level: int = DEBUG):
+        with self._lock:
+            if not self._thread or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="log-writer", daemon=True
+                )
+                self._thread.start()
+        self._queue.put((logger, level, lines))
+
+    def flush(self):
+        """
+        Wait for lines written so far to be logged, unless the thread is
+        not running anymore.
+        """
+        if not self._thread:
+            return
+        done = threading.Event()
+        self._queue.put((None, None, done))
+        while not done.wait(1):
+            if not self._thread.is_alive():
+                return
+
+    def _run(self):
+        while True:
+            logger, level, lines = self._queue.get()
+            if logger is None:
+                lines.set()
+                continue
+            try:
+                if not logger.isEnabledFor(level):
+                    continue
+                for line in lines:
+                    logger.handle(
+                        logger.makeRecord(
+                            logger.name,
+                            level,
+                            "(unknown file)",
+                            0,
+                            line,
+                            (),
+                            None,
+                        )
+                    )
+            except Exception:
+                traceback.print_exc()
+
+
 Logger.manager.setLoggerClass(QBLogger)
 
 QubesBuilderLogger: QBLogger = getLogger("qb")  # type: ignore
+QubesBuilderLogWriter = LogWriter()
 QubesBuilderTimeStamp = datetime.datetime.now(datetime.UTC).strftime(
     PrefixLogFileDataFmt
 )
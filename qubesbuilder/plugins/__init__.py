@@ -16,9 +16,11 @@
 # with this program. If not, see <https://www.gnu.org/licenses/>.
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
+import threading
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path, PurePosixPath
-from typing import List, Dict, Any, Optional
+from typing import Any, Callable, Dict, List, Optional
 
 import dateutil.parser
 import yaml
@@ -28,6 +30,7 @@ from qubesbuilder.component import QubesComponent
 from qubesbuilder.distribution import QubesDistribution
 from qubesbuilder.exc import QubesBuilderError
 from qubesbuilder.log import QubesBuilderLogger
+from qubesbuilder.store import ArtifactStore
 from qubesbuilder.template import QubesTemplate
 
 
@@ -215,12 +218,22 @@ class Plugin:
         # Stage
         self.stage = stage
 
-        # Executor
+        # Executor, and the one of the build target run by the current
+        # thread, see DistributionComponentPlugin.run_build_targets()
+        self._target = threading.local()
         self.executor = self.config.get_executor_from_config(stage, self)
 
         # Dependencies
         self.dependencies = []  # type: List[Dependency]
 
+    @property
+    def executor(self):
+        return getattr(self._target, "executor", self._executor)
+
+    @executor.setter
+    def executor(self, executor):
+        self._executor = executor
+
     def get_artifact_context(self) -> dict:
         """
         Returns a dictionary of objects needed by ArtifactLocator.
@@ -370,6 +383,17 @@ class Plugin:
             msg = f"{basename}: Failed to write info for {stage} stage."
             raise PluginError(msg) from e
 
+        # Components artifacts are linked into the artifacts store
+        if artifacts_dir.resolve().is_relative_to(
+            (self.config.artifacts_dir / "components").resolve()
+        ):
+            self.store_artifacts(artifacts_dir)
+
+    def store_artifacts(self, directory: Path):
+        if not self.config.artifacts_store:
+            return
+        ArtifactStore(self.config.store_dir).add_directory(directory)
+
     def get_artifacts_info(
         self, stage: str, basename: str, artifacts_dir: Path
     ) -> Dict:
@@ -687,6 +711,66 @@ class DistributionComponentPlugin(DistributionPlugin, ComponentPlugin):
             "build", []
         )
 
+    def get_target_jobs(self) -> int:
+        """
+        Returns the number of build targets of the component to run in
+        parallel within this job, from 'target-jobs' stage option.
+        """
+        stage_options = dict(self.config.get_stage_options(self.stage))
+        stage_options.update(self.get_config_stage_options(self.stage))
+        return max(int(stage_options.get("target-jobs", 1)), 1)
+
+    def run_build_targets(
+        self,
+        targets: List[PackagePath],
+        run: Callable[[PackagePath], Any],
+        finish: Optional[Callable[[PackagePath, Any], None]] = None,
+    ):
+        """
+        Call run for each build target, then finish with its result.
+
+        Targets are run one after the other, unless 'target-jobs' allows
+        running several of them in parallel. Each of them then uses its own
+        executor as 'self.executor', and finish is only called once all of
+        them are done, in targets order, so that a target never sees the
+        local repository changing underneath.
+        """
+        jobs = min(self.get_target_jobs(), len(targets))
+        if jobs <= 1:
+            for target in targets:
+                result = run(target)
+                if finish:
+                    finish(target, result)
+            return
+
+        failed = threading.Event()
+
+        def run_target(target):
+            # Do not start remaining targets once one has failed. They come
+            # after the failed one, whose error is raised first.
+            if failed.is_set():
+                return None
+            self._target.executor = self.config.get_executor_from_config(
+                self.stage, self
+            )
+            try:
+                return run(target)
+            except BaseException:
+                failed.set()
+                raise
+            finally:
+                del self._target.executor
+
+        self.log.info(
+            f"{self.component}:{self.dist}: Running {len(targets)} build targets, {jobs} at a time."
+        )
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(run_target, target) for target in targets]
+        results = [future.result() for future in futures]
+        if finish:
+            for target, result in zip(targets, results):
+                finish(target, result)
+
 
 class TemplatePlugin(DistributionPlugin):
     def __init__(
@@ -16,7 +16,22 @@
 # with this program. If not, see <https://www.gnu.org/licenses/>.
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
+from qubesbuilder.actioncache import ACTION_CACHE_VERSION, ActionCacheError
+from qubesbuilder.ccache import CompilerCache
+from qubesbuilder.common import (
+    get_cached_file_digest,
+    get_file_digest,
+    get_temporary_path,
+)
 from qubesbuilder.component import QubesComponent
 from qubesbuilder.config import Config
 from qubesbuilder.distribution import QubesDistribution
@@ -26,13 +41,74 @@ from qubesbuilder.plugins import (
     PluginError,
     JobDependency,
     JobReference,
+    get_artifacts_path,
+)
+
+# Files identifying a prepared chroot cache
+CHROOT_CACHE_SUFFIXES = (
+    ".yml",
+    ".tar",
+    ".tar.gz",
+    ".tgz",
+    ".tar.xz",
+    ".tar.zst",
 )
 
+# Metadata of local builder repository, regenerated with a new date or
+# timestamps on every update, see update_local_repository_metadata() of
+# build plugins
+LOCAL_REPOSITORY_METADATA = ("dists", "repodata", ".repodata")
+
+
+def is_local_repository_metadata(relpath: Path) -> bool:
+    """
+    Returns whether a path relative to the local builder repository of
+    a distribution is metadata rather than packages of a component.
+    """
+    return relpath.parts[0] in LOCAL_REPOSITORY_METADATA or (
+        len(relpath.parts) == 2 and relpath.name == "Packages"
+    )
+
 
 class BuildError(PluginError):
     pass
 
 
+@contextmanager
+def local_repository_lock(repository_dir: Path) -> Iterator[None]:
+    """
+    Lock local builder repository against concurrent changes and snapshots
+    from other jobs of the same distribution.
+    """
+    lock_path = repository_dir.parent / f".{repository_dir.name}.lock"
+    with open(lock_path, "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+@contextmanager
+def local_repository_snapshot(
+    repository_dir: Path, name: Optional[str] = None
+) -> Iterator[Path]:
+    """
+    Hardlink a copy of local builder repository taken under its lock, to be
+    copied in while other jobs of the distribution update the repository.
+    Packages and metadata are replaced and never written into, so the copy
+    stays consistent. It is named like the repository unless a name is
+    given, and removed on exit.
+    """
+    snapshot_dir = get_temporary_path(repository_dir, "snapshot")
+    snapshot = snapshot_dir / (name or repository_dir.name)
+    try:
+        with local_repository_lock(repository_dir):
+            shutil.copytree(
+                repository_dir, snapshot, symlinks=True, copy_function=os.link
+            )
+        yield snapshot
+    finally:
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+
+
 class BuildPlugin(DistributionComponentPlugin):
     """
     BuildPlugin manages generic distribution build.
@@ -87,3 +163,198 @@ class BuildPlugin(DistributionComponentPlugin):
         if component and not component.has_packages:
             return None
         return super().from_args(**kwargs)
+
+    @staticmethod
+    def _get_files_digests(
+        directory: Path, digest=get_file_digest, suffixes=None, exclude=None
+    ) -> List[Tuple[str, str]]:
+        files: List[Tuple[str, str]] = []
+        if not directory.exists():
+            return files
+        for path in sorted(directory.rglob("*")):
+            relpath = path.relative_to(directory)
+            if exclude and exclude(relpath):
+                continue
+            if suffixes and not path.name.endswith(suffixes):
+                continue
+            if path.is_file():
+                files.append((str(relpath), digest(path)))
+        return files
+
+    def get_action_inputs(self) -> Dict[str, Any]:
+        """
+        Returns everything the build artifacts depend on: sources, build
+        parameters, plugins scripts, chroot cache, relevant configuration
+        and packages of other components available in local repository.
+        """
+        plugins = [self.name] + [
+            dependency.reference
+            for dependency in self.dependencies
+            if dependency.builder_object == "plugin"
+        ]
+        dependencies = {}
+        for dependency in self.dependencies:
+            if dependency.builder_object != "job":
+                continue
+            ref = dependency.reference
+            # Previous stages of the component are covered by its sources
+            if not ref.build or ref.component == self.component:
+                continue
+            artifact_path = get_artifacts_path(self.config, ref)
+            info = self._get_artifacts_info(artifact_path)
+            dependencies[str(ref)] = [
+                (file, get_cached_file_digest(artifact_path.parent / file))
+                for file in info.get("files", [])
+                if (artifact_path.parent / file).is_file()
+            ]
+        return {
+            "version": ACTION_CACHE_VERSION,
+            "plugin": self.name,
+            "stage": self.stage,
+            "component": self.component.name,
+            "version-release": self.component.get_version_release(),
+            "source-hash": self.component.get_source_hash(),
+            "dist": self.dist.distribution,
+            "architecture": self.dist.architecture,
+            "parameters": self.get_parameters(self.stage),
+            "environment": self.environment,
+            "config": {
+                "use-qubes-repo": self.config.use_qubes_repo,
+                "increment-devel-versions": self.config.increment_devel_versions,
+                "qubes-release": self.config.qubes_release,
+            },
+            "plugins": {
+                name: self._get_files_digests(
+                    self.manager.entities[name].directory,
+                    exclude=lambda relpath: "__pycache__" in relpath.parts,
+                )
+                for name in sorted(set(plugins))
+            },
+            "chroot": self._get_files_digests(
+                self.config.cache_dir
+                / "chroot"
+                / self.dist.distribution
+                / self.dist.nva,
+                digest=get_cached_file_digest,
+                suffixes=CHROOT_CACHE_SUFFIXES,
+            ),
+            "repository": self._get_files_digests(
+                self.config.repository_dir / self.dist.distribution,
+                digest=get_cached_file_digest,
+                exclude=lambda relpath: relpath.parts[0].startswith(
+                    f"{self.component.name}_"
+                )
+                or is_local_repository_metadata(relpath),
+            ),
+            "dependencies": dependencies,
+        }
+
+    def get_action_key(self) -> str:
+        inputs = json.dumps(
+            self.get_action_inputs(), sort_keys=True, default=str
+        )
+        return hashlib.sha256(inputs.encode()).hexdigest()
+
+    def restore_from_action_cache(self, artifacts_dir: Path) -> bool:
+        """
+        Restore build artifacts from action cache, if configured. Returns
+        True on hit. The key is kept for save_to_action_cache().
+        """
+        self._action_key: Optional[str] = None
+        action_cache = self.config.get_action_cache()
+        if not action_cache:
+            return False
+        self._action_key = self.get_action_key()
+        # Do not leave a partially restored entry in artifacts directory
+        restore_dir = get_temporary_path(artifacts_dir, "restore")
+        try:
+            if not action_cache.restore(self._action_key, restore_dir):
+                self.log.debug(
+                    f"{self.component}:{self.dist}: No entry in action cache for {self._action_key}."
+                )
+                return False
+        except ActionCacheError as e:
+            self.log.warning(
+                f"{self.component}:{self.dist}: Cannot restore from action cache: {str(e)}"
+            )
+            shutil.rmtree(restore_dir, ignore_errors=True)
+            return False
+        shutil.rmtree(artifacts_dir)
+        restore_dir.rename(artifacts_dir)
+        self.store_artifacts(artifacts_dir)
+        self.log.info(
+            f"{self.component}:{self.dist}: Restored build artifacts from action cache ({self._action_key})."
+        )
+        return True
+
+    def save_to_action_cache(self, artifacts_dir: Path):
+        action_cache = self.config.get_action_cache()
+        if not action_cache or not getattr(self, "_action_key", None):
+            return
+        try:
+            action_cache.save(self._action_key, artifacts_dir)  # type: ignore
+        except ActionCacheError as e:
+            self.log.warning(
+                f"{self.component}:{self.dist}: Cannot save to action cache: {str(e)}"
+            )
+
+    def get_compiler_cache(self) -> Optional[CompilerCache]:
+        if not self.config.ccache:
+            return None
+        return CompilerCache(
+            self.config.cache_dir / "ccache" / self.dist.distribution,
+            max_size=self.config.ccache_max_size,
+        )
+
+    def run_with_compiler_cache(
+        self,
+        build: str,
+        cmd: List[str],
+        copy_in: List[Tuple[Path, Path]],
+        copy_out: List[Tuple[Path, Path]],
+        environment: Optional[Dict[str, Any]] = None,
+        **kwargs,
+    ):
+        """
+        Run build commands in executor, with the compiler cache of the
+        distribution if enabled. It is available in executor as
+        'cache/ccache' and build tools enable it when CCACHE_ENABLE is set.
+        """
+        ccache = self.get_compiler_cache()
+        if not ccache:
+            return self.executor.run(
+                cmd, copy_in, copy_out, environment=environment, **kwargs
+            )
+
+        cache_dir = self.executor.get_cache_dir()
+        name = ccache.directory.name
+        with ccache.checkout() as ccache_dir:
+            hits, misses = ccache.get_stats(ccache_dir)
+            out_dir = ccache_dir.parent / "out"
+            out_dir.mkdir()
+            self.executor.run(
+                [
+                    f"mkdir -p {cache_dir / name}",
+                    f"ln -sfn {name} {cache_dir / 'ccache'}",
+                    f"echo 'max_size = {ccache.max_size}' > {cache_dir / name / 'ccache.conf'}",
+                ]
+                + cmd,
+                copy_in + [(ccache_dir, cache_dir)],
+                copy_out + [(cache_dir / name, out_dir)],
+                environment={
+                    **(environment or {}),
+                    "CCACHE_ENABLE": "True",
+                    "CCACHE_MAXSIZE": str(ccache.max_size),
+                },
+                **kwargs,
+            )
+            new_hits, new_misses = ccache.get_stats(out_dir / name)
+            # Statistics may have been zeroed during the build
+            if new_hits < hits or new_misses < misses:
+                hits = misses = 0
+            hits, misses = new_hits - hits, new_misses - misses
+            if hits + misses:
+                self.log.info(
+                    f"{self.component}:{self.dist}:{build}: Compiler cache hit rate: {hits}/{hits + misses} ({100 * hits / (hits + misses):.1f}%)."
+                )
+            ccache.commit(out_dir / name)
@@ -29,7 +29,12 @@ from qubesbuilder.distribution import QubesDistribution
 from qubesbuilder.executors import ExecutorError
 from qubesbuilder.executors.local import LocalExecutor
 from qubesbuilder.plugins import ArchlinuxDistributionPlugin, PluginDependency
-from qubesbuilder.plugins.build import BuildPlugin, BuildError
+from qubesbuilder.plugins.build import (
+    BuildPlugin,
+    BuildError,
+    local_repository_lock,
+    local_repository_snapshot,
+)
 from qubesbuilder.plugins.chroot_archlinux import (
     get_pacman_cmd,
     get_archchroot_cmd,
@@ -50,13 +55,16 @@ def clean_local_repository(
         f"{component}:{dist}: Cleaning local repository '{repository_dir}'"
         f"{' (all versions)' if all_versions else ''}."
     )
-    if all_versions:
-        for version_dir in repository_dir.glob(f"{component.name}_*"):
-            shutil.rmtree(version_dir.as_posix())
-    else:
-        target_dir = repository_dir / f"{component.name}_{component.version}"
-        if target_dir.exists():
-            shutil.rmtree(target_dir.as_posix())
+    with local_repository_lock(repository_dir):
+        if all_versions:
+            for version_dir in repository_dir.glob(f"{component.name}_*"):
+                shutil.rmtree(version_dir.as_posix())
+        else:
+            target_dir = (
+                repository_dir / f"{component.name}_{component.version}"
+            )
+            if target_dir.exists():
+                shutil.rmtree(target_dir.as_posix())
 
 
 def provision_local_repository(
@@ -77,14 +85,15 @@ def provision_local_repository(
 
     # Create target directory that will have hardlinks to PKGs
     target_dir = repository_dir / f"{component.name}_{component.version}"
-    target_dir.mkdir(parents=True, exist_ok=True)
 
     try:
-        # pkgs
-        for pkg in packages_list:
-            pkg_path = build_artifacts_dir / "pkgs" / pkg
-            target_path = target_dir / pkg
-            os.link(pkg_path, target_path)
+        with local_repository_lock(repository_dir):
+            target_dir.mkdir(parents=True, exist_ok=True)
+            # pkgs
+            for pkg in packages_list:
+                pkg_path = build_artifacts_dir / "pkgs" / pkg
+                target_path = target_dir / pkg
+                os.link(pkg_path, target_path)
     except (
         ValueError,
         PermissionError,
@@ -218,7 +227,23 @@ class ArchlinuxBuildPlugin(ArchlinuxDistributionPlugin, BuildPlugin):
             self.log, repository_dir, self.component, self.dist, True
         )
 
-        for build in parameters["build"]:
+        if self.restore_from_action_cache(artifacts_dir):
+            for build in parameters["build"]:
+                info = self.get_dist_artifacts_info(
+                    stage=self.stage, basename=build.mangle()
+                )
+                provision_local_repository(
+                    log=self.log,
+                    build=build,
+                    component=self.component,
+                    dist=self.dist,
+                    repository_dir=repository_dir,
+                    packages_list=info["packages"],
+                    build_artifacts_dir=artifacts_dir,
+                )
+            return
+
+        def build_target(build):
             # spec file basename will be used as prefix for some artifacts
             build_bn = build.mangle()
 
@@ -241,7 +266,6 @@ class ArchlinuxBuildPlugin(ArchlinuxDistributionPlugin, BuildPlugin):
                 (self.component.source_dir, self.executor.get_builder_dir()),
                 (prep_artifacts_dir / "PKGBUILD", source_dir),
                 (distfiles_dir, self.executor.get_distfiles_dir()),
-                (repository_dir, self.executor.get_repository_dir()),
             ]
 
             if qubes_repo_version:
@@ -379,13 +403,15 @@ class ArchlinuxBuildPlugin(ArchlinuxDistributionPlugin, BuildPlugin):
             cmd += [f"cd {source_dir}", " ".join(build_command)]
 
             try:
-                self.executor.run(
-                    cmd,
-                    copy_in,
-                    copy_out,
-                    environment=self.environment,
-                    files_inside_executor_with_placeholders=files_inside_executor_with_placeholders,
-                )
+                with local_repository_snapshot(repository_dir) as repository:
+                    self.executor.run(
+                        cmd,
+                        copy_in
+                        + [(repository, self.executor.get_repository_dir())],
+                        copy_out,
+                        environment=self.environment,
+                        files_inside_executor_with_placeholders=files_inside_executor_with_placeholders,
+                    )
             except ExecutorError as e:
                 msg = f"{self.component}:{self.dist}:{build}: Failed to build PKGs: {str(e)}."
                 raise BuildError(msg) from e
@@ -404,7 +430,9 @@ class ArchlinuxBuildPlugin(ArchlinuxDistributionPlugin, BuildPlugin):
                     "files": packages_list,
                 }
             )
+            return info
 
+        def provision_target(build, info):
             # Provision builder local repository
             provision_local_repository(
                 log=self.log,
@@ -412,14 +440,20 @@ class ArchlinuxBuildPlugin(ArchlinuxDistributionPlugin, BuildPlugin):
                 component=self.component,
                 dist=self.dist,
                 repository_dir=repository_dir,
-                packages_list=packages_list,
+                packages_list=info["packages"],
                 build_artifacts_dir=artifacts_dir,
             )
 
             # Save package information we parsed for next stages
             self.save_dist_artifacts_info(
-                stage=self.stage, basename=build_bn, info=info
+                stage=self.stage, basename=build.mangle(), info=info
             )
 
+        self.run_build_targets(
+            parameters["build"], build_target, provision_target
+        )
+
+        self.save_to_action_cache(artifacts_dir)
+
 
 PLUGINS = [ArchlinuxBuildPlugin]
@@ -17,19 +17,112 @@
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import gzip
+import hashlib
 import logging
 import os
 import shutil
+import subprocess
+import time
 from pathlib import Path
 from typing import List
 
-from qubesbuilder.common import extract_lines_before
+from qubesbuilder.common import extract_lines_before, get_temporary_path
 from qubesbuilder.component import QubesComponent
 from qubesbuilder.config import Config
 from qubesbuilder.distribution import QubesDistribution
 from qubesbuilder.executors import ExecutorError
 from qubesbuilder.plugins import DEBDistributionPlugin, PluginDependency
-from qubesbuilder.plugins.build import BuildPlugin, BuildError
+from qubesbuilder.plugins.build import (
+    BuildPlugin,
+    BuildError,
+    local_repository_lock,
+    local_repository_snapshot,
+)
+
+
+def replace_file(path: Path, content: bytes):
+    """
+    Write content to a temporary file renamed to path, so that a copy of the
+    repository never gets a partially written file.
+    """
+    tmp_path = get_temporary_path(path)
+    try:
+        tmp_path.write_bytes(content)
+        os.replace(tmp_path, path)
+    except OSError:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def update_local_repository_metadata(
+    log: logging.Logger, repository_dir: Path, dist: QubesDistribution
+):
+    """
+    Update metadata of local builder repository, so that executors get it
+    ready instead of generating it for every build. Packages of a component
+    are scanned once, into a 'Packages' file next to them, and the index of
+    the repository is made of these files. On failure, metadata is removed
+    and executors generate it themselves. It must be called with the
+    repository locked, along with the change of its packages.
+    """
+    dists_dir = repository_dir / "dists"
+    suite_dir = dists_dir / dist.name
+    index_files = [
+        "main/binary-amd64/Packages",
+        "main/binary-amd64/Packages.gz",
+    ]
+    try:
+        packages = b""
+        for directory in sorted(repository_dir.iterdir()):
+            if directory == dists_dir or not directory.is_dir():
+                continue
+            packages_file = directory / "Packages"
+            if not packages_file.exists():
+                result = subprocess.run(
+                    [
+                        "dpkg-scanpackages",
+                        "--multiversion",
+                        directory.name,
+                    ],
+                    cwd=repository_dir,
+                    check=True,
+                    capture_output=True,
+                )
+                replace_file(packages_file, result.stdout)
+            packages += packages_file.read_bytes()
+
+        (suite_dir / "main/binary-amd64").mkdir(parents=True, exist_ok=True)
+        index = {
+            index_files[0]: packages,
+            index_files[1]: gzip.compress(packages, compresslevel=9, mtime=0),
+        }
+
+        # Same content as the one of 'create-local-repo'
+        date = time.strftime("%a, %d %b %Y %H:%M:%S UTC", time.gmtime())
+        release = [
+            "Label: Qubes builder repo",
+            f"Suite: {dist.name}",
+            f"Codename: {dist.name}",
+            f"Date: {date}",
+            "Architectures: amd64",
+            "Components: main",
+            "SHA256:",
+        ]
+        for index_file, content in index.items():
+            replace_file(suite_dir / index_file, content)
+            release.append(
+                f" {hashlib.sha256(content).hexdigest()} {len(content)} {index_file}"
+            )
+        replace_file(
+            suite_dir / "Release", ("\n".join(release) + "\n").encode()
+        )
+    except (OSError, subprocess.CalledProcessError) as e:
+        stderr = getattr(e, "stderr", None) or b""
+        log.warning(
+            f"Failed to update metadata of local repository '{repository_dir}': {str(e)} {stderr.decode(errors='replace').strip()}"
+        )
+        shutil.rmtree(dists_dir, ignore_errors=True)
 
 
 def provision_local_repository(
@@ -51,35 +144,40 @@ def provision_local_repository(
 
     # Create target directory that will have hardlinks to built packages
     target_dir = repository_dir / f"{component.name}_{component.version}"
-    if target_dir.exists():
-        shutil.rmtree(target_dir.as_posix())
-    target_dir.mkdir(parents=True)
 
-    try:
-        debian_source_files = ["dsc", "debian"]
-        if source_info["package-type"] == "quilt":
-            debian_source_files.append("orig")
-
-        # deb
-        files = [build_artifacts_dir / deb for deb in packages_list]
-        files += [
-            build_artifacts_dir / source_info[f] for f in debian_source_files
-        ]
+    with local_repository_lock(repository_dir):
+        if target_dir.exists():
+            shutil.rmtree(target_dir.as_posix())
+        target_dir.mkdir(parents=True)
 
-        # changes and buildinfo
-        files += [
-            build_artifacts_dir / source_info["changes"],
-            build_artifacts_dir / source_info["buildinfo"],
-        ]
+        try:
+            debian_source_files = ["dsc", "debian"]
+            if source_info["package-type"] == "quilt":
+                debian_source_files.append("orig")
+
+            # deb
+            files = [build_artifacts_dir / deb for deb in packages_list]
+            files += [
+                build_artifacts_dir / source_info[f]
+                for f in debian_source_files
+            ]
+
+            # changes and buildinfo
+            files += [
+                build_artifacts_dir / source_info["changes"],
+                build_artifacts_dir / source_info["buildinfo"],
+            ]
 
-        # create hardlinks
-        for f in files:
-            target_path = target_dir / f.name
-            # target_path.hardlink_to(f)
-            os.link(f, target_path)
-    except (ValueError, PermissionError, NotImplementedError) as e:
-        msg = f"{component}:{dist}:{debian_directory}: Failed to create repository."
-        raise BuildError(msg) from e
+            # create hardlinks
+            for f in files:
+                target_path = target_dir / f.name
+                # target_path.hardlink_to(f)
+                os.link(f, target_path)
+        except (ValueError, PermissionError, NotImplementedError) as e:
+            msg = f"{component}:{dist}:{debian_directory}: Failed to create repository."
+            raise BuildError(msg) from e
+
+        update_local_repository_metadata(log, repository_dir, dist)
 
 
 class DEBBuildPlugin(DEBDistributionPlugin, BuildPlugin):
@@ -154,10 +252,31 @@ class DEBBuildPlugin(DEBDistributionPlugin, BuildPlugin):
         repository_dir.mkdir(parents=True, exist_ok=True)
 
         # Remove previous versions in order to keep the latest one only
-        for build in repository_dir.glob(f"{self.component.name}_*"):
-            shutil.rmtree(build.as_posix())
+        with local_repository_lock(repository_dir):
+            for build in repository_dir.glob(f"{self.component.name}_*"):
+                shutil.rmtree(build.as_posix())
+            update_local_repository_metadata(
+                self.log, repository_dir, self.dist
+            )
 
-        for directory in parameters["build"]:
+        if self.restore_from_action_cache(artifacts_dir):
+            for directory in parameters["build"]:
+                info = self.get_dist_artifacts_info(
+                    stage=self.stage, basename=directory.mangle()
+                )
+                provision_local_repository(
+                    log=self.log,
+                    debian_directory=directory,
+                    component=self.component,
+                    dist=self.dist,
+                    repository_dir=repository_dir,
+                    source_info=info,
+                    packages_list=info["packages"],
+                    build_artifacts_dir=artifacts_dir,
+                )
+            return
+
+        def build_target(directory):
             # directory basename will be used as prefix for some artifacts
             directory_bn = directory.mangle()
 
@@ -189,7 +308,6 @@ class DEBBuildPlugin(DEBDistributionPlugin, BuildPlugin):
                     self.manager.entities["chroot_deb"].directory / "pbuilder",
                     self.executor.get_builder_dir(),
                 ),
-                (repository_dir, self.executor.get_repository_dir()),
             ]
 
             copy_in += [
@@ -280,15 +398,31 @@ class DEBBuildPlugin(DEBDistributionPlugin, BuildPlugin):
             pbuilder_dir = chroot_dir / self.dist.nva / "pbuilder"
             aptcache_dir = pbuilder_dir / "aptcache"
             base_tgz = pbuilder_dir / "base.tgz"
-            if aptcache_dir.exists():
-                copy_in += [(
-                    pbuilder_dir / "aptcache",
-                    self.executor.get_cache_dir(),
-                )]
+            mount_in = []
+            if self.executor.can_mount_in() and pbuilder_dir.exists():
+                # Link files from the overlay where they are expected.
+                # pbuilder replaces base.tgz instead of writing into it.
+                mount_in += [(pbuilder_dir, self.executor.get_cache_dir() / "chroot")]
+                pbuilder_mount_dir = self.executor.get_cache_dir() / "chroot" / "pbuilder"
+                if aptcache_dir.exists():
+                    cmd = [
+                        f"ln -s {pbuilder_mount_dir / 'aptcache'} {self.executor.get_cache_dir() / 'aptcache'}"
+                    ] + cmd
+                if base_tgz.exists():
+                    cmd += [
+                        f"ln -s {pbuilder_mount_dir / 'base.tgz'} {self.executor.get_builder_dir() / 'pbuilder' / 'base.tgz'}"
+                    ]
+            else:
+                if aptcache_dir.exists():
+                    copy_in += [(
+                        pbuilder_dir / "aptcache",
+                        self.executor.get_cache_dir(),
+                    )]
+                if base_tgz.exists():
+                    copy_in += [
+                        (base_tgz, self.executor.get_builder_dir() / "pbuilder")
+                    ]
             if base_tgz.exists():
-                copy_in += [
-                    (base_tgz, self.executor.get_builder_dir() / "pbuilder")
-                ]
                 cmd += [
                     f"sudo -E pbuilder update "
                     f"--distribution {self.dist.name} "
@@ -322,14 +456,21 @@ class DEBBuildPlugin(DEBDistributionPlugin, BuildPlugin):
             ]
             # fmt: on
             try:
-                self.executor.run(
-                    cmd,
-                    copy_in,
-                    copy_out,
-                    environment=self.environment,
-                    no_fail_copy_out_allowed_patterns=["-dbgsym_"],
-                    files_inside_executor_with_placeholders=files_inside_executor_with_placeholders,
-                )
+                # Its metadata refers to packages from its root
+                with local_repository_snapshot(
+                    repository_dir, self.executor.get_repository_dir().name
+                ) as repository:
+                    self.run_with_compiler_cache(
+                        directory,
+                        cmd,
+                        copy_in
+                        + [(repository, self.executor.get_builder_dir())],
+                        copy_out,
+                        environment=self.environment,
+                        no_fail_copy_out_allowed_patterns=["-dbgsym_"],
+                        files_inside_executor_with_placeholders=files_inside_executor_with_placeholders,
+                        mount_in=mount_in,
+                    )
             except ExecutorError as e:
                 msg = f"{self.component}:{self.dist}:{directory}: Failed to build packages: {str(e)}"
                 errors, start_line = extract_lines_before(
@@ -359,19 +500,7 @@ class DEBBuildPlugin(DEBDistributionPlugin, BuildPlugin):
                 target_path = artifacts_dir / file.name
                 shutil.copy2(file, target_path)
 
-            # Provision builder local repository
-            provision_local_repository(
-                log=self.log,
-                debian_directory=directory,
-                component=self.component,
-                dist=self.dist,
-                repository_dir=repository_dir,
-                source_info=source_info,
-                packages_list=packages_list,
-                build_artifacts_dir=artifacts_dir,
-            )
-
-            # Save package information we parsed for next stages
+            # Package information for next stages
             info = source_info
             info.update(
                 {
@@ -384,9 +513,31 @@ class DEBBuildPlugin(DEBDistributionPlugin, BuildPlugin):
                     "source-hash": self.component.get_source_hash(),
                 }
             )
+            return info
+
+        def provision_target(directory, info):
+            # Provision builder local repository
+            provision_local_repository(
+                log=self.log,
+                debian_directory=directory,
+                component=self.component,
+                dist=self.dist,
+                repository_dir=repository_dir,
+                source_info=info,
+                packages_list=info["packages"],
+                build_artifacts_dir=artifacts_dir,
+            )
+
+            # Save package information we parsed for next stages
             self.save_dist_artifacts_info(
-                stage=self.stage, basename=directory_bn, info=info
+                stage=self.stage, basename=directory.mangle(), info=info
             )
 
+        self.run_build_targets(
+            parameters["build"], build_target, provision_target
+        )
+
+        self.save_to_action_cache(artifacts_dir)
+
 
 PLUGINS = [DEBBuildPlugin]
@@ -20,6 +20,7 @@ import logging
 import os.path
 import re
 import shutil
+import subprocess
 from pathlib import Path
 from typing import List
 
@@ -33,7 +34,12 @@ from qubesbuilder.plugins import (
     RPMDistributionPlugin,
     PluginDependency,
 )
-from qubesbuilder.plugins.build import BuildPlugin, BuildError
+from qubesbuilder.plugins.build import (
+    BuildPlugin,
+    BuildError,
+    local_repository_lock,
+    local_repository_snapshot,
+)
 
 
 def clean_local_repository(
@@ -50,13 +56,44 @@ def clean_local_repository(
         f"{component}:{dist}: Cleaning local repository '{repository_dir}'"
         f"{' (all versions)' if all_versions else ''}."
     )
-    if all_versions:
-        for version_dir in repository_dir.glob(f"{component.name}_*"):
-            shutil.rmtree(version_dir.as_posix())
-    else:
-        target_dir = repository_dir / f"{component.name}_{component.version}"
-        if target_dir.exists():
-            shutil.rmtree(target_dir.as_posix())
+    with local_repository_lock(repository_dir):
+        if all_versions:
+            for version_dir in repository_dir.glob(f"{component.name}_*"):
+                shutil.rmtree(version_dir.as_posix())
+        else:
+            target_dir = (
+                repository_dir / f"{component.name}_{component.version}"
+            )
+            if target_dir.exists():
+                shutil.rmtree(target_dir.as_posix())
+
+        update_local_repository_metadata(log, repository_dir)
+
+
+def update_local_repository_metadata(
+    log: logging.Logger, repository_dir: Path
+):
+    """
+    Update metadata of local builder repository, reusing the one of
+    unchanged packages, so that executors get it ready instead of generating
+    it for every build. On failure, metadata is removed and executors
+    generate it themselves. It must be called with the repository locked,
+    along with the change of its packages.
+    """
+    try:
+        subprocess.run(
+            ["createrepo_c", "--update", "--quiet", str(repository_dir)],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+    except (OSError, subprocess.CalledProcessError) as e:
+        stderr = getattr(e, "stderr", None) or ""
+        log.warning(
+            f"Failed to update metadata of local repository '{repository_dir}': {str(e)} {stderr.strip()}"
+        )
+        for name in ("repodata", ".repodata"):
+            shutil.rmtree(repository_dir / name, ignore_errors=True)
 
 
 def provision_local_repository(
@@ -79,36 +116,39 @@ def provision_local_repository(
 
     # Create target directory that will have hardlinks to SRPM and built RPMs
     target_dir = repository_dir / f"{component.name}_{component.version}"
-    target_dir.mkdir(parents=True, exist_ok=True)
 
-    try:
-        # srpm
-        srpm_path = prep_artifacts_dir / source_info["srpm"]
-        target_path = target_dir / source_info["srpm"]
-        # target_path.hardlink_to(srpm_path)
-        os.link(srpm_path, target_path)
-
-        # rpms
-        for rpm in packages_list:
-            rpm_path = build_artifacts_dir / "rpm" / rpm
-            target_path = target_dir / rpm
-            # target_path.hardlink_to(rpm_path)
-            os.link(rpm_path, target_path)
-
-        # buildinfo
-        buildinfo_path = build_artifacts_dir / "rpm" / source_info["buildinfo"]
-        target_path = target_dir / source_info["buildinfo"]
-        os.link(buildinfo_path, target_path)
-    except (
-        ValueError,
-        PermissionError,
-        NotImplementedError,
-        FileExistsError,
-    ) as e:
-        msg = (
-            f"{component}:{dist}:{build}: Failed to provision local repository."
-        )
-        raise BuildError(msg) from e
+    with local_repository_lock(repository_dir):
+        target_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            # srpm
+            srpm_path = prep_artifacts_dir / source_info["srpm"]
+            target_path = target_dir / source_info["srpm"]
+            # target_path.hardlink_to(srpm_path)
+            os.link(srpm_path, target_path)
+
+            # rpms
+            for rpm in packages_list:
+                rpm_path = build_artifacts_dir / "rpm" / rpm
+                target_path = target_dir / rpm
+                # target_path.hardlink_to(rpm_path)
+                os.link(rpm_path, target_path)
+
+            # buildinfo
+            buildinfo_path = (
+                build_artifacts_dir / "rpm" / source_info["buildinfo"]
+            )
+            target_path = target_dir / source_info["buildinfo"]
+            os.link(buildinfo_path, target_path)
+        except (
+            ValueError,
+            PermissionError,
+            NotImplementedError,
+            FileExistsError,
+        ) as e:
+            msg = f"{component}:{dist}:{build}: Failed to provision local repository."
+            raise BuildError(msg) from e
+
+        update_local_repository_metadata(log, repository_dir)
 
 
 class RPMBuildPlugin(RPMDistributionPlugin, BuildPlugin):
@@ -217,7 +257,25 @@ class RPMBuildPlugin(RPMDistributionPlugin, BuildPlugin):
             self.log, repository_dir, self.component, self.dist, True
         )
 
-        for build in parameters["build"]:
+        if self.restore_from_action_cache(artifacts_dir):
+            for build in parameters["build"]:
+                info = self.get_dist_artifacts_info(
+                    stage=self.stage, basename=build.mangle()
+                )
+                provision_local_repository(
+                    log=self.log,
+                    build=build,
+                    component=self.component,
+                    dist=self.dist,
+                    repository_dir=repository_dir,
+                    source_info=info,
+                    packages_list=info["rpms"],
+                    prep_artifacts_dir=prep_artifacts_dir,
+                    build_artifacts_dir=artifacts_dir,
+                )
+            return
+
+        def build_target(build):
             # spec file basename will be used as prefix for some artifacts
             build_bn = build.mangle()
 
@@ -243,7 +301,6 @@ class RPMBuildPlugin(RPMDistributionPlugin, BuildPlugin):
             copy_in = self.default_copy_in(
                 self.executor.get_plugins_dir(), self.executor.get_sources_dir()
             ) + [
-                (repository_dir, self.executor.get_repository_dir()),
                 (
                     prep_artifacts_dir / source_info["srpm"],
                     self.executor.get_build_dir(),
@@ -264,11 +321,12 @@ class RPMBuildPlugin(RPMDistributionPlugin, BuildPlugin):
                 )
             ]
 
-            # Createrepo of local builder repository and ensure 'mock' group can access
-            # build directory
+            # Createrepo of local builder repository, unless its metadata is
+            # already up to date, and ensure 'mock' group can access build
+            # directory
             cmd = [
                 f"cd {self.executor.get_repository_dir()}",
-                "createrepo_c .",
+                "test -e repodata/repomd.xml || createrepo_c .",
                 f"sudo chown -R {self.executor.get_user()}:mock {self.executor.get_build_dir()}",
             ]
 
@@ -279,10 +337,16 @@ class RPMBuildPlugin(RPMDistributionPlugin, BuildPlugin):
                 self.config.cache_dir / "chroot" / self.dist.distribution
             )
             chroot_cache = chroot_cache_topdir / mock_conf.replace(".cfg", "")
+            mount_in = []
             if chroot_cache.exists():
-                copy_in += [
-                    (chroot_cache, self.executor.get_cache_dir() / "mock")
-                ]
+                if self.executor.can_mount_in():
+                    mount_in += [
+                        (chroot_cache, self.executor.get_cache_dir() / "mock")
+                    ]
+                else:
+                    copy_in += [
+                        (chroot_cache, self.executor.get_cache_dir() / "mock")
+                    ]
                 cmd += [
                     f"sudo chown -R root:mock {self.executor.get_cache_dir() / 'mock'}"
                 ]
@@ -300,7 +364,7 @@ class RPMBuildPlugin(RPMDistributionPlugin, BuildPlugin):
             # On Fedora /usr/bin/mock is a (consolehelper) wrapper,
             # which among other things, strips environment variables
             mock_cmd = [
-                "sudo --preserve-env=DIST,PACKAGE_SET,USE_QUBES_REPO_VERSION",
+                "sudo --preserve-env=DIST,PACKAGE_SET,USE_QUBES_REPO_VERSION,CCACHE_ENABLE,CCACHE_MAXSIZE",
                 "/usr/libexec/mock/mock --no-cleanup-after --verbose",
                 f"--rebuild {self.executor.get_build_dir() / source_info['srpm']}",
                 f"--root {self.executor.get_plugins_dir()}/chroot_rpm/mock/{mock_conf}",
@@ -348,17 +412,24 @@ class RPMBuildPlugin(RPMDistributionPlugin, BuildPlugin):
                 f"{self.executor.get_build_dir()} {self.executor.get_build_dir()}/rpm {dist_tag} {self.dist.architecture}"
             ]
             try:
-                self.executor.run(
-                    cmd,
-                    copy_in,
-                    copy_out,
-                    environment=self.environment,
-                    no_fail_copy_out_allowed_patterns=[
-                        "-debugsource",
-                        "-debuginfo",
-                    ],
-                    files_inside_executor_with_placeholders=files_inside_executor_with_placeholders,
-                )
+                # Its metadata refers to packages from its root
+                with local_repository_snapshot(
+                    repository_dir, self.executor.get_repository_dir().name
+                ) as repository:
+                    self.run_with_compiler_cache(
+                        build,
+                        cmd,
+                        copy_in
+                        + [(repository, self.executor.get_builder_dir())],
+                        copy_out,
+                        environment=self.environment,
+                        no_fail_copy_out_allowed_patterns=[
+                            "-debugsource",
+                            "-debuginfo",
+                        ],
+                        files_inside_executor_with_placeholders=files_inside_executor_with_placeholders,
+                        mount_in=mount_in,
+                    )
             except ExecutorError as e:
                 msg = f"{self.component}:{self.dist}:{build}: Failed to build RPMs: {str(e)}."
                 errors, start_line = extract_lines_before(
@@ -392,7 +463,9 @@ class RPMBuildPlugin(RPMDistributionPlugin, BuildPlugin):
                     + [buildinfo_file, source_info["srpm"]]
                 ],
             }
+            return info
 
+        def provision_target(build, info):
             # Provision builder local repository
             provision_local_repository(
                 log=self.log,
@@ -401,15 +474,21 @@ class RPMBuildPlugin(RPMDistributionPlugin, BuildPlugin):
                 dist=self.dist,
                 repository_dir=repository_dir,
                 source_info=info,
-                packages_list=packages_list,
+                packages_list=info["rpms"],
                 prep_artifacts_dir=prep_artifacts_dir,
                 build_artifacts_dir=artifacts_dir,
             )
 
             # Save package information we parsed for next stages
             self.save_dist_artifacts_info(
-                stage=self.stage, basename=build_bn, info=info
+                stage=self.stage, basename=build.mangle(), info=info
             )
 
+        self.run_build_targets(
+            parameters["build"], build_target, provision_target
+        )
+
+        self.save_to_action_cache(artifacts_dir)
+
 
 PLUGINS = [RPMBuildPlugin]
@@ -17,6 +17,7 @@
 #
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import hashlib
 import os.path
 import re
 import shlex
@@ -25,15 +26,24 @@ import tempfile
 import urllib.parse
 from pathlib import Path
 from shlex import quote
-from typing import Any, List, Union
-
-from qubesbuilder.common import VerificationMode, get_archive_name
+from typing import Any, List, Optional, Union
+
+from qubesbuilder.common import (
+    VerificationMode,
+    get_archive_name,
+    get_file_digest,
+    get_temporary_path,
+)
 from qubesbuilder.exc import NoQubesBuilderFileError
 from qubesbuilder.executors import ExecutorError
 from qubesbuilder.executors.local import LocalExecutor
 from qubesbuilder.plugins import ComponentPlugin, PluginError
 
 
+# Maximum number of files downloaded at the same time for a component
+MAX_PARALLEL_DOWNLOADS = 4
+
+
 class FetchError(PluginError):
     pass
 
@@ -75,7 +85,11 @@ class FetchPlugin(ComponentPlugin):
         """
         Run plugin for given stage.
         """
+        # Keep the same cage for all the executor runs of the stage
+        with self.executor.session():
+            self._fetch()
 
+    def _fetch(self):
         # Override provided executor for git phase only
         if self.config.get("git-run-inplace", False):
             executor = LocalExecutor()
@@ -162,6 +176,28 @@ class FetchPlugin(ComponentPlugin):
                 else:
                     copy_in += [(local_source_dir, executor.get_builder_dir())]
 
+        if (
+            do_fetch
+            and not local_source_dir.exists()
+            and self.config.get("git-mirror-cache", False)
+        ):
+            # Persistent mirror of the component repository, so that cloning
+            # again only downloads new objects.
+            mirror_name = (
+                hashlib.sha256(self.component.url.encode()).hexdigest()
+                + ".git"
+            )
+            mirror_dir = self.config.cache_dir / "git" / mirror_name
+            if mirror_dir.exists():
+                copy_in += [(mirror_dir, executor.get_builder_dir())]
+            copy_out += [
+                (executor.get_builder_dir() / mirror_name, mirror_dir.parent)
+            ]
+            get_sources_cmd += [
+                "--git-mirror",
+                str(executor.get_builder_dir() / mirror_name),
+            ]
+
         if do_fetch:
             cmd += [
                 f"cd {str(executor.get_builder_dir())}",
@@ -180,9 +216,10 @@ class FetchPlugin(ComponentPlugin):
 
         # Download and verify files given in .qubesbuilder
         if not self.config.get("skip-files-fetch", False):
+            url_files = []
             for file in parameters.get("files", []):
                 if "url" in file:
-                    self.download_file(file, executor, distfiles_dir)
+                    url_files.append(file)
                 elif "git-url" in file:
                     self.download_git_archive(file, executor, distfiles_dir)
                 else:
@@ -190,6 +227,7 @@ class FetchPlugin(ComponentPlugin):
                         "'files' entries must have either url or git-url entry"
                     )
                     raise FetchError(msg)
+            self.download_files(url_files, executor, distfiles_dir)
 
         #
         # source hash and version tags determination
@@ -381,6 +419,7 @@ class FetchPlugin(ComponentPlugin):
             self.component.increment_devel_versions()
 
         try:
+            self.store_artifacts(distfiles_dir)
             self.save_artifacts_info(
                 stage=self.stage,
                 basename="source",
@@ -422,6 +461,12 @@ class FetchPlugin(ComponentPlugin):
                     f"{self.component}: file {archive_name} already downloaded. Skipping."
                 )
                 return
+        # Each archive gets its own directory as the executor may be kept
+        # across several archives: keys of one archive must not be trusted
+        # for another one.
+        archive_dir = (
+            executor.get_builder_dir() / "git-archives" / archive_name
+        )
         copy_in = [
             (
                 self.manager.entities["fetch"].directory,
@@ -433,11 +478,11 @@ class FetchPlugin(ComponentPlugin):
             copy_in += [
                 (
                     local_source_dir / key_file,
-                    executor.get_builder_dir() / "keys",
+                    archive_dir / "keys",
                 )
             ]
 
-        source_dir = executor.get_builder_dir() / repo_bn
+        source_dir = archive_dir / repo_bn
 
         get_sources_cmd = [
             str(
@@ -448,8 +493,8 @@ class FetchPlugin(ComponentPlugin):
             "--trust-all-keys",
             file["git-url"],  # clone from
             str(source_dir),  # clone into
-            str(executor.get_builder_dir() / "keyring"),  # git keyring dir
-            str(executor.get_builder_dir() / "keys"),  # keys to import
+            str(archive_dir / "keyring"),  # git keyring dir
+            str(archive_dir / "keys"),  # keys to import
         ]
         if "tag" in file:
             get_sources_cmd += ["--git-branch", file["tag"]]
@@ -457,7 +502,8 @@ class FetchPlugin(ComponentPlugin):
             get_sources_cmd += ["--git-commit", file["commit-id"]]
 
         cmd = [
-            f"cd {str(executor.get_builder_dir())}",
+            f"mkdir -p {str(archive_dir)}",
+            f"cd {str(archive_dir)}",
             " ".join(get_sources_cmd),
             f"{executor.get_plugins_dir()}/fetch/scripts/create-archive {source_dir} {archive_name} {archive_base}/",
         ]
@@ -469,70 +515,196 @@ class FetchPlugin(ComponentPlugin):
         except ExecutorError as e:
             raise FetchError(f"Failed to download file '{file}': {str(e)}.")
 
-    def download_file(self, file, executor, distfiles_dir):
-        # Temporary dir for downloaded file
-        temp_dir = Path(tempfile.mkdtemp(dir=self.config.temp_dir))
-        #
-        # download
-        #
-        parsed_url = urllib.parse.urlparse(file["url"])
-        fn = str(os.path.basename(parsed_url.geturl()))
-        # If we request to uncompress the file we drop the archive suffix
-        if file.get("uncompress", False):
-            final_fn = Path(fn).with_suffix("").name
-        else:
-            final_fn = fn
-        untrusted_final_fn = "untrusted_" + final_fn
-        if (distfiles_dir / final_fn).exists():
-            if self.config.force_fetch:
-                os.remove(distfiles_dir / final_fn)
+    def get_distfiles_cache_path(self, file) -> Optional[Path]:
+        """
+        Returns the location of file in distfiles cache, keyed by the
+        checksum declared for it.
+        """
+        cache_dir = self.config.distfiles_cache_dir
+        if not cache_dir:
+            return None
+        # Same checksum as the one used for verification
+        for algorithm, length in (("sha256", 64), ("sha512", 128)):
+            if not file.get(algorithm, None):
+                continue
+            try:
+                checksum_file = self.component.source_dir / file[algorithm]
+                digest = checksum_file.read_text().split()[0].lower()
+            except (OSError, IndexError):
+                return None
+            if not re.match(rf"\A[0-9a-f]{{{length}}}\Z", digest):
+                return None
+            return cache_dir / algorithm / digest[:2] / digest
+        return None
+
+    def get_from_distfiles_cache(self, cache_path: Path, path: Path) -> bool:
+        if not cache_path.exists():
+            return False
+        algorithm, digest = cache_path.parts[-3], cache_path.name
+        try:
+            if get_file_digest(cache_path, algorithm) != digest:
+                self.log.warning(
+                    f"{self.component}: wrong checksum for '{cache_path}' in distfiles cache."
+                )
+                return False
+            try:
+                os.link(cache_path, path)
+            except OSError:
+                shutil.copy2(cache_path, path)
+        except OSError as e:
+            self.log.warning(
+                f"{self.component}: cannot get '{path.name}' from distfiles cache: {str(e)}."
+            )
+            return False
+        return True
+
+    def add_to_distfiles_cache(self, path: Path, cache_path: Path):
+        tmp_path = get_temporary_path(cache_path)
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.link(path, tmp_path)
+            except OSError:
+                shutil.copy2(path, tmp_path)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            self.log.warning(
+                f"{self.component}: cannot add '{path.name}' to distfiles cache: {str(e)}."
+            )
+
+    def download_files(self, files, executor, distfiles_dir):
+        """
+        Download files concurrently in one executor, then verify each of
+        them separately.
+        """
+        downloads = []
+        for file in files:
+            parsed_url = urllib.parse.urlparse(file["url"])
+            fn = str(os.path.basename(parsed_url.geturl()))
+            # If we request to uncompress the file we drop the archive suffix
+            if file.get("uncompress", False):
+                final_fn = Path(fn).with_suffix("").name
             else:
+                final_fn = fn
+            if (distfiles_dir / final_fn).exists():
+                if self.config.force_fetch:
+                    os.remove(distfiles_dir / final_fn)
+                else:
+                    self.log.info(
+                        f"{self.component}: file {final_fn} already downloaded. Skipping."
+                    )
+                    continue
+
+            # Verified files are shared with other components and builders
+            # through distfiles cache, no need to download them again.
+            cache_path = self.get_distfiles_cache_path(file)
+            if cache_path and self.get_from_distfiles_cache(
+                cache_path, distfiles_dir / final_fn
+            ):
                 self.log.info(
-                    f"{self.component}: file {final_fn} already downloaded. Skipping."
+                    f"{self.component}: file {final_fn} found in distfiles cache. Skipping."
                 )
-                return
+                continue
+            downloads.append((file, fn, final_fn, cache_path))
+
+        if not downloads:
+            return
+
+        # Temporary dir for downloaded files
+        temp_dir = Path(tempfile.mkdtemp(dir=self.config.temp_dir))
+        # Partial downloads from a previous interrupted fetch
+        partial_dir = (
+            self.config.cache_dir / "partial-downloads" / self.component.name
+        )
+        downloads_dir = executor.get_builder_dir() / "downloads"
         copy_in = [
             (
                 self.manager.entities["fetch"].directory,
                 executor.get_plugins_dir(),
             ),
-            (self.component.source_dir, executor.get_builder_dir()),
-        ]
-        source_dir = executor.get_builder_dir() / self.component.name
-        copy_out = [(source_dir / untrusted_final_fn, temp_dir)]
-        # Construct command for "download-file".
-        download_cmd = [
-            str(executor.get_plugins_dir() / "fetch/scripts/download-file"),
-            "--output-dir",
-            str(executor.get_builder_dir() / self.component.name),
-            "--file-name",
-            fn,
-            "--file-url",
-            file["url"],
         ]
-        if file.get("signature", None):
-            download_cmd += ["--signature-url", file["signature"]]
-            signature_fn = os.path.basename(file["signature"])
-            untrusted_signature_fn = "untrusted_" + signature_fn
-            copy_out += [
-                (
-                    executor.get_builder_dir()
-                    / self.component.name
-                    / untrusted_signature_fn,
-                    temp_dir,
-                )
+        if partial_dir.exists():
+            copy_in += [
+                (partial_file, downloads_dir)
+                for partial_file in sorted(partial_dir.glob("*.part"))
+            ]
+        # Downloaded files, and partial ones, are copied out even if some
+        # downloads failed.
+        copy_out = [(downloads_dir, temp_dir)]
+        download_cmds = []
+        for file, fn, _, _ in downloads:
+            # Construct command for "download-file".
+            download_cmd = [
+                str(
+                    executor.get_plugins_dir() / "fetch/scripts/download-file"
+                ),
+                "--output-dir",
+                str(downloads_dir),
+                "--file-name",
+                fn,
+                "--file-url",
+                file["url"],
             ]
-        if file.get("uncompress", False):
-            download_cmd += ["--uncompress"]
-        cmd = [" ".join(map(shlex.quote, download_cmd))]
+            if file.get("signature", None):
+                download_cmd += ["--signature-url", file["signature"]]
+            if file.get("uncompress", False):
+                download_cmd += ["--uncompress"]
+            download_cmds.append(
+                f"{quote_list(download_cmd)} & "
+                f'[ "$(jobs -rp | wc -l)" -lt {MAX_PARALLEL_DOWNLOADS} ] '
+                f"|| wait -n;"
+            )
+        cmd = [
+            quote_list(["mkdir", "-p", downloads_dir]),
+            "{ " + " ".join(download_cmds) + " wait; }",
+        ]
         try:
             executor.run(cmd, copy_in, copy_out, environment=self.environment)
         except ExecutorError as e:
             shutil.rmtree(temp_dir)
-            raise FetchError(f"Failed to download file '{file}': {str(e)}.")
-        #
-        # verify
-        #
+            raise FetchError(f"Failed to download files: {str(e)}.")
+
+        # Keep partial downloads to resume them next time. Previous ones have
+        # either been completed or are replaced.
+        try:
+            if partial_dir.exists():
+                shutil.rmtree(partial_dir)
+            for partial_file in (temp_dir / "downloads").glob("*.part"):
+                partial_dir.mkdir(parents=True, exist_ok=True)
+                shutil.move(partial_file, partial_dir / partial_file.name)
+        except OSError as e:
+            self.log.warning(
+                f"{self.component}: cannot keep partial downloads: {str(e)}."
+            )
+
+        try:
+            download_dir = temp_dir / "downloads"
+            for file, _, final_fn, cache_path in downloads:
+                if not (download_dir / f"untrusted_{final_fn}").exists():
+                    raise FetchError(f"Failed to download file '{file}'.")
+                self.verify_file(file, final_fn, download_dir, executor)
+                shutil.move(download_dir / final_fn, distfiles_dir / final_fn)
+                if file.get("signature", None) and not file.get(
+                    "sha256", file.get("sha512", None)
+                ):
+                    signature_fn = os.path.basename(file["signature"])
+                    shutil.move(
+                        download_dir / signature_fn,
+                        distfiles_dir / signature_fn,
+                    )
+                if cache_path:
+                    self.add_to_distfiles_cache(
+                        distfiles_dir / final_fn, cache_path
+                    )
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def verify_file(self, file, final_fn, download_dir, executor):
+        """
+        Verify a downloaded file in a local executor. The verified file is
+        written next to the downloaded one, without the 'untrusted_' prefix.
+        """
+        untrusted_final_fn = "untrusted_" + final_fn
         # Keep executor workflow if we move verification of files in another
         # cage type (copy-in, copy-out and cmd would need adjustments).
         if isinstance(executor, LocalExecutor):
@@ -543,17 +715,15 @@ class FetchPlugin(ComponentPlugin):
             local_executor = LocalExecutor()
         local_executor.log = self.log.getChild("fetch")
 
-        copy_in = []
-        copy_out = [(temp_dir / final_fn, distfiles_dir)]
         # Construct command for "verify-file".
         verify_cmd = [
             str(
                 self.manager.entities["fetch"].directory / "scripts/verify-file"
             ),
             "--output-dir",
-            str(temp_dir),
+            str(download_dir),
             "--untrusted-file",
-            str(temp_dir / untrusted_final_fn),
+            str(download_dir / untrusted_final_fn),
         ]
         if file.get("sha256", None):
             verify_cmd += [
@@ -574,13 +744,7 @@ class FetchPlugin(ComponentPlugin):
             untrusted_signature_fn = "untrusted_" + signature_fn
             verify_cmd += [
                 "--untrusted-signature-file",
-                str(temp_dir / untrusted_signature_fn),
-            ]
-            copy_out += [
-                (
-                    temp_dir / signature_fn,
-                    distfiles_dir,
-                )
+                str(download_dir / untrusted_signature_fn),
             ]
         else:
             raise FetchError(f"No verification method for {final_fn}")
@@ -592,13 +756,9 @@ class FetchPlugin(ComponentPlugin):
                 ]
         cmd = [" ".join(map(shlex.quote, verify_cmd))]
         try:
-            local_executor.run(
-                cmd, copy_in, copy_out, environment=self.environment
-            )
+            local_executor.run(cmd, environment=self.environment)
         except ExecutorError as e:
             raise FetchError(f"Failed to verify file '{file}': {str(e)}.")
-        finally:
-            shutil.rmtree(temp_dir)
 
 
 PLUGINS = [FetchPlugin]
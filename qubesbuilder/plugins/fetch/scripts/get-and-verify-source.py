@@ -79,6 +79,94 @@ def verify_git_obj(gpg_client, keyring_dir, repository_dir, obj_type, obj_path):
         print(f"ERROR: {e!r}; stderr: {e.stderr}")
 
 
+def update_git_mirror(git_url, mirror):
+    """
+    Create or update a bare mirror of branches and tags of git_url. Only
+    objects not already in the mirror are downloaded.
+    """
+    if not (mirror / "objects").is_dir():
+        if mirror.is_dir() and not mirror.is_symlink():
+            shutil.rmtree(mirror)
+        elif mirror.exists() or mirror.is_symlink():
+            mirror.unlink()
+        subprocess.run(
+            ["git", "init", "-q", "--bare", str(mirror)],
+            capture_output=True,
+            check=True,
+        )
+    subprocess.run(
+        ["git", "--git-dir", str(mirror), "fetch", "-q", "--prune"]
+        + ["--", git_url, "+refs/heads/*:refs/heads/*"]
+        + ["+refs/tags/*:refs/tags/*"],
+        capture_output=True,
+        check=True,
+    )
+
+
+def clone_repository(
+    git_url, repo, git_branch, git_options, git_commit=None, git_mirror=None
+):
+    """
+    Clone git_branch, or git_commit, of git_url into repo. Objects already in
+    git_mirror are not downloaded again. They are copied into the clone,
+    which does not depend on the mirror afterward.
+    """
+    looks_like_commit = re.match(r"^[a-fA-F0-9]{40}$", git_branch)
+    if git_commit or looks_like_commit:
+        # git clone can't handle commit reference, use fetch instead
+        repo.mkdir()
+        subprocess.run(
+            ["git", "init"],
+            capture_output=True,
+            cwd=repo,
+            check=True,
+        )
+        alternates = repo / ".git/objects/info/alternates"
+        if git_mirror:
+            alternates.write_text(f"{git_mirror / 'objects'}\n")
+        subprocess.run(
+            ["git", "fetch"]
+            + (["--tags"] if looks_like_commit else [])
+            + git_options
+            + ["--", git_url, git_branch],
+            capture_output=True,
+            cwd=repo,
+            check=True,
+        )
+        subprocess.run(
+            ["git", "reset", "-q", "--soft", "FETCH_HEAD"],
+            capture_output=True,
+            cwd=repo,
+            check=True,
+        )
+        if git_mirror:
+            # Same as 'git clone --dissociate'
+            subprocess.run(
+                ["git", "repack", "-a", "-d", "-q"],
+                capture_output=True,
+                cwd=repo,
+                check=True,
+            )
+            alternates.unlink()
+    else:
+        reference_options = []
+        if git_mirror:
+            reference_options = [
+                "--reference",
+                str(git_mirror),
+                "--dissociate",
+            ]
+        subprocess.run(
+            ["git", "clone"]
+            + git_options
+            + reference_options
+            + ["-n", "-q", "-b", git_branch]
+            + ["--", git_url, str(repo)],
+            capture_output=True,
+            check=True,
+        )
+
+
 def main(args):
     # Sanity check on branch and repo
     if not re.match(r"^[A-Za-z0-9][A-Za-z0-9/._-]+$", args.git_branch):
@@ -182,40 +270,39 @@ def main(args):
     else:
         if repo.exists():
             shutil.rmtree(repo)
+        git_mirror = None
+        if args.git_mirror and not args.shallow_clone:
+            git_mirror = Path(args.git_mirror).expanduser().resolve()
+            try:
+                update_git_mirror(git_url, git_mirror)
+            except (subprocess.CalledProcessError, OSError) as e:
+                stderr = getattr(e, "stderr", None) or str(e)
+                print(f"WARNING: Cannot update git mirror: {stderr}")
+                git_mirror = None
+
         try:
-            looks_like_commit = re.match(r"^[a-fA-F0-9]{40}$", git_branch)
-            if args.git_commit or looks_like_commit:
-                # git clone can't handle commit reference, use fetch instead
-                repo.mkdir()
-                subprocess.run(
-                    ["git", "init"],
-                    capture_output=True,
-                    cwd=repo,
-                    check=True,
-                )
-                subprocess.run(
-                    ["git", "fetch"]
-                    + (["--tags"] if looks_like_commit else [])
-                    + git_options
-                    + ["--", git_url, git_branch],
-                    capture_output=True,
-                    cwd=repo,
-                    check=True,
+            try:
+                clone_repository(
+                    git_url,
+                    repo,
+                    git_branch,
+                    git_options,
+                    git_commit=args.git_commit,
+                    git_mirror=git_mirror,
                 )
-                subprocess.run(
-                    ["git", "reset", "-q", "--soft", "FETCH_HEAD"],
-                    capture_output=True,
-                    cwd=repo,
-                    check=True,
-                )
-            else:
-                subprocess.run(
-                    ["git", "clone"]
-                    + git_options
-                    + ["-n", "-q", "-b", git_branch]
-                    + ["--", git_url, str(repo)],
-                    capture_output=True,
-                    check=True,
+            except subprocess.CalledProcessError as e:
+                if not git_mirror:
+                    raise e
+                # The mirror may be stale or corrupted, do without it
+                print(f"WARNING: Cannot clone using git mirror: {e.stderr}")
+                if repo.exists():
+                    shutil.rmtree(repo)
+                clone_repository(
+                    git_url,
+                    repo,
+                    git_branch,
+                    git_options,
+                    git_commit=args.git_commit,
                 )
         except subprocess.CalledProcessError as e:
             if ignore_missing:
@@ -324,8 +411,13 @@ def main(args):
                 check=True,
             )
 
+        # Only stop the agent of this keyring, other fetch jobs may be
+        # running in parallel with their own keyring and agent.
         subprocess.run(
-            ["gpgconf", "--kill", "gpg-agent"], check=True, capture_output=True
+            ["gpgconf", "--kill", "gpg-agent"],
+            check=True,
+            capture_output=True,
+            env=env,
         )
         expected_hash = verify_ref
         hash_len = len(expected_hash)
@@ -537,6 +629,10 @@ def get_args():
         action="store_true",
         help="Fetch git repo with --depth=1 to reduce amount of data.",
     )
+    parser.add_argument(
+        "--git-mirror",
+        help="Local bare mirror to update and to take objects from when cloning.",
+    )
     parser.add_argument(
         "--fetch-only",
         action="store_true",
@@ -134,238 +134,286 @@ class RPMSourcePlugin(RPMDistributionPlugin, SourcePlugin):
         create_archive = not parameters.get("files", [])
         create_archive = parameters.get("create-archive", create_archive)
 
-        for build in parameters["build"]:
-            # Temporary dir for temporary copied-out files
-            temp_dir = Path(tempfile.mkdtemp())
-
-            # Source component directory inside executors
-            source_dir = self.executor.get_builder_dir() / self.component.name
-
-            # spec file basename will be used as prefix for some artifacts
-            build_bn = build.mangle()
+        def prepare_target(build):
+            with self.executor.session():
+                # Temporary dir for temporary copied-out files
+                temp_dir = Path(tempfile.mkdtemp())
+
+                # Source component directory inside executors
+                source_dir = (
+                    self.executor.get_builder_dir() / self.component.name
+                )
 
-            # generate expected artifacts info filename for sanity checks
-            artifacts_info_filename = self.get_artifacts_info_filename(
-                self.stage, build_bn
-            )
+                # spec file basename will be used as prefix for some artifacts
+                build_bn = build.mangle()
 
-            # Generate %{name}-%{version}-%{release} and %Source0
-            copy_in = self.default_copy_in(
-                self.executor.get_plugins_dir(), self.executor.get_sources_dir()
-            ) + [
-                (self.component.source_dir, self.executor.get_builder_dir()),
-            ]
-
-            copy_out = [
-                (source_dir / f"{build_bn}_package_release_name", temp_dir),
-                (source_dir / f"{build_bn}_packages.list", temp_dir),
-            ]
-
-            if self.config.increment_devel_versions:
-                dist_tag = f"{self.component.devel}.{self.dist.tag}"
-            else:
-                dist_tag = self.dist.tag
-
-            cmd = [
-                f"{self.executor.get_plugins_dir()}/source_rpm/scripts/get-source-info "
-                f"{source_dir} {source_dir / build} {dist_tag}"
-            ]
-            try:
-                self.executor.run(
-                    cmd, copy_in, copy_out, environment=self.environment
+                # generate expected artifacts info filename for sanity checks
+                artifacts_info_filename = self.get_artifacts_info_filename(
+                    self.stage, build_bn
                 )
-            except ExecutorError as e:
-                msg = f"{self.component}:{self.dist}:{build}: Failed to get source information: {str(e)}."
-                raise SourceError(msg) from e
-
-            # Read package release name
-            with open(temp_dir / f"{build_bn}_package_release_name") as f:
-                data = f.read().splitlines()
-            if len(data) < 2:
-                msg = f"{self.component}:{self.dist}:{build}: Invalid data."
-                raise SourceError(msg)
-
-            source_rpm = f"{data[0]}.src.rpm"
-            if not is_filename_valid(
-                source_rpm, forbidden_filename=artifacts_info_filename
-            ):
-                msg = f"{self.component}:{self.dist}:{build}: Invalid source rpm name."
-                raise SourceError(msg)
-
-            source_orig = None
-            if create_archive:
-                # Source0 may contain a URL.
-                source_orig = os.path.basename(data[1])
-                if not is_filename_valid(
-                    source_orig, forbidden_filename=artifacts_info_filename
-                ):
-                    msg = f"{self.component}:{self.dist}:{build}: Invalid source names."
-                    raise SourceError(msg)
 
-            # Read packages list
-            packages_list = []
-            with open(temp_dir / f"{build_bn}_packages.list") as f:
-                data = f.read().splitlines()
-            for line in data:
-                if not is_filename_valid(line, allowed_ext=[".rpm"]):
-                    msg = f"{self.component}:{self.dist}:{build}: Invalid package name."
-                    raise SourceError(msg)
-                packages_list.append(line)
+                # Generate %{name}-%{version}-%{release} and %Source0
+                copy_in = self.default_copy_in(
+                    self.executor.get_plugins_dir(),
+                    self.executor.get_sources_dir(),
+                ) + [
+                    (
+                        self.component.source_dir,
+                        self.executor.get_builder_dir(),
+                    ),
+                ]
 
-            #
-            # Create source RPM
-            #
+                copy_out = [
+                    (
+                        source_dir / f"{build_bn}_package_release_name",
+                        temp_dir,
+                    ),
+                    (source_dir / f"{build_bn}_packages.list", temp_dir),
+                ]
 
-            # Copy-in distfiles, content and source
-            copy_in = self.default_copy_in(
-                self.executor.get_plugins_dir(), self.executor.get_sources_dir()
-            ) + [
-                (distfiles_dir, self.executor.get_distfiles_dir()),
-                (self.component.source_dir, self.executor.get_builder_dir()),
-            ]
+                if self.config.increment_devel_versions:
+                    dist_tag = f"{self.component.devel}.{self.dist.tag}"
+                else:
+                    dist_tag = self.dist.tag
 
-            # Copy-out source RPM
-            copy_out = [
-                (self.executor.get_build_dir() / source_rpm, artifacts_dir),
-            ]
+                cmd = [
+                    f"{self.executor.get_plugins_dir()}/source_rpm/scripts/get-source-info "
+                    f"{source_dir} {source_dir / build} {dist_tag}"
+                ]
+                try:
+                    self.executor.run(
+                        cmd, copy_in, copy_out, environment=self.environment
+                    )
+                except ExecutorError as e:
+                    msg = f"{self.component}:{self.dist}:{build}: Failed to get source information: {str(e)}."
+                    raise SourceError(msg) from e
+
+                # Read package release name
+                with open(temp_dir / f"{build_bn}_package_release_name") as f:
+                    data = f.read().splitlines()
+                if len(data) < 2:
+                    msg = (
+                        f"{self.component}:{self.dist}:{build}: Invalid data."
+                    )
+                    raise SourceError(msg)
 
-            # Init command with .qubesbuilder command entries and then run 'mock' to generate source RPM
-            cmd = parameters.get("source", {}).get("commands", [])
+                source_rpm = f"{data[0]}.src.rpm"
+                if not is_filename_valid(
+                    source_rpm, forbidden_filename=artifacts_info_filename
+                ):
+                    msg = f"{self.component}:{self.dist}:{build}: Invalid source rpm name."
+                    raise SourceError(msg)
 
-            mock_conf = f"{self.dist.fullname}-{self.dist.version}-{self.dist.architecture}.cfg"
+                source_orig = None
+                if create_archive:
+                    # Source0 may contain a URL.
+                    source_orig = os.path.basename(data[1])
+                    if not is_filename_valid(
+                        source_orig, forbidden_filename=artifacts_info_filename
+                    ):
+                        msg = f"{self.component}:{self.dist}:{build}: Invalid source names."
+                        raise SourceError(msg)
+
+                # Read packages list
+                packages_list = []
+                with open(temp_dir / f"{build_bn}_packages.list") as f:
+                    data = f.read().splitlines()
+                for line in data:
+                    if not is_filename_valid(line, allowed_ext=[".rpm"]):
+                        msg = f"{self.component}:{self.dist}:{build}: Invalid package name."
+                        raise SourceError(msg)
+                    packages_list.append(line)
+
+                #
+                # Create source RPM
+                #
+
+                # Copy-in distfiles, content and source
+                copy_in = self.default_copy_in(
+                    self.executor.get_plugins_dir(),
+                    self.executor.get_sources_dir(),
+                ) + [
+                    (distfiles_dir, self.executor.get_distfiles_dir()),
+                    (
+                        self.component.source_dir,
+                        self.executor.get_builder_dir(),
+                    ),
+                ]
 
-            # Add prepared chroot cache
-            chroot_cache_topdir = (
-                self.config.cache_dir / "chroot" / self.dist.distribution
-            )
-            chroot_cache = chroot_cache_topdir / mock_conf.replace(".cfg", "")
-            if chroot_cache.exists():
-                copy_in += [
-                    (chroot_cache, self.executor.get_cache_dir() / "mock")
+                # Copy-out source RPM
+                copy_out = [
+                    (
+                        self.executor.get_build_dir() / source_rpm,
+                        artifacts_dir,
+                    ),
                 ]
-                cmd += [
-                    f"sudo chown -R root:mock {self.executor.get_cache_dir() / 'mock'}"
+
+                # Remove source information files from the previous run in
+                # the same session, so they don't end up in the source archive
+                cmd = [
+                    f"rm -f {source_dir}/{build_bn}_package_release_name "
+                    f"{source_dir}/{build_bn}_packages.list"
                 ]
 
-            if self.component.is_salt():
-                if not (
-                    self.component.source_dir / "Makefile.install"
-                ).exists():
-                    copy_in += [
-                        (
-                            self.manager.entities["source"].directory
-                            / "salt/Makefile.install",
-                            source_dir,
-                        )
+                # Add .qubesbuilder command entries and then run 'mock' to generate source RPM
+                cmd += parameters.get("source", {}).get("commands", [])
+
+                mock_conf = f"{self.dist.fullname}-{self.dist.version}-{self.dist.architecture}.cfg"
+
+                # Add prepared chroot cache
+                chroot_cache_topdir = (
+                    self.config.cache_dir / "chroot" / self.dist.distribution
+                )
+                chroot_cache = chroot_cache_topdir / mock_conf.replace(
+                    ".cfg", ""
+                )
+                mount_in = []
+                if chroot_cache.exists():
+                    if self.executor.can_mount_in():
+                        mount_in += [
+                            (
+                                chroot_cache,
+                                self.executor.get_cache_dir() / "mock",
+                            )
+                        ]
+                    else:
+                        copy_in += [
+                            (
+                                chroot_cache,
+                                self.executor.get_cache_dir() / "mock",
+                            )
+                        ]
+                    cmd += [
+                        f"sudo chown -R root:mock {self.executor.get_cache_dir() / 'mock'}"
                     ]
-                cmd += [
-                    f"{self.executor.get_plugins_dir()}/source/salt/yaml-dumper "
-                    "--env VERBOSE "
-                    f"--outfile {source_dir}/Makefile.vars -- "
-                    f"{self.executor.get_plugins_dir()}/source/salt/FORMULA-DEFAULTS {source_dir}/FORMULA"
-                ]
-            if create_archive:
-                # If no Source0 is provided, we expect 'source' from query-spec.
-                if source_orig != "source":
+
+                if self.component.is_salt():
+                    if not (
+                        self.component.source_dir / "Makefile.install"
+                    ).exists():
+                        copy_in += [
+                            (
+                                self.manager.entities["source"].directory
+                                / "salt/Makefile.install",
+                                source_dir,
+                            )
+                        ]
                     cmd += [
-                        f"{self.executor.get_plugins_dir()}/fetch/scripts/create-archive {source_dir} {source_orig}",
+                        f"{self.executor.get_plugins_dir()}/source/salt/yaml-dumper "
+                        "--env VERBOSE "
+                        f"--outfile {source_dir}/Makefile.vars -- "
+                        f"{self.executor.get_plugins_dir()}/source/salt/FORMULA-DEFAULTS {source_dir}/FORMULA"
                     ]
+                if create_archive:
+                    # If no Source0 is provided, we expect 'source' from query-spec.
+                    if source_orig != "source":
+                        cmd += [
+                            f"{self.executor.get_plugins_dir()}/fetch/scripts/create-archive {source_dir} {source_orig}",
+                        ]
+
+                for file in parameters.get("files", []):
+                    fn = get_archive_name(file)
+                    cmd.append(
+                        f"mv {self.executor.get_distfiles_dir() / self.component.name / fn} {source_dir}"
+                    )
+                    if file.get("signature", None):
+                        cmd.append(
+                            f"mv {self.executor.get_distfiles_dir() / self.component.name / os.path.basename(file['signature'])} {source_dir}"
+                        )
 
-            for file in parameters.get("files", []):
-                fn = get_archive_name(file)
-                cmd.append(
-                    f"mv {self.executor.get_distfiles_dir() / self.component.name / fn} {source_dir}"
-                )
-                if file.get("signature", None):
+                for module in fetch_info.get("modules", []):
                     cmd.append(
-                        f"mv {self.executor.get_distfiles_dir() / self.component.name / os.path.basename(file['signature'])} {source_dir}"
+                        f"mv {self.executor.get_distfiles_dir() / self.component.name / module['archive']} {source_dir}"
+                    )
+                    cmd.append(
+                        f"sed -i 's/@{module['name']}@/{module['archive']}/g' {source_dir / build}.in"
                     )
 
-            for module in fetch_info.get("modules", []):
-                cmd.append(
-                    f"mv {self.executor.get_distfiles_dir() / self.component.name / module['archive']} {source_dir}"
-                )
-                cmd.append(
-                    f"sed -i 's/@{module['name']}@/{module['archive']}/g' {source_dir / build}.in"
-                )
+                # Generate the spec that Mock will use for creating source RPM ensure 'mock'
+                # group can access build directory
+                cmd += [
+                    f"{self.executor.get_plugins_dir()}/source_rpm/scripts/generate-spec {source_dir} {source_dir / build}.in {source_dir / build}",
+                    f"mkdir -p {self.executor.get_build_dir()}",
+                    f"sudo chown -R {self.executor.get_user()}:mock {self.executor.get_build_dir()}",
+                ]
 
-            # Generate the spec that Mock will use for creating source RPM ensure 'mock'
-            # group can access build directory
-            cmd += [
-                f"{self.executor.get_plugins_dir()}/source_rpm/scripts/generate-spec {source_dir} {source_dir / build}.in {source_dir / build}",
-                f"mkdir -p {self.executor.get_build_dir()}",
-                f"sudo chown -R {self.executor.get_user()}:mock {self.executor.get_build_dir()}",
-            ]
-
-            mock_cmd = [
-                f"sudo --preserve-env=DIST,PACKAGE_SET,USE_QUBES_REPO_VERSION",
-                f"/usr/libexec/mock/mock",
-                "--verbose",
-                "--buildsrpm",
-                f"--spec {source_dir / build}",
-                f"--root {self.executor.get_plugins_dir()}/chroot_rpm/mock/{mock_conf}",
-                f"--sources={source_dir}",
-                f"--resultdir={self.executor.get_build_dir()}",
-                "--disablerepo=builder-local",
-            ]
-            if isinstance(self.executor, ContainerExecutor):
-                msg = f"{self.component}:{self.dist}:{build}: Mock isolation set to 'simple', build has full network access. Use 'qubes' executor for network-isolated build."
-                self.log.warning(msg)
-                mock_cmd.append("--isolation=simple")
-            else:
-                mock_cmd.append("--isolation=nspawn")
-            if chroot_cache.exists():
-                mock_cmd.append("--plugin-option=root_cache:age_check=False")
-            if self.config.increment_devel_versions:
-                mock_cmd.append(f"--define 'dist .{dist_tag}'")
-            if chroot_cache.exists():
-                mock_cmd.append("--no-clean")
-
-            files_inside_executor_with_placeholders = [
-                f"@PLUGINS_DIR@/chroot_rpm/mock/{mock_conf}"
-            ]
-
-            cmd += [" ".join(mock_cmd)]
-            try:
-                self.executor.run(
-                    cmd,
-                    copy_in,
-                    copy_out,
-                    environment=self.environment,
-                    files_inside_executor_with_placeholders=files_inside_executor_with_placeholders,
-                )
-            except ExecutorError as e:
-                msg = f"{self.component}:{self.dist}:{build}: Failed to generate SRPM ({str(e)})"
-                errors, start_line = extract_lines_before(
-                    self.log.get_log_file(), "EXCEPTION:.*/usr/bin/rpmbuild -bs"
-                )
-                additional_info = {
-                    "log_file": self.log.get_log_file().name,
-                    "start_line": start_line,
-                    "lines": errors,
-                }
-                raise SourceError(msg, additional_info=additional_info) from e
-
-            # Save package information we parsed for next stages
-            try:
-                info = fetch_info
-                info.update(
-                    {
-                        "files": [source_rpm],
-                        "srpm": source_rpm,
-                        "rpms": packages_list,
-                        "source-hash": self.component.get_source_hash(),
+                mock_cmd = [
+                    f"sudo --preserve-env=DIST,PACKAGE_SET,USE_QUBES_REPO_VERSION",
+                    f"/usr/libexec/mock/mock",
+                    "--verbose",
+                    "--buildsrpm",
+                    f"--spec {source_dir / build}",
+                    f"--root {self.executor.get_plugins_dir()}/chroot_rpm/mock/{mock_conf}",
+                    f"--sources={source_dir}",
+                    f"--resultdir={self.executor.get_build_dir()}",
+                    "--disablerepo=builder-local",
+                ]
+                if isinstance(self.executor, ContainerExecutor):
+                    msg = f"{self.component}:{self.dist}:{build}: Mock isolation set to 'simple', build has full network access. Use 'qubes' executor for network-isolated build."
+                    self.log.warning(msg)
+                    mock_cmd.append("--isolation=simple")
+                else:
+                    mock_cmd.append("--isolation=nspawn")
+                if chroot_cache.exists():
+                    mock_cmd.append(
+                        "--plugin-option=root_cache:age_check=False"
+                    )
+                if self.config.increment_devel_versions:
+                    mock_cmd.append(f"--define 'dist .{dist_tag}'")
+                if chroot_cache.exists():
+                    mock_cmd.append("--no-clean")
+
+                files_inside_executor_with_placeholders = [
+                    f"@PLUGINS_DIR@/chroot_rpm/mock/{mock_conf}"
+                ]
+
+                cmd += [" ".join(mock_cmd)]
+                try:
+                    self.executor.run(
+                        cmd,
+                        copy_in,
+                        copy_out,
+                        environment=self.environment,
+                        files_inside_executor_with_placeholders=files_inside_executor_with_placeholders,
+                        mount_in=mount_in,
+                    )
+                except ExecutorError as e:
+                    msg = f"{self.component}:{self.dist}:{build}: Failed to generate SRPM ({str(e)})"
+                    errors, start_line = extract_lines_before(
+                        self.log.get_log_file(),
+                        "EXCEPTION:.*/usr/bin/rpmbuild -bs",
+                    )
+                    additional_info = {
+                        "log_file": self.log.get_log_file().name,
+                        "start_line": start_line,
+                        "lines": errors,
                     }
-                )
-                self.save_dist_artifacts_info(
-                    stage=self.stage, basename=build_bn, info=info
-                )
+                    raise SourceError(
+                        msg, additional_info=additional_info
+                    ) from e
+
+                # Save package information we parsed for next stages
+                try:
+                    info = dict(fetch_info)
+                    info.update(
+                        {
+                            "files": [source_rpm],
+                            "srpm": source_rpm,
+                            "rpms": packages_list,
+                            "source-hash": self.component.get_source_hash(),
+                        }
+                    )
+                    self.save_dist_artifacts_info(
+                        stage=self.stage, basename=build_bn, info=info
+                    )
+
+                    # Clean temporary directory
+                    shutil.rmtree(temp_dir)
+                except OSError as e:
+                    msg = f"{self.component}:{self.dist}:{build}: Failed to clean artifacts: {str(e)}."
+                    raise SourceError(msg) from e
 
-                # Clean temporary directory
-                shutil.rmtree(temp_dir)
-            except OSError as e:
-                msg = f"{self.component}:{self.dist}:{build}: Failed to clean artifacts: {str(e)}."
-                raise SourceError(msg) from e
+        self.run_build_targets(parameters["build"], prepare_target)
 
 
 PLUGINS = [RPMSourcePlugin]
@@ -0,0 +1,235 @@
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# Copyright (C) 2025 Frédéric Pierret (fepitre) <frederic@invisiblethingslab.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from graphlib import TopologicalSorter
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from qubesbuilder.log import QubesBuilderLogger
+
+
+def get_available_memory() -> Optional[int]:
+    """
+    Return the memory available for starting new processes, in bytes.
+    """
+    try:
+        for line in Path("/proc/meminfo").read_text().splitlines():
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class AdmissionController:
+    """
+    Admit jobs according to host free memory and load.
+
+    Free memory and load average only account for a job some time after it
+    has started. Until then, the memory it needs and one unit of load are
+    reserved, so that several jobs are not admitted on the same figures.
+    """
+
+    def __init__(
+        self,
+        max_load: Optional[float] = None,
+        min_free_memory: Optional[Callable[[Any], int]] = None,
+        settle_time: float = 30,
+    ):
+        self.max_load = max_load
+        self.min_free_memory = min_free_memory
+        self.settle_time = settle_time
+        self._admitted: List[Tuple[float, int]] = []
+
+    def __call__(self, node) -> bool:
+        now = time.monotonic()
+        self._admitted = [
+            (admitted_at, memory)
+            for admitted_at, memory in self._admitted
+            if now - admitted_at < self.settle_time
+        ]
+        reserved_memory = sum(memory for _, memory in self._admitted)
+        reserved_load = len(self._admitted)
+
+        memory = self.min_free_memory(node) if self.min_free_memory else 0
+        if memory:
+            available_memory = get_available_memory()
+            if (
+                available_memory is not None
+                and available_memory - reserved_memory < memory
+            ):
+                return False
+        if self.max_load is not None:
+            if os.getloadavg()[0] + reserved_load >= self.max_load:
+                return False
+
+        self._admitted.append((now, memory))
+        return True
+
+
+class JobScheduler:
+    """
+    Run the nodes of a dependency graph on a pool of workers.
+
+    The graph maps every node to the nodes it depends on, as expected by
+    graphlib.TopologicalSorter. A node is started as soon as all of its
+    dependencies are done. When a node fails, every node depending on it,
+    directly or not, is cancelled while independent nodes keep running.
+
+    The number of nodes running at the same time can be further limited:
+    `limits` returns, for a node, the maximum number of running nodes
+    sharing the same key (e.g. an executor type), and `admit` tells if a
+    node can be started now (e.g. enough free memory). They are not
+    consulted when nothing is running so that every node eventually runs.
+    """
+
+    def __init__(
+        self,
+        graph: Mapping[Any, Iterable[Any]],
+        jobs: int = 1,
+        describe: Callable[[Any], str] = str,
+        limits: Optional[Callable[[Any], Mapping[Any, int]]] = None,
+        admit: Optional[Callable[[Any], bool]] = None,
+        poll_interval: float = 5,
+    ):
+        self.graph = {node: list(deps) for node, deps in graph.items()}
+        self.jobs = max(1, int(jobs))
+        self.describe = describe
+        self.limits = limits
+        self.admit = admit
+        self.poll_interval = poll_interval
+
+        # Nodes that depend on a given node
+        self.dependents: Dict[Hashable, List[Hashable]] = {}
+        for node, deps in self.graph.items():
+            for dep in deps:
+                self.dependents.setdefault(dep, []).append(node)
+
+        self.failed: Dict[Hashable, BaseException] = {}
+        self.cancelled: Set[Hashable] = set()
+
+        # Number of running nodes per limit key
+        self._usage: Dict[Hashable, int] = {}
+
+    def _cancel_dependents(self, node: Hashable):
+        stack = list(self.dependents.get(node, []))
+        while stack:
+            dependent = stack.pop()
+            if dependent in self.cancelled:
+                continue
+            self.cancelled.add(dependent)
+            stack += self.dependents.get(dependent, [])
+
+    def _can_start(self, node: Hashable, limits: Mapping[Any, int]) -> bool:
+        for key, limit in limits.items():
+            if self._usage.get(key, 0) >= max(1, int(limit)):
+                return False
+        if self.admit and not self.admit(node):
+            return False
+        return True
+
+    async def _run(self, func: Callable[[Any], Any], pool: ThreadPoolExecutor):
+        sorter = TopologicalSorter(self.graph)
+        sorter.prepare()
+        pending: List[Hashable] = []
+        running: Dict[asyncio.Future, Tuple[Hashable, Mapping]] = {}
+        loop = asyncio.get_running_loop()
+
+        while sorter.is_active():
+            for node in sorter.get_ready():
+                if node in self.cancelled:
+                    QubesBuilderLogger.warning(
+                        f"{self.describe(node)}: cancelled due to a failed dependency."
+                    )
+                    sorter.done(node)
+                    continue
+                pending.append(node)
+
+            for node in list(pending):
+                if len(running) >= self.jobs:
+                    break
+                limits = self.limits(node) if self.limits else {}
+                if running and not self._can_start(node, limits):
+                    continue
+                pending.remove(node)
+                for key in limits:
+                    self._usage[key] = self._usage.get(key, 0) + 1
+                future = loop.run_in_executor(pool, func, node)
+                running[future] = (node, limits)
+
+            if not running:
+                # Only cancelled nodes were ready, get the next ones.
+                continue
+
+            # Pending nodes may be admitted later on, without waiting
+            # for a running node to complete.
+            done, _ = await asyncio.wait(
+                running,
+                timeout=self.poll_interval if pending else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            for future in done:
+                node, limits = running.pop(future)
+                for key in limits:
+                    self._usage[key] -= 1
+                exc = future.exception()
+                if exc:
+                    QubesBuilderLogger.error(
+                        f"{self.describe(node)}: {str(exc)}"
+                    )
+                    self.failed[node] = exc
+                    self._cancel_dependents(node)
+                sorter.done(node)
+
+    def run(self, func: Callable[[Any], Any]):
+        """
+        Call func on every node of the graph, respecting dependencies.
+
+        This blocks until every node is either done, failed or cancelled.
+        Failed nodes and their exception are available in `failed`.
+        """
+        try:
+            loop = asyncio.get_event_loop()
+        except RuntimeError:
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+
+        pool = ThreadPoolExecutor(max_workers=self.jobs)
+        try:
+            loop.run_until_complete(self._run(func, pool))
+        except BaseException:
+            # On interruption, do not wait for running nodes: they are
+            # stopped by the executors cleanup callbacks.
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        pool.shutdown(wait=True)
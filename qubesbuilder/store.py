@@ -0,0 +1,149 @@
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# Copyright (C) 2025 Frédéric Pierret (fepitre) <frederic@invisiblethingslab.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+import os
+import stat
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+from qubesbuilder.common import get_file_digest, get_temporary_path
+from qubesbuilder.exc import QubesBuilderError
+from qubesbuilder.log import QubesBuilderLogger
+
+# Only packages and archives are stored. Metadata files like .dsc, .changes
+# or .buildinfo are small and are updated in place by signing tools.
+STORE_SUFFIXES = (
+    ".rpm",
+    ".deb",
+    ".ddeb",
+    ".udeb",
+    ".pkg.tar.zst",
+    ".tar",
+    ".tar.gz",
+    ".tar.bz2",
+    ".tar.xz",
+    ".tar.zst",
+    ".tgz",
+    ".zip",
+    ".msi",
+)
+
+
+class ArtifactStoreError(QubesBuilderError):
+    pass
+
+
+class ArtifactStore:
+    """
+    Content-addressed store of artifacts.
+
+    Every file is stored once under its sha256 digest and hardlinked to its
+    location in the artifacts directory. Stored files are read-only: tools
+    updating an artifact (e.g. signing) have to replace it, which detaches it
+    from the store and keeps the stored content intact.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.log = QubesBuilderLogger.getChild("store")
+
+    def get_path(self, digest: str) -> Path:
+        return self.directory / "sha256" / digest[:2] / digest
+
+    def iter_blobs(self) -> Iterator[Path]:
+        blobs_dir = self.directory / "sha256"
+        if not blobs_dir.exists():
+            return
+        for prefix_dir in sorted(blobs_dir.iterdir()):
+            yield from sorted(prefix_dir.iterdir())
+
+    @staticmethod
+    def get_digest(path: Path) -> str:
+        return get_file_digest(path, "sha256")
+
+    @staticmethod
+    def is_stored(path: Path) -> bool:
+        # Stored files are read-only and have at least one other link, the
+        # blob. This avoids hashing them again.
+        st = path.lstat()
+        return (
+            stat.S_ISREG(st.st_mode)
+            and st.st_nlink > 1
+            and not st.st_mode & 0o222
+        )
+
+    def add(self, path: Path) -> Optional[str]:
+        """
+        Store path and replace it by a link to the stored blob.
+
+        Returns the digest of path or None if it cannot be linked into the
+        store, for example because it is on another filesystem.
+        """
+        digest = self.get_digest(path)
+        blob = self.get_path(digest)
+        try:
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.link(path, blob)
+                os.chmod(blob, stat.S_IMODE(blob.stat().st_mode) & ~0o222)
+            except FileExistsError:
+                if os.path.samefile(path, blob):
+                    return digest
+                # Replace path atomically with a link to the existing blob
+                tmp_path = get_temporary_path(path)
+                os.link(blob, tmp_path)
+                os.replace(tmp_path, path)
+        except OSError as e:
+            self.log.debug(f"Cannot store '{path}': {str(e)}")
+            return None
+        return digest
+
+    def add_directory(self, directory: Path) -> List[str]:
+        """
+        Store packages and archives found in directory, recursively.
+        """
+        digests: List[str] = []
+        if not directory.exists():
+            return digests
+        for path in sorted(directory.rglob("*")):
+            if not path.name.endswith(STORE_SUFFIXES) or path.is_symlink():
+                continue
+            if not path.is_file() or self.is_stored(path):
+                continue
+            digest = self.add(path)
+            if digest:
+                digests.append(digest)
+        return digests
+
+    def gc(self, dry_run: bool = False) -> List[Path]:
+        """
+        Remove blobs not linked anymore from the artifacts directory.
+        """
+        removed = []
+        for blob in self.iter_blobs():
+            if blob.stat().st_nlink > 1:
+                continue
+            if not dry_run:
+                try:
+                    blob.unlink()
+                except OSError as e:
+                    raise ArtifactStoreError(
+                        f"Failed to remove '{blob}': {str(e)}"
+                    ) from e
+            removed.append(blob)
+        return removed
@@ -1,10 +1,19 @@
+import io
 import os
 import pathlib
+import shlex
+import tarfile
 import tempfile
 import uuid
 
 import pytest
 
+from qubesbuilder.executors.container import (
+    ChunksReader,
+    ContainerExecutor,
+    ContainerPool,
+)
+
 
 def pytest_addoption(parser):
     parser.addoption(
@@ -55,3 +64,163 @@ def artifacts_dir(pytestconfig):
 
     root.mkdir(parents=True, exist_ok=True)
     yield root
+
+
+FAKE_CURL = """#!/bin/bash
+server=@SERVER@
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -C) resume=1; shift ;;
+        -o) output="$2"; shift ;;
+        --) url="$2"; break ;;
+    esac
+    shift
+done
+if [ -n "$resume" ] && [ -e "$output" ]; then
+    echo "resume $url" >> "$server/.log"
+else
+    echo "$url" >> "$server/.log"
+fi
+mkdir -p "$server/.running"
+touch "$server/.running/$$"
+ls "$server/.running" | wc -l >> "$server/.concurrency"
+sleep "${FAKE_CURL_DELAY:-0}"
+src="$server/${url##*/}"
+ret=0
+if [ -e "$src.partial" ]; then
+    cp "$src.partial" "$output"
+    ret=18
+elif [ ! -e "$src" ]; then
+    ret=22
+elif [ -n "$resume" ] && [ -e "$output" ]; then
+    if [ -e "$server/.no-ranges" ]; then
+        ret=33
+    else
+        tail -c "+$(($(stat -c %s "$output") + 1))" "$src" >> "$output"
+    fi
+else
+    cp "$src" "$output"
+fi
+rm -f "$server/.running/$$"
+exit "$ret"
+"""
+
+
+@pytest.fixture
+def fake_server(tmp_path, monkeypatch):
+    """
+    Directory of files served by a fake 'curl' first in PATH. Requested URLs
+    are logged in '.log', prefixed with 'resume' for resumed downloads, and
+    the number of concurrent requests in '.concurrency'. A file named after the requested one with '.partial'
+    suffix is given instead, as an interrupted transfer. Range requests fail
+    as unsupported if '.no-ranges' exists.
+    """
+    server = tmp_path / "server"
+    server.mkdir()
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    curl = bin_dir / "curl"
+    curl.write_text(FAKE_CURL.replace("@SERVER@", shlex.quote(str(server))))
+    curl.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}:{os.environ['PATH']}")
+    yield server
+
+
+class FakeContainer:
+    """
+    Container of the fake container client, with its root filesystem in a
+    host directory.
+    """
+
+    id = short_id = "fake"
+    status = "running"
+
+    def __init__(self, root):
+        self.root = root
+        self.put_archives = 0
+        self.put_members = []
+        self.removed = False
+        self.changes = []
+
+    def start(self):
+        pass
+
+    def reload(self):
+        pass
+
+    def remove(self, force=False):
+        self.removed = True
+
+    def diff(self):
+        return self.changes
+
+    def put_archive(self, path, data):
+        self.put_archives += 1
+        with tarfile.open(fileobj=ChunksReader(data), mode="r|") as tar:
+            tar.extractall(self.root / path.lstrip("/"))
+            self.put_members += tar.getnames()
+        return True
+
+    def get_archive(self, path):
+        archive = io.BytesIO()
+        src = self.root / path.lstrip("/")
+        with tarfile.open(fileobj=archive, mode="w") as tar:
+            tar.add(src, arcname=src.name)
+        # Streamed in chunks not aligned on tar blocks
+        data = archive.getvalue()
+        return (data[i : i + 1000] for i in range(0, len(data), 1000)), {}
+
+
+@pytest.fixture
+def container_client(tmp_path, monkeypatch):
+    """
+    Fake docker client used by ContainerExecutor, with empty client, image
+    and container pool caches. Created clients, looked up images, and
+    arguments and instances of created containers are recorded as class
+    attributes. Containers have their root in 'container' directory of
+    tmp_path.
+    """
+
+    class FakeImage:
+        attrs = {"Id": "sha256:image"}
+
+    class FakeClient:
+        clients: list = []
+        lookups: list = []
+        created: list = []
+        instances: list = []
+
+        def __init__(self, **kwargs):
+            self.clients.append(kwargs)
+            self.images = self
+            self.containers = self
+
+        def get(self, image):
+            self.lookups.append(image)
+            return FakeImage()
+
+        def create(self, *args, **kwargs):
+            self.created.append((args, kwargs))
+            self.instances.append(FakeContainer(tmp_path / "container"))
+            return self.instances[-1]
+
+    monkeypatch.setattr(
+        "qubesbuilder.executors.container.DockerClient", FakeClient
+    )
+    monkeypatch.setattr(ContainerExecutor, "_clients", {})
+    monkeypatch.setattr(ContainerExecutor, "_images", {})
+    monkeypatch.setattr(ContainerPool, "_pools", {})
+    yield FakeClient
+
+
+@pytest.fixture
+def container_executor(container_client):
+    """
+    Returns a function creating docker executors using the fake container
+    client, with the given executor options.
+    """
+
+    def create(image="fedora:latest", **kwargs):
+        return ContainerExecutor("docker", image, **kwargs)
+
+    yield create
@@ -1,15 +1,28 @@
+import asyncio
+import io
+import itertools
+import logging
 import os.path
+import shutil
 import subprocess
+import sys
+import tarfile
 import tempfile
+import threading
+import time
 from pathlib import Path, PurePath
 
 import pytest
 
+from qubesbuilder.common import PROJECT_PATH, get_file_digest
 from qubesbuilder.exc import QubesBuilderError
 from qubesbuilder.executors import Executor, ExecutorError
-from qubesbuilder.executors.container import ContainerExecutor
-from qubesbuilder.executors.local import LocalExecutor
-from qubesbuilder.executors.qubes import LinuxQubesExecutor
+from qubesbuilder.executors.container import ContainerExecutor, ContainerPool
+from qubesbuilder.executors.local import LocalExecutor, copy_file
+from qubesbuilder.executors.qubes import DispVMPool, LinuxQubesExecutor
+from qubesbuilder.executors.remote import RemoteLinuxExecutor
+from qubesbuilder.log import LogWriter
+from tests.conftest import FakeContainer
 
 
 class MockExecutor(Executor):
@@ -111,6 +124,88 @@ def test_executor_replace_placeholders():
     assert replaced_s == "/builder//builder/build"
 
 
+def test_executor_read_stream():
+    class Stream:
+        def __init__(self, chunks):
+            self.chunks = chunks
+
+        async def read(self, size):
+            return self.chunks.pop(0) if self.chunks else b""
+
+    chunks = [b"first\r\nsec", b"ond\x1b\nthird" + b"x" * 20, b"\nlast"]
+    batches = []
+    output = asyncio.run(
+        Executor._read_stream(
+            Stream(list(chunks)), batches.append, collect=True, max_length=10
+        )
+    )
+    assert output == b"".join(chunks)
+    assert batches == [
+        ["first"],
+        ["second.", "thirdxxxxx\u2026"],
+        ["xxxxxxxxxxxxxxx"],
+        ["last"],
+    ]
+
+
+def test_log_writer():
+    records = []
+
+    class Handler(logging.Handler):
+        def emit(self, record):
+            records.append(record.getMessage())
+
+    logger = logging.getLogger("test-log-writer")
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(Handler())
+    writer = LogWriter()
+    writer.write(logger, ["line 1", "line 2"])
+    writer.write(logger, ["line 3"])
+    writer.write(logger, ["ignored"], level=logging.NOTSET)
+    writer.flush()
+    logger.info("after")
+    assert records == ["line 1", "line 2", "line 3", "after"]
+
+
+@pytest.mark.filterwarnings(
+    "ignore::pytest.PytestUnhandledThreadExceptionWarning"
+)
+def test_log_writer_errors(capsys):
+    records = []
+
+    class Filter(logging.Filter):
+        def filter(self, record):
+            if record.getMessage() == "error":
+                raise ValueError("Broken filter")
+            records.append(record.getMessage())
+            return True
+
+    logger = logging.getLogger("test-log-writer-errors")
+    logger.setLevel(logging.DEBUG)
+    logger.addFilter(Filter())
+    writer = LogWriter()
+    # A batch failing to be logged does not stop the thread
+    writer.write(logger, ["error", "lost"])
+    writer.write(logger, ["line"])
+    writer.flush()
+    assert records == ["line"]
+    assert "Broken filter" in capsys.readouterr().err
+
+    # Flushing does not wait for a thread not running anymore
+    class ExitingLogger:
+        def isEnabledFor(self, level):
+            raise SystemExit
+
+    writer.write(ExitingLogger(), ["exit"])
+    writer._thread.join(5)
+    assert not writer._thread.is_alive()
+    writer.flush()
+    # and a new one is started on next write
+    writer.write(logger, ["after"])
+    writer.flush()
+    assert records == ["line", "after"]
+
+
 def test_executor_error():
     with pytest.raises(ExecutorError) as exc_info:
         raise ExecutorError("Test error")
@@ -328,6 +423,156 @@ def test_local_on_error_noclean():
     executor.cleanup()
 
 
+def test_local_session():
+    executor = LocalExecutor()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        hello = Path(temp_dir) / "hello.md"
+        hello.write_text("Hello!\n")
+        copy_in = [(hello, executor.get_builder_dir() / "tmp")]
+        copy_out = [
+            (executor.get_builder_dir() / "tmp/hello.md", Path(temp_dir))
+        ]
+        cmd = [f"echo It works! >> {executor.get_builder_dir()}/tmp/hello.md"]
+
+        with executor.session():
+            executor.run(cmd, copy_in, [])
+            assert executor._temporary_dir.exists()
+            # Already copied-in file is kept in place and not copied again
+            executor.run(cmd, copy_in, copy_out)
+            assert hello.read_text() == "Hello!\nIt works!\nIt works!\n"
+        assert not executor._temporary_dir.exists()
+
+        # Outside the session, a new cage is used for each run
+        executor.run(cmd, copy_in, copy_out)
+        assert hello.read_text() == "Hello!\nIt works!\nIt works!\nIt works!\n"
+        assert not executor._temporary_dir.exists()
+
+
+def test_local_session_error():
+    executor = LocalExecutor()
+    with pytest.raises(ExecutorError):
+        with executor.session():
+            executor.run(["true"])
+            assert executor._temporary_dir.exists()
+            executor.run(["false"])
+    assert not executor._temporary_dir.exists()
+
+
+def test_local_run_async(tmp_path):
+    # Every run waits for the others to have started: they can only
+    # succeed if they are driven concurrently by the same event loop.
+    executors = [LocalExecutor() for _ in range(3)]
+    copy_out = []
+    for i, executor in enumerate(executors):
+        out = tmp_path / str(i)
+        out.mkdir()
+        copy_out.append([(executor.get_builder_dir() / "hello.md", out)])
+
+    async def run_all():
+        return await asyncio.gather(
+            *[
+                executor.run_async(
+                    [
+                        f"touch {tmp_path}/started-{i}",
+                        "timeout 10 bash -c 'until [ -e "
+                        + " -a -e ".join(
+                            f"{tmp_path}/started-{j}"
+                            for j in range(len(executors))
+                        )
+                        + " ]; do sleep 0.1; done'",
+                        f"echo {i} > {executor.get_builder_dir()}/hello.md",
+                    ],
+                    copy_out=copy_out[i],
+                )
+                for i, executor in enumerate(executors)
+            ]
+        )
+
+    asyncio.run(run_all())
+    for i, executor in enumerate(executors):
+        assert (tmp_path / str(i) / "hello.md").read_text() == f"{i}\n"
+        assert not executor._temporary_dir.exists()
+
+
+@pytest.mark.skipif(os.geteuid() != 0, reason="mounting requires root")
+def test_local_mount_in(tmp_path, monkeypatch):
+    # Running as root, sudo is not needed and may not be installed.
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "sudo").write_text('#!/bin/bash\nexec "$@"\n')
+    (bin_dir / "sudo").chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}:{os.environ['PATH']}")
+
+    chroot_cache = tmp_path / "chroot" / "fedora-42-x86_64"
+    chroot_cache.mkdir(parents=True)
+    (chroot_cache / "cache.tar").write_text("cache")
+
+    assert not LocalExecutor(directory=tmp_path).can_mount_in()
+    executor = LocalExecutor(directory=tmp_path, overlay_mounts=True)
+    assert executor.can_mount_in()
+    mock_dir = executor.get_cache_dir() / "mock"
+    executor.run(
+        [
+            f"cp {mock_dir}/fedora-42-x86_64/cache.tar {executor.get_builder_dir()}",
+            f"echo modified > {mock_dir}/fedora-42-x86_64/cache.tar",
+            f"chown -R nobody {mock_dir}",
+        ],
+        copy_out=[(executor.get_builder_dir() / "cache.tar", tmp_path)],
+        mount_in=[(chroot_cache, mock_dir)],
+    )
+    assert (tmp_path / "cache.tar").read_text() == "cache"
+    # Host directory is left untouched and is not mounted anymore
+    assert (chroot_cache / "cache.tar").read_text() == "cache"
+    assert (chroot_cache / "cache.tar").stat().st_uid == 0
+    assert str(tmp_path) not in Path("/proc/mounts").read_text()
+    assert not executor._temporary_dir.exists()
+
+
+def test_local_copy_file(tmp_path, monkeypatch):
+    src = tmp_path / "src"
+    src.write_text("content")
+    dst = tmp_path / "dst"
+    dst.mkdir()
+
+    # Reflink
+    ioctls = []
+    monkeypatch.setattr(
+        "fcntl.ioctl", lambda fd, request, arg: ioctls.append(request)
+    )
+    copy_file(str(src), str(dst))
+    assert ioctls == [0x40049409]
+
+    def not_supported(*args):
+        raise OSError(95, "Operation not supported")
+
+    # In kernel copy, existing file is replaced and not written into
+    monkeypatch.setattr("fcntl.ioctl", not_supported)
+    os.link(dst / "src", tmp_path / "other")
+    copy_file(str(src), str(dst))
+    assert (dst / "src").read_text() == "content"
+    assert not os.path.samefile(dst / "src", tmp_path / "other")
+
+    # Regular copy
+    monkeypatch.setattr("os.copy_file_range", not_supported)
+    src.write_text("new content")
+    copy_file(str(src), str(dst / "copy"))
+    assert (dst / "copy").read_text() == "new content"
+    assert (dst / "copy").stat().st_mtime == src.stat().st_mtime
+
+    # Read-only files are hardlinked on copy-out only, files of the cage
+    # must not share their inode with host ones
+    src.chmod(0o444)
+    executor = LocalExecutor()
+    executor.copy_in(tmp_path / "dst", executor.get_builder_dir())
+    executor.copy_in(src, executor.get_builder_dir())
+    assert not os.path.samefile(src, executor.get_builder_dir() / "src")
+    out = tmp_path / "out"
+    executor.copy_out(executor.get_builder_dir() / "src", out)
+    assert os.path.samefile(executor.get_builder_dir() / "src", out / "src")
+    executor.cleanup()
+    assert (out / "src").read_text() == "new content"
+
+
 def test_qubes_clean_on_error():
     executor = LinuxQubesExecutor(
         os.environ.get("QUBES_EXECUTOR_DISPVM", "builder-dvm")
@@ -380,3 +625,540 @@ def test_qubes_on_error_noclean():
     )
 
     executor.cleanup()
+
+
+def test_qubes_dispvm_pool(monkeypatch):
+    names = itertools.count()
+    created = []
+    cleaned = []
+    halted = set()
+
+    def prepare_dispvm(self):
+        self.dispvm = f"disp{next(names)}"
+        created.append(self.dispvm)
+
+    monkeypatch.setattr(LinuxQubesExecutor, "_prepare_dispvm", prepare_dispvm)
+    monkeypatch.setattr(
+        LinuxQubesExecutor, "cleanup", lambda self: cleaned.append(self.dispvm)
+    )
+    monkeypatch.setattr(
+        "qubesbuilder.executors.qubes.vm_state",
+        lambda executor, vm: "Halted" if vm in halted else "Running",
+    )
+
+    monkeypatch.setattr(DispVMPool, "_pools", {})
+
+    def wait_provisioning():
+        for thread in pool._threads:
+            thread.join()
+
+    # The pool is only started on first run
+    executor = LinuxQubesExecutor(dispvm="builder-dvm", warm_pool=2)
+    assert not DispVMPool._pools
+    pool = executor.get_pool()
+    assert DispVMPool._pools == {"builder-dvm": pool}
+    assert all(thread.daemon for thread in pool._threads)
+    wait_provisioning()
+    assert sorted(created) == ["disp0", "disp1"]
+
+    # Qubes are provisioned concurrently and ready in any order
+    first = pool.acquire()
+    assert first in created
+    wait_provisioning()
+    # Remaining one is not running anymore, it is thrown away.
+    stale = ({"disp0", "disp1"} - {first}).pop()
+    halted.add(stale)
+    assert pool.acquire() == "disp2"
+    assert cleaned == [stale]
+    assert pool.hits == 2 and pool.misses == 0
+    wait_provisioning()
+
+    pool.shutdown()
+    assert sorted(cleaned) == sorted([stale, "disp3", "disp4"])
+    assert pool.acquire() is None
+    assert pool.misses == 1
+
+    # Qubes still being provisioned are waited for and cleaned at exit
+    pool = DispVMPool("other-dvm", 1)
+    pool.shutdown()
+    assert not any(thread.is_alive() for thread in pool._threads)
+    assert sorted(cleaned) == sorted([stale, "disp3", "disp4", "disp5"])
+
+    # Qubes failing to be provisioned are discarded
+    def prepare_dispvm_failure(self):
+        prepare_dispvm(self)
+        raise ExecutorError("Failed to prepare disposable qube (status=1).")
+
+    monkeypatch.setattr(
+        LinuxQubesExecutor, "_prepare_dispvm", prepare_dispvm_failure
+    )
+    pool = DispVMPool("failing-dvm", 1)
+    wait_provisioning()
+    assert cleaned[-1] == created[-1] == "disp6"
+    assert pool.acquire() is None
+    wait_provisioning()
+    pool.shutdown()
+    assert cleaned[-1] == "disp7"
+    assert pool._provisioning == 0
+
+
+def test_qubes_prepare_dispvm_failure(monkeypatch):
+    monkeypatch.setattr(
+        "qubesbuilder.executors.qubes.create_dispvm", lambda *args: "disp0"
+    )
+    monkeypatch.setattr(
+        "qubesbuilder.executors.qubes.start_vm", lambda *args: None
+    )
+    monkeypatch.setattr(
+        "qubesbuilder.executors.qubes.build_run_cmd_and_list",
+        lambda *args: ["false"],
+    )
+    monkeypatch.setattr(
+        LinuxQubesExecutor, "copy_rpc_services", lambda self: None
+    )
+    executor = LinuxQubesExecutor(dispvm="builder-dvm")
+    with pytest.raises(ExecutorError, match="status=1"):
+        executor._prepare_dispvm()
+    assert executor.dispvm == "disp0"
+
+
+@pytest.mark.skipif(not shutil.which("zstd"), reason="zstd is not available")
+def test_qubes_compressed_copy(tmp_path, monkeypatch):
+    # Local stand-in for qrexec-client-vm running the service directly
+    qrexec_client = tmp_path / "qrexec-client-vm"
+    qrexec_client.write_text(
+        f"""#!/bin/sh
+echo "$3" >> {tmp_path}/qrexec.log
+exec {sys.executable} {PROJECT_PATH}/rpc/"$3"
+"""
+    )
+    qrexec_client.chmod(0o755)
+    monkeypatch.setattr(
+        "qubesbuilder.executors.qubes.QREXEC_CLIENT", str(qrexec_client)
+    )
+
+    executor = LinuxQubesExecutor(
+        dispvm="builder-dvm", compressed_copy=True, clean=False
+    )
+    executor.dispvm = "disp1234"
+
+    src = tmp_path / "src" / "chroot"
+    (src / "dir").mkdir(parents=True)
+    (src / "dir" / "file").write_text("content")
+    (src / "link").symlink_to("dir/file")
+    with open(src / "root.img", "wb") as f:
+        f.seek(64 * 1024 * 1024)
+        f.write(b"data")
+
+    vm_dir = tmp_path / "disp1234" / "builder"
+    executor.copy_in(src, vm_dir)
+    assert (vm_dir / "chroot/dir/file").read_text() == "content"
+
+    (vm_dir / "chroot/dir/file").write_text("new content")
+    executor.copy_out(vm_dir / "chroot", tmp_path / "out")
+    out = tmp_path / "out" / "chroot"
+    assert (out / "dir/file").read_text() == "new content"
+    assert os.readlink(out / "link") == "dir/file"
+    # Holes are kept
+    assert (out / "root.img").stat().st_size == 64 * 1024 * 1024 + 4
+    assert (out / "root.img").stat().st_blocks * 512 < 1024 * 1024
+
+    with pytest.raises(ExecutorError, match="cannot find"):
+        executor.copy_out(vm_dir / "missing", tmp_path / "out")
+
+    # All files of a run are copied with one call in each direction
+    (tmp_path / "qrexec.log").unlink()
+    (tmp_path / "src" / "file").write_text("file")
+
+    async def execute_async(cmd):
+        return 0
+
+    monkeypatch.setattr(executor, "execute_async", execute_async)
+    with executor.session():
+        executor.run(
+            ["true"],
+            copy_in=[
+                (tmp_path / "src" / "file", vm_dir / "sources"),
+                (src / "dir", vm_dir / "sources"),
+                (src / "dir", vm_dir / "plugins"),
+            ],
+            copy_out=[
+                (vm_dir / "sources" / "file", tmp_path / "artifacts"),
+                (vm_dir / "plugins" / "dir", tmp_path / "artifacts"),
+                (vm_dir / "sources" / "missing.log", tmp_path / "artifacts"),
+            ],
+            no_fail_copy_out_allowed_patterns=[".log"],
+        )
+    assert (tmp_path / "qrexec.log").read_text().split() == [
+        "qubesbuilder.ArchiveCopyIn",
+        "qubesbuilder.ArchiveCopyOut",
+    ]
+    assert (vm_dir / "plugins/dir/file").read_text() == "content"
+    assert (tmp_path / "artifacts/file").read_text() == "file"
+    assert (tmp_path / "artifacts/dir/file").read_text() == "content"
+
+
+def test_container_archive_copy(tmp_path, container_executor):
+    executor = container_executor()
+    executor.container = FakeContainer(tmp_path / "container")
+
+    sources = tmp_path / "sources"
+    (sources / "component" / "subdir").mkdir(parents=True)
+    (sources / "component" / "subdir" / "file").write_text("content")
+    (sources / "component" / "link").symlink_to("/etc/hosts")
+    (sources / "plugin").mkdir()
+    (sources / "plugin" / "script").write_text("script")
+
+    executor._put_archive(
+        [
+            (sources / "component", PurePath("/builder/sources")),
+            (sources / "plugin", PurePath("/builder/plugins")),
+        ]
+    )
+    # All sources are sent in one archive, with their parent directories
+    assert executor.container.put_archives == 1
+    assert "builder" in executor.container.put_members
+    container_dir = tmp_path / "container/builder"
+    assert (
+        container_dir / "sources/component/subdir/file"
+    ).read_text() == "content"
+    assert (
+        os.readlink(container_dir / "sources/component/link") == "/etc/hosts"
+    )
+    assert (container_dir / "plugins/plugin/script").read_text() == "script"
+
+    # Directories created by a previous copy are not touched again
+    executor.container.put_members.clear()
+    executor.copy_in(sources / "plugin", PurePath("/builder/plugins/more"))
+    assert executor.container.put_members[0] == "builder/plugins/more"
+    assert (container_dir / "plugins/more/plugin/script").exists()
+
+    # Sources which cannot be read fail the copy
+    with pytest.raises(ExecutorError, match="Failed to copy-in"):
+        executor.copy_in(tmp_path / "missing", PurePath("/builder"))
+
+    # Existing files are replaced, not written into
+    artifacts = tmp_path / "artifacts"
+    artifacts.mkdir()
+    (artifacts / "component").mkdir()
+    (artifacts / "component" / "subdir").mkdir()
+    (tmp_path / "other").write_text("other")
+    os.link(tmp_path / "other", artifacts / "component/subdir/file")
+    executor.copy_out(PurePath("/builder/sources/component"), artifacts)
+    assert (artifacts / "component/subdir/file").read_text() == "content"
+    assert (tmp_path / "other").read_text() == "other"
+    assert os.readlink(artifacts / "component/link") == "/etc/hosts"
+
+
+def test_container_archive_unsafe_copy_out(tmp_path, container_executor):
+    executor = container_executor()
+    executor.container = FakeContainer(tmp_path / "container")
+
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode="w") as tar:
+        tarinfo = tarfile.TarInfo("../escaped")
+        tar.addfile(tarinfo, io.BytesIO(b""))
+    executor.container.get_archive = lambda path: ([archive.getvalue()], {})
+
+    with pytest.raises(ExecutorError, match="unsafe path"):
+        executor.copy_out(PurePath("/builder/file"), tmp_path / "artifacts")
+    assert not (tmp_path / "escaped").exists()
+
+
+def test_container_archive_hardlink_through_symlink(
+    tmp_path, container_executor
+):
+    executor = container_executor()
+    executor.container = FakeContainer(tmp_path / "container")
+    (tmp_path / "secret").write_text("secret")
+
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode="w") as tar:
+        tarinfo = tarfile.TarInfo("file/link")
+        tarinfo.type = tarfile.SYMTYPE
+        tarinfo.linkname = str(tmp_path)
+        tar.addfile(tarinfo)
+        tarinfo = tarfile.TarInfo("file/pkg.rpm")
+        tarinfo.type = tarfile.LNKTYPE
+        tarinfo.linkname = "file/link/secret"
+        tar.addfile(tarinfo)
+    executor.container.get_archive = lambda path: ([archive.getvalue()], {})
+
+    with pytest.raises(ExecutorError, match="unsafe path"):
+        executor.copy_out(PurePath("/builder/file"), tmp_path / "artifacts")
+    assert (tmp_path / "secret").stat().st_nlink == 1
+    assert not (tmp_path / "artifacts" / "file" / "pkg.rpm").exists()
+
+
+def test_container_persistent(tmp_path, container_client, container_executor):
+    commands = []
+
+    async def execute_async(cmd, collect=False, **kwargs):
+        commands.append(cmd)
+        if collect:
+            return 0, b"1000\n1000\n", b""
+        return 0
+
+    executor = container_executor(persistent=True)
+    executor.distribution = "host-fc42"
+    executor.execute_async = execute_async
+    assert executor.supports_session and not executor.can_mount_in()
+    job_dir = executor.get_builder_dir().parent
+
+    (tmp_path / "plugin").mkdir()
+    (tmp_path / "plugin" / "script").write_text("script")
+    copy_in = [(tmp_path / "plugin", executor.get_plugins_dir())]
+    with executor.session():
+        executor.run(["true"], copy_in, environment={"DIST": "fc42"})
+        container = executor.container
+        executor.run(["true"], copy_in)
+        # Runs are executed in the same container and files are copied once
+        assert executor.container is container
+        assert container.put_archives == 1
+        # Existing directories are not part of the archive
+        prefix = str(executor.get_plugins_dir() / "plugin").lstrip("/")
+        assert all(n.startswith(prefix) for n in container.put_members)
+        # Copied files are given to the executor user
+        tarinfo = executor._set_owner(tarfile.TarInfo("file"))
+        assert (tarinfo.uid, tarinfo.gname) == (1000, "user")
+    assert len(container_client.created) == 1
+    assert (
+        tmp_path
+        / "container"
+        / executor.get_plugins_dir().relative_to("/")
+        / "plugin/script"
+    ).read_text() == "script"
+    run_cmds = [c for c in commands if c[-1].startswith("true")]
+    assert run_cmds[0][:4] == ["docker", "exec", "--env", "DIST"]
+    assert "chown -R" not in " ".join(commands[0])
+    # Builder directory and build roots are removed and the container is
+    # back in the pool of its distribution
+    assert commands[-1][-1].startswith("sudo bash -c")
+    assert str(job_dir) in commands[-1][-1]
+    assert "/var/lib/mock/*" in commands[-1][-1]
+    assert executor.container is None
+    key, pool = ContainerPool._pools.popitem()
+    assert key[-1] == "host-fc42"
+    assert pool.acquire() is container
+
+    pool.release(container)
+    container.changes = [
+        {"Path": "/var", "Kind": 0},
+        {"Path": "/var/cache/pbuilder/base.tgz", "Kind": 1},
+    ]
+    executor.run(["true"])
+    assert len(container_client.created) == 1
+    assert pool.acquire() is container
+    pool.release(container)
+
+    # Containers changed outside job directories are not reused
+    container.changes.append({"Path": "/etc/passwd", "Kind": 0})
+    executor.run(["true"])
+    assert container.removed
+    assert pool.acquire() is None
+
+    # Containers are not reused after a failure
+    async def execute_async_failure(cmd, collect=False, **kwargs):
+        return (0, b"1000 1000", b"") if collect else 1
+
+    executor.execute_async = execute_async_failure
+    with pytest.raises(ExecutorError):
+        executor.run(["false"])
+    assert len(container_client.instances) == 2
+    assert container_client.instances[-1].removed
+    assert pool.acquire() is None
+
+    # Containers are not shared with other distributions
+    executor = container_executor(persistent=True)
+    executor.distribution = "vm-bookworm"
+    executor.execute_async = execute_async
+    executor.run(["true"])
+    assert len(container_client.instances) == 3
+    assert [key[-1] for key in ContainerPool._pools] == ["vm-bookworm"]
+
+
+def test_container_mount_in(tmp_path, container_client, container_executor):
+    async def execute_async(cmd, collect=False, **kwargs):
+        return 0
+
+    executor = container_executor(clean=False, overlay_mounts=True)
+    executor.execute_async = execute_async
+    assert executor.can_mount_in()
+
+    chroot_cache = tmp_path / "chroot" / "fedora-42-x86_64"
+    chroot_cache.mkdir(parents=True)
+    mock_dir = executor.get_cache_dir() / "mock"
+    executor.run(
+        ["true"], environment={}, mount_in=[(chroot_cache, mock_dir)]
+    )
+    (args, kwargs) = container_client.created[0]
+    # Host directory is bind mounted read-only, with an overlay on top
+    assert {
+        "type": "bind",
+        "source": str(chroot_cache),
+        "target": "/overlays/lower/0",
+        "read_only": True,
+    } in kwargs["mounts"]
+    cmd = args[1][-1]
+    assert (
+        "lowerdir=/overlays/lower/0,upperdir=/overlays/upper/0/upper,"
+        "workdir=/overlays/upper/0/work" in cmd
+    )
+    assert f"{mock_dir}/fedora-42-x86_64" in cmd
+    assert cmd.endswith("&&true")
+
+
+def test_container_client_and_image_cache(monkeypatch, container_client):
+    for _ in range(3):
+        executor = ContainerExecutor("docker", "fedora:latest")
+        with executor.get_client():
+            pass
+    assert executor._attrs["Id"] == "sha256:image"
+    assert container_client.clients == [{}]
+    assert container_client.lookups == ["fedora:latest"]
+
+    # Another endpoint uses its own client
+    ContainerExecutor("docker", "fedora:latest", base_url="tcp://host:2375")
+    assert container_client.clients == [{}, {"base_url": "tcp://host:2375"}]
+    assert len(container_client.lookups) == 2
+
+    # Image attributes are looked up again once expired
+    monkeypatch.setattr("qubesbuilder.executors.container.IMAGE_CACHE_TTL", 0)
+    ContainerExecutor("docker", "fedora:latest")
+    assert len(container_client.lookups) == 3
+    assert len(container_client.clients) == 2
+
+
+def test_ssh_executor(tmp_path, monkeypatch):
+    # Local stand-in for ssh running commands directly
+    ssh = tmp_path / "ssh"
+    ssh.write_text(f"""#!/bin/bash
+while [ "$1" != "--" ]; do shift; done
+echo "$2" >> {tmp_path}/ssh.log
+exec bash -c "$3"
+""")
+    ssh.chmod(0o755)
+    monkeypatch.setattr("qubesbuilder.executors.remote.SSH", str(ssh))
+
+    remote = tmp_path / "remote"
+    remote.mkdir()
+    src = tmp_path / "src"
+    (src / "dir").mkdir(parents=True)
+    (src / "dir" / "small").write_text("small")
+    (src / "dir" / "big").write_bytes(b"big" * 1024)
+    (src / "dir" / "big").chmod(0o640)
+    os.link(src / "dir" / "big", src / "dir" / "big-link")
+    out = tmp_path / "out"
+
+    executor = RemoteLinuxExecutor(
+        hosts=["host1", "host2"],
+        directory=str(remote),
+        cache_dir=str(remote / "qubes-builder-cache"),
+        cache_min_size=1024,
+        host_selection="sticky",
+    )
+    executor.distribution = "host-fc42"
+    builder_dir = executor.get_builder_dir()
+    executor.run(
+        [
+            f"cd {builder_dir}",
+            "cat dir/small dir/big dir/big-link > result",
+            'test "$DIST" = "fc 42"',
+        ],
+        copy_in=[(src / "dir", builder_dir)],
+        copy_out=[(builder_dir / "result", out), (builder_dir / "dir", out)],
+        environment={"DIST": "fc 42"},
+    )
+    assert (out / "result").read_bytes() == b"small" + b"big" * 2048
+    assert (out / "dir" / "big").read_bytes() == b"big" * 1024
+    assert (out / "dir" / "big").stat().st_mode & 0o777 == 0o640
+
+    # Big files are sent once and kept in the cache of the host
+    digest = get_file_digest(src / "dir" / "big")
+    assert [p.name for p in remote.iterdir()] == ["qubes-builder-cache"]
+    assert [p.name for p in (remote / "qubes-builder-cache").iterdir()] == [
+        digest
+    ]
+    executor.host = executor.select_host(executor.distribution)
+    assert executor._get_missing_digests([digest, "0" * 64]) == ["0" * 64]
+    # Corrupted files are removed and sent again
+    blob = remote / "qubes-builder-cache" / digest
+    blob.write_bytes(b"corrupted")
+    assert executor._get_missing_digests([digest]) == [digest]
+    assert not blob.exists()
+    executor.host = None
+    executor.run(["true"], copy_in=[(src / "dir", builder_dir)])
+    assert blob.read_bytes() == b"big" * 1024
+
+    # Least recently used files are removed above the maximum size, unless
+    # used within the last hour
+    executor._cache_max_size = 4096
+    (src / "dir" / "big2").write_bytes(b"big2" * 1024)
+    for name, age in (("old", 7200), ("recent", 60)):
+        (remote / "qubes-builder-cache" / name.encode().hex()).write_bytes(
+            bytes(4096)
+        )
+        os.utime(
+            remote / "qubes-builder-cache" / name.encode().hex(),
+            (time.time() - age, time.time() - age),
+        )
+    executor.run(["true"], copy_in=[(src / "dir", builder_dir)])
+    assert sorted(
+        p.name for p in (remote / "qubes-builder-cache").iterdir()
+    ) == sorted(
+        [
+            digest,
+            get_file_digest(src / "dir" / "big2"),
+            "recent".encode().hex(),
+        ]
+    )
+
+    with pytest.raises(ExecutorError, match="cannot find"):
+        executor.run(
+            ["true"],
+            copy_out=[(builder_dir / "missing", out)],
+        )
+    executor.run(
+        ["true"],
+        copy_out=[(builder_dir / "missing.buildinfo", out)],
+        no_fail_copy_out_allowed_patterns=[".buildinfo"],
+    )
+    # All runs of the same distribution used the same host
+    assert len(set((tmp_path / "ssh.log").read_text().split())) == 1
+    assert RemoteLinuxExecutor._host_usage == {
+        host: 0 for host in RemoteLinuxExecutor._host_usage
+    }
+
+
+def test_ssh_executor_host_selection(monkeypatch):
+    outputs = {"host1": b"4\n2.00 1.00 1.00 1/100 1000\n", "host2": None}
+    outputs["host3"] = b"2\n0.50 1.00 1.00 1/100 1000\n"
+
+    def ssh(what, host, script, input=None):
+        if outputs[host] is None:
+            raise ExecutorError("Host is unreachable.")
+        return outputs[host]
+
+    executor = RemoteLinuxExecutor(hosts=["host1", "host2", "host3"])
+    monkeypatch.setattr(executor, "_ssh", ssh)
+    monkeypatch.setattr(RemoteLinuxExecutor, "_host_usage", {})
+    assert executor.select_host() == "host3"
+    # Runs of this process are accounted for
+    executor._acquire_host()
+    assert executor.select_host() == "host1"
+    executor._release_host()
+    assert RemoteLinuxExecutor._host_usage == {"host3": 0}
+
+    # A given key goes to the same host, whatever the order of hosts
+    executor._host_selection = "sticky"
+    sticky = RemoteLinuxExecutor(
+        hosts=["host3", "host2", "host1"], host_selection="sticky"
+    )
+    monkeypatch.setattr(sticky, "_ssh", ssh)
+    for key in ("fc42", "bookworm", "trixie", "archlinux"):
+        assert executor.select_host(key) == sticky.select_host(key)
+        assert executor.select_host(key) != "host2"
+
+    outputs["host1"] = outputs["host3"] = None
+    with pytest.raises(ExecutorError, match="No remote host available"):
+        executor.select_host("fc42")
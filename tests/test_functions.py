@@ -1,15 +1,44 @@
+import hashlib
+import http.server
+import logging
+import os
+import shutil
+import subprocess
+import tarfile
 import tempfile
+import threading
+import time
 from pathlib import Path
 
 import pytest
 
+from qubesbuilder.actioncache import (
+    ActionCacheError,
+    HTTPActionCache,
+    LocalActionCache,
+)
+from qubesbuilder.ccache import CompilerCache
 from qubesbuilder.cli.cli_main import parse_config_from_cli
 from qubesbuilder.common import (
     is_filename_valid,
     deep_check,
     sed,
     get_archive_name,
+    sanitize_line,
+    sanitize_lines,
+    size_to_bytes,
+    get_temporary_path,
+    remove_file,
+)
+from qubesbuilder.distribution import QubesDistribution
+from qubesbuilder.plugins.build import (
+    is_local_repository_metadata,
+    local_repository_lock,
+    local_repository_snapshot,
 )
+from qubesbuilder.plugins.build_deb import update_local_repository_metadata
+from qubesbuilder.scheduler import AdmissionController, JobScheduler
+from qubesbuilder.store import ArtifactStore
 
 
 def test_filename():
@@ -326,3 +355,437 @@ def test_get_archive_name_git_url():
     }
     fn = get_archive_name(file)
     assert fn == "repo-2.0.0.tar"
+
+
+def test_scheduler_order():
+    graph = {"a": [], "b": ["a"], "c": ["a"], "d": ["b", "c"]}
+    done = []
+    lock = threading.Lock()
+
+    def func(node):
+        with lock:
+            assert all(dep in done for dep in graph[node])
+            done.append(node)
+
+    scheduler = JobScheduler(graph, jobs=4)
+    scheduler.run(func)
+    assert sorted(done) == ["a", "b", "c", "d"]
+    assert done[0] == "a" and done[-1] == "d"
+    assert not scheduler.failed and not scheduler.cancelled
+
+
+def test_scheduler_parallel():
+    # Both nodes have to be running at the same time to pass the barrier.
+    barrier = threading.Barrier(2, timeout=10)
+    scheduler = JobScheduler({"a": [], "b": []}, jobs=2)
+    scheduler.run(lambda node: barrier.wait())
+    assert not scheduler.failed
+
+
+def test_scheduler_failure():
+    graph = {
+        "a": [],
+        "b": ["a"],
+        "c": ["b"],
+        "d": [],
+        "e": ["d"],
+    }
+    done = []
+
+    def func(node):
+        if node == "a":
+            raise ValueError("failure")
+        done.append(node)
+
+    scheduler = JobScheduler(graph, jobs=2)
+    scheduler.run(func)
+    assert sorted(done) == ["d", "e"]
+    assert list(scheduler.failed) == ["a"]
+    assert isinstance(scheduler.failed["a"], ValueError)
+    assert scheduler.cancelled == {"b", "c"}
+
+
+def test_scheduler_limits():
+    lock = threading.Lock()
+    running = {"qubes": 0, "local": 0}
+    maximum = {"qubes": 0, "local": 0}
+
+    def func(node):
+        kind = node.split("-")[0]
+        with lock:
+            running[kind] += 1
+            maximum[kind] = max(maximum[kind], running[kind])
+        time.sleep(0.05)
+        with lock:
+            running[kind] -= 1
+
+    graph = {f"qubes-{i}": [] for i in range(6)}
+    graph.update({f"local-{i}": [] for i in range(6)})
+    scheduler = JobScheduler(
+        graph,
+        jobs=8,
+        limits=lambda node: {"qubes": 2} if node.startswith("qubes") else {},
+    )
+    scheduler.run(func)
+    assert not scheduler.failed
+    assert maximum["qubes"] == 2
+    assert maximum["local"] > 2
+
+
+def test_scheduler_admission():
+    # Nothing is admitted: nodes are run one at a time.
+    lock = threading.Lock()
+    running = []
+    maximum = []
+
+    def func(node):
+        with lock:
+            running.append(node)
+            maximum.append(len(running))
+        time.sleep(0.01)
+        with lock:
+            running.remove(node)
+
+    scheduler = JobScheduler(
+        {i: [] for i in range(4)},
+        jobs=4,
+        admit=lambda node: False,
+        poll_interval=0.01,
+    )
+    scheduler.run(func)
+    assert max(maximum) == 1
+
+
+def test_admission_controller(monkeypatch):
+    monkeypatch.setattr(
+        "qubesbuilder.scheduler.get_available_memory", lambda: 10 << 30
+    )
+    monkeypatch.setattr("os.getloadavg", lambda: (1.0, 1.0, 1.0))
+
+    admit = AdmissionController(min_free_memory=lambda node: 4 << 30)
+    assert admit("a")
+    assert admit("b")
+    # Memory of recently admitted jobs is reserved.
+    assert not admit("c")
+
+    # Each recently admitted job counts for one unit of load.
+    admit = AdmissionController(max_load=3)
+    assert admit("a")
+    assert admit("b")
+    assert not admit("c")
+
+
+def test_sanitize_line():
+    assert sanitize_line(b"Build: OK\r") == "Build: OK "
+    assert sanitize_line(b"\x1b[1m\xc3\xa9\n") == ".[1m..."
+    assert sanitize_line(bytearray(b"\t")) == "."
+    assert sanitize_lines(b"a\r\nb\x00\n") == "a \nb.\n"
+    data = bytes(range(256))
+    assert sanitize_lines(data).split("\n") == [
+        sanitize_line(line) for line in data.split(b"\n")
+    ]
+
+
+def test_size_to_bytes():
+    assert size_to_bytes(1024) == 1024
+    assert size_to_bytes("512") == 512
+    assert size_to_bytes("4K") == 4096
+    assert size_to_bytes("2M") == 2 << 20
+    assert size_to_bytes("4G") == 4 << 30
+    assert size_to_bytes("1.5GB") == 3 << 29
+
+
+def test_get_temporary_path(tmp_path):
+    path = get_temporary_path(tmp_path / "file")
+    assert path.parent == tmp_path
+    assert path.name.startswith(".file.")
+    assert get_temporary_path(tmp_path / "file") == path
+    assert get_temporary_path(tmp_path / "dir", "old").name.startswith(
+        ".dir.old."
+    )
+
+    paths = []
+    thread = threading.Thread(
+        target=lambda: paths.append(get_temporary_path(tmp_path / "file"))
+    )
+    thread.start()
+    thread.join()
+    assert paths[0] != path
+
+
+def test_remove_file(tmp_path):
+    (tmp_path / "other").write_text("other")
+    (tmp_path / "file").hardlink_to(tmp_path / "other")
+    (tmp_path / "link").symlink_to("missing")
+    (tmp_path / "dir").mkdir()
+    for name in ("file", "link", "dir", "missing"):
+        remove_file(tmp_path / name)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["dir", "other"]
+    assert (tmp_path / "other").read_text() == "other"
+
+
+def test_artifact_store(tmpdir):
+    store = ArtifactStore(Path(tmpdir) / "store")
+    artifacts_dir = Path(tmpdir) / "components"
+    for dist in ("vm-fc41", "vm-fc42"):
+        (artifacts_dir / dist / "rpm").mkdir(parents=True)
+        (artifacts_dir / dist / "rpm" / "foo-1.0-1.noarch.rpm").write_text(
+            "noarch"
+        )
+        (
+            artifacts_dir / dist / "rpm" / f"foo-1.0-1.{dist}.x86_64.rpm"
+        ).write_text(dist)
+        (artifacts_dir / dist / "rpm" / "foo.buildinfo").write_text(dist)
+
+    digests = store.add_directory(artifacts_dir / "vm-fc41")
+    assert len(digests) == 2
+    digests += store.add_directory(artifacts_dir / "vm-fc42")
+    assert len(digests) == 4
+    assert len(set(digests)) == 3
+    assert len(list(store.iter_blobs())) == 3
+
+    noarch = [
+        artifacts_dir / dist / "rpm" / "foo-1.0-1.noarch.rpm"
+        for dist in ("vm-fc41", "vm-fc42")
+    ]
+    assert noarch[0].samefile(noarch[1])
+    assert noarch[0].stat().st_nlink == 3
+    assert noarch[0].read_text() == "noarch"
+    assert ArtifactStore.is_stored(noarch[0])
+    # Metadata files are not stored
+    buildinfo = artifacts_dir / "vm-fc41" / "rpm" / "foo.buildinfo"
+    assert buildinfo.stat().st_nlink == 1
+
+    # Already stored files are not added again
+    assert store.add_directory(artifacts_dir / "vm-fc41") == []
+
+    # Only blobs not linked anymore are removed
+    shutil.rmtree(artifacts_dir / "vm-fc41")
+    assert len(store.gc(dry_run=True)) == 1
+    assert len(list(store.iter_blobs())) == 3
+    removed = store.gc()
+    assert len(removed) == 1
+    assert not removed[0].exists()
+    assert noarch[1].read_text() == "noarch"
+    assert len(list(store.iter_blobs())) == 2
+
+
+def _check_action_cache(cache, tmpdir):
+    key = hashlib.sha256(b"inputs").hexdigest()
+    artifacts_dir = Path(tmpdir) / "build"
+    (artifacts_dir / "rpm").mkdir(parents=True)
+    (artifacts_dir / "rpm" / "foo-1.0-1.x86_64.rpm").write_text("rpm")
+    (artifacts_dir / "foo.build.yml").write_text("rpms: []")
+
+    restored_dir = Path(tmpdir) / "restored"
+    assert not cache.restore(key, restored_dir)
+    cache.save(key, artifacts_dir)
+    assert cache.restore(key, restored_dir)
+    assert (restored_dir / "rpm" / "foo-1.0-1.x86_64.rpm").read_text() == "rpm"
+    assert (restored_dir / "foo.build.yml").read_text() == "rpms: []"
+
+    with pytest.raises(ActionCacheError):
+        cache.restore("../foo", restored_dir)
+
+
+def test_action_cache_local(tmpdir):
+    cache = LocalActionCache(Path(tmpdir) / "cache")
+    _check_action_cache(cache, tmpdir)
+
+    # Entries escaping the artifacts directory are rejected
+    key = hashlib.sha256(b"other").hexdigest()
+    cache.get_path(key).parent.mkdir(parents=True, exist_ok=True)
+    with tarfile.open(cache.get_path(key), "w") as tar:
+        info = tarfile.TarInfo("../escape")
+        tar.addfile(info)
+    with pytest.raises(ActionCacheError):
+        cache.restore(key, Path(tmpdir) / "other")
+    assert not (Path(tmpdir) / "escape").exists()
+
+    # Read-only cache
+    cache = LocalActionCache(Path(tmpdir) / "cache-ro", upload=False)
+    cache.save(key, Path(tmpdir) / "build")
+    assert not cache.restore(key, Path(tmpdir) / "other")
+
+
+def test_action_cache_http(tmpdir):
+    entries = {}
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in entries:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(entries[self.path])))
+            self.end_headers()
+            self.wfile.write(entries[self.path])
+
+        def do_PUT(self):
+            length = int(self.headers["Content-Length"])
+            entries[self.path] = self.rfile.read(length)
+            self.send_response(201)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        cache = HTTPActionCache(f"http://127.0.0.1:{server.server_port}/")
+        _check_action_cache(cache, tmpdir)
+        assert len(entries) == 1
+    finally:
+        server.shutdown()
+        thread.join()
+        server.server_close()
+
+
+def test_compiler_cache(tmpdir):
+    ccache = CompilerCache(Path(tmpdir) / "ccache" / "vm-fc42", max_size=40)
+
+    def write_stats(directory, hits, misses):
+        counters = [0] * 23
+        counters[4], counters[22] = misses, hits
+        (directory / "0").mkdir(exist_ok=True)
+        # Like ccache, do not write into the hardlinked file
+        (directory / "0" / "stats").unlink(missing_ok=True)
+        (directory / "0" / "stats").write_text(
+            "\n".join(str(c) for c in counters)
+        )
+
+    with ccache.checkout() as ccache_dir:
+        assert ccache_dir.name == "vm-fc42"
+        assert ccache.get_stats(ccache_dir) == (0, 0)
+        write_stats(ccache_dir, 1, 3)
+        for i in range(3):
+            (ccache_dir / "0" / f"entry{i}").write_text("x" * 10)
+        ccache.commit(ccache_dir)
+    assert ccache.get_stats(ccache.directory) == (1, 3)
+    assert len(list(ccache.directory.glob("0/entry*"))) == 3
+    # Only the cache is left
+    assert [p.name for p in ccache.directory.parent.iterdir()] == ["vm-fc42"]
+
+    with ccache.checkout() as ccache_dir:
+        # Cache entries are hardlinked
+        assert (ccache_dir / "0" / "entry0").samefile(
+            ccache.directory / "0" / "entry0"
+        )
+        write_stats(ccache_dir, 4, 3)
+        for i in range(3, 6):
+            (ccache_dir / "0" / f"entry{i}").write_text("x" * 10)
+            time.sleep(0.01)
+        ccache.commit(ccache_dir)
+    assert ccache.get_stats(ccache.directory) == (4, 3)
+    # Least recently used entries are removed down to 80% of maximum size
+    assert sorted(p.name for p in ccache.directory.glob("0/entry*")) == [
+        "entry3",
+        "entry4",
+        "entry5",
+    ]
+
+
+@pytest.mark.skipif(
+    not shutil.which("dpkg-deb") or not shutil.which("dpkg-scanpackages"),
+    reason="dpkg-deb and dpkg-scanpackages are needed",
+)
+def test_local_repository_metadata_deb(tmpdir, monkeypatch):
+    log = logging.getLogger("test")
+    dist = QubesDistribution("vm-bookworm")
+    repository_dir = Path(tmpdir) / "repository" / "vm-bookworm"
+    repository_dir.mkdir(parents=True)
+
+    for name in ("foo", "bar"):
+        pkg_dir = Path(tmpdir) / name
+        (pkg_dir / "DEBIAN").mkdir(parents=True)
+        (pkg_dir / "DEBIAN" / "control").write_text(
+            f"Package: {name}\nVersion: 1.0\nArchitecture: all\n"
+            f"Maintainer: Nobody <nobody@example.com>\nDescription: {name}\n"
+        )
+        (repository_dir / f"{name}_1.0").mkdir()
+        subprocess.run(
+            [
+                "dpkg-deb",
+                "--build",
+                str(pkg_dir),
+                str(repository_dir / f"{name}_1.0" / f"{name}_1.0_all.deb"),
+            ],
+            check=True,
+            capture_output=True,
+        )
+
+    update_local_repository_metadata(log, repository_dir, dist)
+    suite_dir = repository_dir / "dists" / "bookworm"
+    packages = (suite_dir / "main/binary-amd64/Packages").read_text()
+    assert "Filename: bar_1.0/bar_1.0_all.deb" in packages
+    assert "Filename: foo_1.0/foo_1.0_all.deb" in packages
+    # Packages of each directory are kept for next updates
+    assert (repository_dir / "foo_1.0" / "Packages").exists()
+    release = (suite_dir / "Release").read_text()
+    assert "Codename: bookworm\n" in release
+    assert (
+        f" {hashlib.sha256(packages.encode()).hexdigest()} {len(packages)} main/binary-amd64/Packages\n"
+        in release
+    )
+    # Metadata is not part of action cache key as it changes on every update
+    assert [
+        str(path.relative_to(repository_dir))
+        for path in sorted(repository_dir.rglob("*"))
+        if path.is_file()
+        and not is_local_repository_metadata(path.relative_to(repository_dir))
+    ] == ["bar_1.0/bar_1.0_all.deb", "foo_1.0/foo_1.0_all.deb"]
+
+    # Removed packages are removed from metadata, without scanning others
+    shutil.rmtree(repository_dir / "bar_1.0")
+    monkeypatch.setenv("PATH", "")
+    # Metadata is replaced, not written into as it may be in a snapshot
+    os.link(suite_dir / "Release", tmpdir / "Release")
+    update_local_repository_metadata(log, repository_dir, dist)
+    packages = (suite_dir / "main/binary-amd64/Packages").read_text()
+    assert "bar_1.0_all.deb" not in packages
+    assert "Filename: foo_1.0/foo_1.0_all.deb" in packages
+    assert (Path(tmpdir) / "Release").read_text() == release
+    assert not list(repository_dir.rglob(".*"))
+
+    # Metadata is removed if it cannot be updated
+    (repository_dir / "bar_1.0").mkdir()
+    update_local_repository_metadata(log, repository_dir, dist)
+    assert not (repository_dir / "dists").exists()
+
+
+def test_local_repository_snapshot(tmp_path):
+    repository_dir = tmp_path / "repository" / "vm-bookworm"
+    (repository_dir / "foo_1.0").mkdir(parents=True)
+    (repository_dir / "foo_1.0" / "foo_1.0_all.deb").write_text("foo")
+
+    snapshots = []
+
+    def take_snapshot():
+        with local_repository_snapshot(repository_dir) as snapshot:
+            snapshots.append(
+                sorted(
+                    str(path.relative_to(snapshot))
+                    for path in snapshot.rglob("*")
+                )
+            )
+            # Later changes do not affect it
+            shutil.rmtree(repository_dir / "bar_1.0")
+            snapshots.append(
+                (snapshot / "bar_1.0" / "bar_1.0_all.deb").read_text()
+            )
+        snapshots.append(snapshot.parent.exists())
+
+    # Snapshot waits for changes made under the lock
+    thread = threading.Thread(target=take_snapshot)
+    with local_repository_lock(repository_dir):
+        thread.start()
+        time.sleep(0.2)
+        assert not snapshots
+        shutil.rmtree(repository_dir / "foo_1.0")
+        (repository_dir / "bar_1.0").mkdir()
+        (repository_dir / "bar_1.0" / "bar_1.0_all.deb").write_text("bar")
+    thread.join()
+    assert snapshots == [["bar_1.0", "bar_1.0/bar_1.0_all.deb"], "bar", False]
+    assert not (repository_dir / "bar_1.0").exists()
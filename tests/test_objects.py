@@ -1,18 +1,32 @@
+import hashlib
 import os
 import shutil
 import tempfile
+import time
 from pathlib import Path
+from unittest.mock import patch
 
 import pytest
 
+from qubesbuilder.cli.cli_main import parse_config_from_cli
 from qubesbuilder.common import VerificationMode, PROJECT_PATH
 from qubesbuilder.component import QubesComponent
 from qubesbuilder.config import Config
 from qubesbuilder.distribution import QubesDistribution
 from qubesbuilder.exc import ComponentError, DistributionError, ConfigError
+from qubesbuilder.executors import Executor
 from qubesbuilder.executors.container import ContainerExecutor
 from qubesbuilder.pluginmanager import PluginManager
-from qubesbuilder.plugins import DistributionComponentPlugin
+from qubesbuilder.plugins import (
+    DistributionComponentPlugin,
+    PackagePath,
+    PluginError,
+)
+from qubesbuilder.plugins.fetch import FetchError, FetchPlugin
+from qubesbuilder.plugins.source import SourceError
+from qubesbuilder.plugins.source_deb import DEBSourcePlugin
+from qubesbuilder.plugins.source_rpm import RPMSourcePlugin
+from qubesbuilder.scheduler import AdmissionController
 from qubesbuilder.template import QubesTemplate, TemplateError
 
 
@@ -239,6 +253,67 @@ vm:
         assert not plugin.has_component_packages(stage="prep")
 
 
+def test_component_source_hash(tmpdir):
+    source_dir = Path(tmpdir) / "source"
+    (source_dir / ".git").mkdir(parents=True)
+    (source_dir / ".git" / "HEAD").write_text("ref: refs/heads/main")
+    (source_dir / "src" / "sub").mkdir(parents=True)
+    (source_dir / "src" / "main.c").write_text("int main() {}")
+    (source_dir / "src" / "sub" / "file.txt").write_text("content")
+    (source_dir / "src" / "main.o").write_text("object")
+    (source_dir / "src" / ".gitignore").write_text("*.o")
+    (source_dir / "Makefile").write_text("all:")
+    (source_dir / "link").symlink_to("Makefile")
+    (source_dir / "empty").mkdir()
+
+    # Hash is computed over names and content, in sorted order, excluding
+    # .git and content ignored by .gitignore
+    expected = hashlib.sha512()
+    for name, content in [
+        ("empty", None),
+        ("link", "all:"),
+        ("Makefile", "all:"),
+        ("src", None),
+        (".gitignore", "*.o"),
+        ("main.c", "int main() {}"),
+        ("sub", None),
+        ("file.txt", "content"),
+    ]:
+        expected.update(name.encode())
+        if content:
+            expected.update(content.encode())
+
+    component = QubesComponent(source_dir)
+    assert component.get_source_hash() == expected.hexdigest()
+
+    # Files modified recently are not cached
+    cache_dir = Path(tmpdir) / "cache"
+    component = QubesComponent(source_dir, source_hash_cache_dir=cache_dir)
+    assert component.get_source_hash() == expected.hexdigest()
+    assert not (cache_dir / "source.json").exists()
+
+    old_time = time.time() - 3600
+    for path in source_dir.rglob("*"):
+        os.utime(path, (old_time, old_time), follow_symlinks=False)
+    assert component.get_source_hash() == expected.hexdigest()
+    assert (cache_dir / "source.json").exists()
+
+    # Unchanged files are not read again
+    with patch.object(
+        QubesComponent, "_update_hash_from_file", side_effect=AssertionError
+    ):
+        assert component.get_source_hash() == expected.hexdigest()
+
+    # Ignored files do not invalidate cache, others do
+    (source_dir / "src" / "main.o").write_text("new object")
+    with patch.object(
+        QubesComponent, "_update_hash_from_file", side_effect=AssertionError
+    ):
+        assert component.get_source_hash() == expected.hexdigest()
+    (source_dir / "src" / "main.c").write_text("int main() { }")
+    assert component.get_source_hash() != expected.hexdigest()
+
+
 #
 # QubesDistribution
 #
@@ -666,6 +741,18 @@ executor:
         assert config.get("executor").get("options").get("image") == "fedora"
 
 
+def test_config_options_max_load(temp_config_file):
+    assert Config(temp_config_file).max_load is None
+
+    # Options given on command line are strings
+    options = parse_config_from_cli(["max-load=8"])
+    config = Config(temp_config_file, options)
+    assert config.max_load == 8.0
+    admit = AdmissionController(max_load=config.max_load)
+    with patch("os.getloadavg", return_value=(1.0, 1.0, 1.0)):
+        assert admit("a")
+
+
 def test_config_merge_include():
     with (
         tempfile.NamedTemporaryFile("w") as config_file_main,
@@ -1153,3 +1240,590 @@ def test_config_path_from_config_with_home_relative_path(config):
     result = config.get_absolute_path_from_config(config_path_str)
     expected = Path(config_path_str).expanduser().resolve()
     assert result == expected
+
+
+def test_config_jobs_graph(tmp_path):
+    config_file = tmp_path / "builder.yml"
+    config_file.write_text(
+        f"""
+artifacts-dir: {tmp_path}/artifacts
+
+executor:
+  type: local
+
+components:
+  - linux-utils
+
+distributions:
+  - host-fc37
+  - vm-bookworm
+"""
+    )
+    config = Config(config_file)
+    source_dir = config.sources_dir / "linux-utils"
+    source_dir.mkdir(parents=True)
+    (source_dir / ".qubesbuilder").write_text(
+        """
+host:
+  rpm:
+    build:
+    - rpm_spec/qubes-utils.spec
+vm:
+  deb:
+    build:
+    - debian
+"""
+    )
+    (source_dir / "version").write_text("1.2.3")
+    (source_dir / "rel").write_text("4")
+
+    graph = config.get_jobs_graph(
+        components=config.get_components(),
+        distributions=config.get_distributions(),
+        templates=[],
+        stages=["prep", "build"],
+    )
+    jobs = {(job.stage, job.dist.distribution): job for job in graph}
+    assert set(jobs) == {
+        ("init-cache", "host-fc37"),
+        ("init-cache", "vm-bookworm"),
+        ("prep", "host-fc37"),
+        ("prep", "vm-bookworm"),
+        ("build", "host-fc37"),
+        ("build", "vm-bookworm"),
+    }
+    # Stages of the same distribution are ordered, distributions are not
+    # depending on each other.
+    for dist in ("host-fc37", "vm-bookworm"):
+        assert jobs[("init-cache", dist)] in graph[jobs[("prep", dist)]]
+        assert jobs[("prep", dist)] in graph[jobs[("build", dist)]]
+    for job, deps in graph.items():
+        assert all(dep.dist == job.dist for dep in deps)
+
+
+@pytest.mark.parametrize("independent", [False, True])
+def test_config_jobs_graph_build_order(tmp_path, independent):
+    config_file = tmp_path / "builder.yml"
+    config_file.write_text(
+        f"""
+artifacts-dir: {tmp_path}/artifacts
+independent-builds: {str(independent).lower()}
+
+executor:
+  type: local
+
+components:
+  - core-vchan-xen
+  - core-qubesdb
+  - linux-utils
+
+distributions:
+  - host-fc37
+  - vm-fc40
+"""
+    )
+    config = Config(config_file)
+    for name in ("core-vchan-xen", "core-qubesdb", "linux-utils"):
+        source_dir = config.sources_dir / name
+        source_dir.mkdir(parents=True)
+        (source_dir / ".qubesbuilder").write_text(
+            """
+rpm:
+  build:
+  - rpm_spec/package.spec
+"""
+        )
+        (source_dir / "version").write_text("1.2.3")
+        (source_dir / "rel").write_text("4")
+
+    graph = config.get_jobs_graph(
+        components=config.get_components(),
+        distributions=config.get_distributions(),
+        templates=[],
+        stages=["prep", "build"],
+    )
+    jobs = {
+        (job.stage, job.component.name, job.dist.distribution): job
+        for job in graph
+        if job.component
+    }
+    for dist in ("host-fc37", "vm-fc40"):
+        vchan = jobs[("build", "core-vchan-xen", dist)]
+        qubesdb = jobs[("build", "core-qubesdb", dist)]
+        utils = jobs[("build", "linux-utils", dist)]
+        # Builds of a distribution are run in components order, unless
+        # they are independent.
+        assert (vchan in graph[qubesdb]) != independent
+        assert (qubesdb in graph[utils]) != independent
+        assert all(dep.stage != "build" for dep in graph[vchan])
+        # Other stages are not ordered between components
+        for prep in ("core-vchan-xen", "core-qubesdb"):
+            assert jobs[("prep", prep, dist)] not in graph[
+                jobs[("prep", "linux-utils", dist)]
+            ]
+    for job, deps in graph.items():
+        assert all(dep.dist == job.dist for dep in deps)
+
+
+def test_config_job_limits(tmp_path):
+    config_file = tmp_path / "builder.yml"
+    config_file.write_text(
+        f"""
+artifacts-dir: {tmp_path}/artifacts
+
+executor:
+  type: local
+  max-parallel: 4
+  min-free-memory: 2G
+
+stages:
+  - fetch
+  - build:
+      max-parallel: 2
+      executor:
+        type: qubes
+        min-free-memory: 4G
+
+components:
+  - linux-utils
+
+distributions:
+  - vm-bookworm
+"""
+    )
+    config = Config(config_file)
+    source_dir = config.sources_dir / "linux-utils"
+    source_dir.mkdir(parents=True)
+    (source_dir / ".qubesbuilder").write_text(
+        """
+vm:
+  deb:
+    build:
+    - debian
+"""
+    )
+    (source_dir / "version").write_text("1.2.3")
+    (source_dir / "rel").write_text("4")
+
+    jobs = config.get_jobs(
+        components=config.get_components(),
+        distributions=config.get_distributions(),
+        templates=[],
+        stages=["fetch"],
+    )
+    assert config.get_job_limits(jobs[0]) == {"executor:local": 4}
+    assert config.get_job_min_free_memory(jobs[0]) == 2 << 30
+
+    jobs[0].stage = "build"
+    assert config.get_job_limits(jobs[0]) == {
+        "executor:qubes": 4,
+        "stage:build": 2,
+    }
+    assert config.get_job_min_free_memory(jobs[0]) == 4 << 30
+
+
+def test_config_fetch_jobs(tmp_path):
+    config_file = tmp_path / "builder.yml"
+    config_file.write_text("jobs: 4\n")
+    config = Config(config_file)
+    assert config.jobs == 4
+    assert config.fetch_jobs == 4
+
+    config_file.write_text("jobs: 4\nfetch-jobs: 16\n")
+    config = Config(config_file)
+    assert config.jobs == 4
+    assert config.fetch_jobs == 16
+
+
+def test_fetch_distfiles_cache(tmp_path):
+    config_file = tmp_path / "builder.yml"
+    config_file.write_text(f"""
+artifacts-dir: {tmp_path}/artifacts
+distfiles-cache-dir: {tmp_path}/distfiles-cache
+executor:
+  type: local
+components:
+  - linux-utils
+""")
+    config = Config(config_file)
+    component = config.get_components()[0]
+    component.source_dir.mkdir(parents=True)
+    content = b"upstream tarball"
+    (component.source_dir / "foo.tar.gz.sha256").write_text(
+        hashlib.sha256(content).hexdigest() + "\n"
+    )
+    (component.source_dir / "foo.tar.gz.sha512").write_text("invalid")
+    plugin = FetchPlugin(component=component, config=config, stage="fetch")
+
+    file = {
+        "url": "https://example.com/foo.tar.gz",
+        "sha256": "foo.tar.gz.sha256",
+    }
+    cache_path = plugin.get_distfiles_cache_path(file)
+    digest = hashlib.sha256(content).hexdigest()
+    assert (
+        cache_path == tmp_path / "distfiles-cache/sha256" / digest[:2] / digest
+    )
+    assert (
+        plugin.get_distfiles_cache_path({"sha512": "foo.tar.gz.sha512"})
+        is None
+    )
+    assert (
+        plugin.get_distfiles_cache_path({"signature": "foo.tar.gz.asc"})
+        is None
+    )
+
+    distfiles_dir = tmp_path / "distfiles"
+    distfiles_dir.mkdir()
+    assert not plugin.get_from_distfiles_cache(
+        cache_path, distfiles_dir / "foo.tar.gz"
+    )
+
+    downloaded = tmp_path / "foo.tar.gz"
+    downloaded.write_bytes(content)
+    plugin.add_to_distfiles_cache(downloaded, cache_path)
+    assert plugin.get_from_distfiles_cache(
+        cache_path, distfiles_dir / "foo.tar.gz"
+    )
+    assert (distfiles_dir / "foo.tar.gz").read_bytes() == content
+
+    # Corrupted cache entries are not used
+    cache_path.unlink()
+    cache_path.write_bytes(b"corrupted")
+    assert not plugin.get_from_distfiles_cache(
+        cache_path, distfiles_dir / "bar.tar.gz"
+    )
+    assert not (distfiles_dir / "bar.tar.gz").exists()
+
+
+def test_fetch_download_files(tmp_path, fake_server, monkeypatch):
+    config_file = tmp_path / "builder.yml"
+    config_file.write_text(f"""
+artifacts-dir: {tmp_path}/artifacts
+executor:
+  type: local
+components:
+  - linux-utils
+""")
+    config = Config(config_file)
+    component = config.get_components()[0]
+    component.source_dir.mkdir(parents=True)
+    files = []
+    for i in range(6):
+        content = f"upstream tarball {i}".encode()
+        (fake_server / f"foo{i}.tar.gz").write_bytes(content)
+        (component.source_dir / f"foo{i}.tar.gz.sha256").write_text(
+            hashlib.sha256(content).hexdigest() + "\n"
+        )
+        files.append(
+            {
+                "url": f"https://example.com/foo{i}.tar.gz",
+                "sha256": f"foo{i}.tar.gz.sha256",
+            }
+        )
+    plugin = FetchPlugin(
+        component=component,
+        config=config,
+        stage="fetch",
+        manager=PluginManager(config.get_plugins_dirs()),
+    )
+    config.temp_dir.mkdir(parents=True)
+    distfiles_dir = tmp_path / "distfiles"
+    distfiles_dir.mkdir()
+
+    # Interrupted downloads are kept for next time
+    (fake_server / "foo0.tar.gz.partial").write_bytes(b"upstream")
+    with pytest.raises(FetchError, match="foo0.tar.gz"):
+        plugin.download_files(files[:1], plugin.executor, distfiles_dir)
+    partial_dir = config.cache_dir / "partial-downloads/linux-utils"
+    assert [p.name for p in partial_dir.iterdir()] == [
+        "untrusted_foo0.tar.gz.part"
+    ]
+
+    # Downloads run in parallel, up to MAX_PARALLEL_DOWNLOADS
+    (fake_server / "foo0.tar.gz.partial").unlink()
+    (fake_server / ".concurrency").unlink()
+    monkeypatch.setattr("qubesbuilder.plugins.fetch.MAX_PARALLEL_DOWNLOADS", 2)
+    monkeypatch.setenv("FAKE_CURL_DELAY", "0.5")
+    plugin.download_files(files, plugin.executor, distfiles_dir)
+    assert sorted(p.name for p in distfiles_dir.iterdir()) == [
+        f"foo{i}.tar.gz" for i in range(6)
+    ]
+    concurrency = (fake_server / ".concurrency").read_text().split()
+    assert max(map(int, concurrency)) == 2
+    # Partial download has been resumed
+    log = (fake_server / ".log").read_text().splitlines()
+    assert "resume https://example.com/foo0.tar.gz" in log
+    assert "https://example.com/foo1.tar.gz" in log
+    assert not partial_dir.exists()
+
+
+def test_plugin_run_build_targets(tmp_path):
+    config_file = tmp_path / "builder.yml"
+    config_file.write_text(f"""
+artifacts-dir: {tmp_path}/artifacts
+executor:
+  type: local
+stages:
+  - build:
+      target-jobs: 2
+components:
+  - linux-utils
+  - core-admin-linux:
+      stages:
+        - build:
+            target-jobs: 3
+distributions:
+  - vm-bookworm
+""")
+    config = Config(config_file)
+    dist = config.get_distributions()[0]
+    plugins = [
+        DistributionComponentPlugin(
+            component=component, dist=dist, config=config, stage="build"
+        )
+        for component in config.get_components()
+    ]
+    assert plugins[0].get_target_jobs() == 2
+    assert plugins[1].get_target_jobs() == 3
+
+    plugin = plugins[0]
+    targets = [PackagePath(f"debian-{i}") for i in range(4)]
+    running = []
+    executors = {}
+    finished = []
+
+    def run(target):
+        executors[target] = plugin.executor
+        running.append(target)
+        time.sleep(0.2)
+        assert len(running) <= 2
+        running.remove(target)
+        return target.mangle()
+
+    def finish(target, result):
+        # Finished in order, once all targets are done
+        assert not running
+        assert len(executors) == len(targets)
+        finished.append(result)
+
+    plugin.run_build_targets(targets, run, finish)
+    assert finished == [target.mangle() for target in targets]
+    # Each target had its own executor
+    assert len(set(map(id, executors.values()))) == len(targets)
+    assert plugin.executor not in executors.values()
+    # Executors know the distribution they run for
+    assert {e.distribution for e in executors.values()} == {"vm-bookworm"}
+
+    def fail(target):
+        if target.name == "debian-0":
+            time.sleep(0.1)
+            raise PluginError("failed")
+        time.sleep(0.2)
+        finished.append(target)
+
+    finished.clear()
+    with pytest.raises(PluginError):
+        plugin.run_build_targets(targets, fail, finish)
+    # Remaining targets are not started once one failed
+    assert finished == [PackagePath("debian-1")]
+
+
+class SessionExecutor(Executor):
+    """
+    Executor recording runs, with files copied out given by name.
+    """
+
+    supports_session = True
+
+    def __init__(self, outputs):
+        super().__init__()
+        self.outputs = outputs
+        self.runs = []
+
+    def copy_in(self, *args, **kwargs):
+        pass
+
+    def copy_out(self, *args, **kwargs):
+        pass
+
+    def get_user(self):
+        return "user"
+
+    def run(self, cmd, copy_in=None, copy_out=None, **kwargs):
+        copy_in = self.get_session_copy_in(copy_in)
+        self.runs.append((self._in_session, cmd, [dst for _, dst in copy_in]))
+        for src, dst in copy_in:
+            self.add_session_file(src, dst)
+        for src, dst in copy_out or []:
+            if src.name in self.outputs:
+                (dst / src.name).write_text(self.outputs[src.name])
+
+
+def get_source_plugin(tmp_path, plugin_class, dist, outputs):
+    source_dir = tmp_path / "artifacts/sources/foo"
+    source_dir.mkdir(parents=True, exist_ok=True)
+    (source_dir / "version").write_text("1.0\n")
+    (source_dir / "rel").write_text("1\n")
+    (source_dir / ".qubesbuilder").write_text("""
+vm:
+  rpm:
+    build:
+      - foo.spec
+  deb:
+    build:
+      - debian
+""")
+    config_file = tmp_path / "builder.yml"
+    config_file.write_text(f"""
+artifacts-dir: {tmp_path}/artifacts
+executor:
+  type: local
+components:
+  - foo
+distributions:
+  - {dist}
+""")
+    config = Config(config_file)
+    plugin = plugin_class(
+        component=config.get_components()[0],
+        dist=config.get_distributions()[0],
+        config=config,
+        stage="prep",
+        manager=PluginManager(config.get_plugins_dirs()),
+    )
+    # Artifacts of previous stages are not needed by the executor
+    plugin.dependencies = []
+    plugin.executor = SessionExecutor(outputs)
+    return plugin
+
+
+def test_source_rpm_prep_session(tmp_path):
+    plugin = get_source_plugin(
+        tmp_path,
+        RPMSourcePlugin,
+        "vm-fc42",
+        {
+            "foo.spec_package_release_name": "foo-1.0-1.fc42\nfoo-1.0.tar.gz\n",
+            "foo.spec_packages.list": "foo-1.0-1.fc42.x86_64.rpm\n",
+            "foo-1.0-1.fc42.src.rpm": "",
+        },
+    )
+    plugin.run()
+    (info_session, info_cmd, info_copy_in), (
+        srpm_session,
+        srpm_cmd,
+        srpm_copy_in,
+    ) = plugin.executor.runs
+    assert info_session and srpm_session
+    assert "get-source-info" in info_cmd[0]
+    assert Path("/builder") in info_copy_in
+    # Sources and plugins are already in the cage
+    assert srpm_copy_in == [Path("/builder/distfiles")]
+    # Source information files are not left in the source
+    assert srpm_cmd[0] == (
+        "rm -f /builder/foo/foo.spec_package_release_name "
+        "/builder/foo/foo.spec_packages.list"
+    )
+    info = plugin.get_dist_artifacts_info("prep", "foo.spec")
+    assert info["srpm"] == "foo-1.0-1.fc42.src.rpm"
+    assert info["rpms"] == ["foo-1.0-1.fc42.x86_64.rpm"]
+
+
+@pytest.mark.parametrize(
+    "outputs, error",
+    [
+        (
+            {"foo.spec_package_release_name": "../foo-1.0-1\nfoo.tar.gz\n"},
+            "Invalid source rpm name",
+        ),
+        (
+            {
+                "foo.spec_package_release_name": "foo-1.0-1\n"
+                "https://example.com/-foo.tar.gz\n"
+            },
+            "Invalid source names",
+        ),
+        (
+            {
+                "foo.spec_package_release_name": "foo-1.0-1\nfoo.tar.gz\n",
+                "foo.spec_packages.list": "../foo-1.0-1.x86_64.rpm\n",
+            },
+            "Invalid package name",
+        ),
+    ],
+)
+def test_source_rpm_prep_invalid_names(tmp_path, outputs, error):
+    plugin = get_source_plugin(tmp_path, RPMSourcePlugin, "vm-fc42", outputs)
+    with pytest.raises(SourceError, match=error):
+        plugin.run()
+    # Copied-out names are checked before creating the source RPM
+    assert len(plugin.executor.runs) == 1
+
+
+def test_source_deb_prep_session(tmp_path):
+    plugin = get_source_plugin(
+        tmp_path,
+        DEBSourcePlugin,
+        "vm-bookworm",
+        {
+            "debian_package_release_name": "foo_1.0\nfoo_1.0-1+deb12u1\nquilt\n",
+            "debian_packages.list": "foo_1.0-1+deb12u1_amd64.deb\n",
+        },
+    )
+    plugin.run()
+    (info_session, info_cmd, info_copy_in), (
+        source_session,
+        source_cmd,
+        source_copy_in,
+    ) = plugin.executor.runs
+    assert info_session and source_session
+    assert Path("/builder") in info_copy_in
+    assert source_copy_in == [Path("/builder/distfiles")]
+    # Changelog is modified in a copy of the source for getting information
+    assert info_cmd[:2] == [
+        "rm -rf /builder/foo.info",
+        "cp -a /builder/foo /builder/foo.info",
+    ]
+    assert all("/builder/foo " not in c for c in info_cmd[2:])
+    info = plugin.get_dist_artifacts_info("prep", "debian")
+    assert info["orig"] == "foo_1.0.orig.tar.gz"
+    assert info["packages"] == ["foo_1.0-1+deb12u1_amd64.deb"]
+
+
+@pytest.mark.parametrize(
+    "outputs, error",
+    [
+        (
+            {"debian_package_release_name": "foo_1.0\n../foo_1.0-1\nquilt\n"},
+            "Invalid source names",
+        ),
+        (
+            {"debian_package_release_name": "foo_1.0\nfoo_1.0-1\nother\n"},
+            "Invalid source type",
+        ),
+    ],
+)
+def test_source_deb_prep_invalid_names(tmp_path, outputs, error):
+    plugin = get_source_plugin(
+        tmp_path, DEBSourcePlugin, "vm-bookworm", outputs
+    )
+    with pytest.raises(SourceError, match=error):
+        plugin.run()
+    # Copied-out names are checked before creating the Debian source
+    assert len(plugin.executor.runs) == 1
+
+
+def test_source_deb_prep_invalid_packages(tmp_path):
+    plugin = get_source_plugin(
+        tmp_path,
+        DEBSourcePlugin,
+        "vm-bookworm",
+        {
+            "debian_package_release_name": "foo_1.0\nfoo_1.0-1\nnative\n",
+            "debian_packages.list": "../foo_1.0-1_amd64.deb\n",
+        },
+    )
+    with pytest.raises(SourceError, match="Invalid package name"):
+        plugin.run()
+    assert not plugin.get_dist_artifacts_info("prep", "debian")
@@ -12,9 +12,10 @@ import pytest
 
 from qubesbuilder.common import PROJECT_PATH
 
-get_and_verify_source = importlib.import_module(
+get_and_verify_source_module = importlib.import_module(
     "qubesbuilder.plugins.fetch.scripts.get-and-verify-source"
-).main
+)
+get_and_verify_source = get_and_verify_source_module.main
 
 
 @pytest.fixture
@@ -129,6 +130,7 @@ def create_dummy_args(
     maintainers=None,
     minimum_distinct_maintainers=1,
     trust_all_keys=False,
+    git_mirror=None,
 ):
     args = Namespace()
 
@@ -163,6 +165,7 @@ def create_dummy_args(
     args.maintainer = maintainers
     args.minimum_distinct_maintainers = minimum_distinct_maintainers
     args.trust_all_keys = trust_all_keys
+    args.git_mirror = git_mirror
     return args
 
 
@@ -675,3 +678,228 @@ def test_repository_shallow_clone(temp_directory):
         == "true"
     )
     assert (temp_directory / "version").exists()
+
+
+def create_local_repository(repo_dir):
+    subprocess.run(
+        ["git", "init", "-q", "-b", "main", str(repo_dir)],
+        check=True,
+        capture_output=True,
+    )
+    add_local_commit(repo_dir, "version", "1.0")
+
+
+def add_local_commit(repo_dir, filename, content):
+    (repo_dir / filename).write_text(content)
+    subprocess.run(
+        ["git", "add", filename], check=True, capture_output=True, cwd=repo_dir
+    )
+    subprocess.run(
+        ["git", "-c", "user.name=testuser", "-c", "user.email=test@localhost"]
+        + ["commit", "-q", "-m", f"Update {filename}"],
+        check=True,
+        capture_output=True,
+        cwd=repo_dir,
+    )
+    return subprocess.run(
+        ["git", "rev-parse", "HEAD"],
+        check=True,
+        capture_output=True,
+        cwd=repo_dir,
+        text=True,
+    ).stdout.strip()
+
+
+def get_head(repo_dir, ref="HEAD"):
+    return subprocess.run(
+        ["git", "rev-parse", ref],
+        capture_output=True,
+        cwd=str(repo_dir),
+        text=True,
+    ).stdout.strip()
+
+
+def test_repository_git_mirror(temp_directory):
+    upstream = temp_directory / "upstream"
+    create_local_repository(upstream)
+    mirror = temp_directory / "mirror"
+    component = temp_directory / "component"
+    args = create_dummy_args(
+        component_repository=str(upstream),
+        component_directory=component,
+        insecure_skip_checking=True,
+        maintainers=[],
+        git_mirror=str(mirror),
+    )
+    get_and_verify_source(args)
+    assert get_head(component) == get_head(upstream)
+    assert (mirror / "refs/heads/main").exists()
+    # The clone does not depend on the mirror
+    assert not (component / ".git/objects/info/alternates").exists()
+
+    # The mirror is updated with new objects
+    commit = add_local_commit(upstream, "file", "content")
+    shutil.rmtree(component)
+    get_and_verify_source(args)
+    assert get_head(component) == commit
+    assert get_head(mirror, "main") == commit
+
+    # Commits are fetched through the mirror too
+    add_local_commit(upstream, "file", "new content")
+    shutil.rmtree(component)
+    args.git_commit = commit
+    get_and_verify_source(args)
+    assert get_head(component) == commit
+    assert not (component / ".git/objects/info/alternates").exists()
+    shutil.rmtree(mirror)
+    subprocess.run(
+        ["git", "fsck"], check=True, capture_output=True, cwd=component
+    )
+
+
+def test_repository_git_mirror_corrupted(capsys, temp_directory):
+    upstream = temp_directory / "upstream"
+    create_local_repository(upstream)
+    mirror = temp_directory / "mirror"
+    (mirror / "objects").mkdir(parents=True)
+    (mirror / "HEAD").write_text("garbage")
+    component = temp_directory / "component"
+    args = create_dummy_args(
+        component_repository=str(upstream),
+        component_directory=component,
+        insecure_skip_checking=True,
+        maintainers=[],
+        git_mirror=str(mirror),
+    )
+    # Source is cloned without the mirror
+    get_and_verify_source(args)
+    assert "WARNING: Cannot update git mirror" in capsys.readouterr().out
+    assert get_head(component) == get_head(upstream)
+    assert not (component / ".git/objects/info/alternates").exists()
+
+    # A mirror not being a directory is replaced
+    shutil.rmtree(mirror)
+    mirror.write_text("garbage")
+    shutil.rmtree(component)
+    get_and_verify_source(args)
+    assert get_head(mirror, "main") == get_head(upstream)
+    assert get_head(component) == get_head(upstream)
+
+
+def test_repository_git_mirror_clone_failure(
+    capsys, monkeypatch, temp_directory
+):
+    upstream = temp_directory / "upstream"
+    create_local_repository(upstream)
+    mirror = temp_directory / "mirror"
+    component = temp_directory / "component"
+    args = create_dummy_args(
+        component_repository=str(upstream),
+        component_directory=component,
+        insecure_skip_checking=True,
+        maintainers=[],
+        git_mirror=str(mirror),
+        git_commit=get_head(upstream),
+    )
+    get_and_verify_source(args)
+
+    # Objects of the mirror are corrupted after its update
+    monkeypatch.setattr(
+        get_and_verify_source_module,
+        "update_git_mirror",
+        lambda git_url, mirror: None,
+    )
+    for path in (mirror / "objects").glob("??/*"):
+        path.chmod(0o644)
+        path.write_bytes(b"garbage")
+    shutil.rmtree(component)
+    get_and_verify_source(args)
+    assert "WARNING: Cannot clone using git mirror" in capsys.readouterr().out
+    assert get_head(component) == get_head(upstream)
+    assert not (component / ".git/objects/info/alternates").exists()
+
+
+#
+# download-file
+#
+
+DOWNLOAD_FILE = (
+    PROJECT_PATH / "qubesbuilder/plugins/fetch/scripts/download-file"
+)
+
+
+def run_download_file(output_dir, *args):
+    return subprocess.run(
+        [str(DOWNLOAD_FILE), "--output-dir", str(output_dir), *args],
+        capture_output=True,
+        text=True,
+    )
+
+
+def test_download_file_resume(fake_server, temp_directory):
+    content = get_random_string(4096)
+    (fake_server / "foo.tar.gz").write_text(content)
+    (fake_server / "foo.tar.gz.asc").write_text("signature")
+
+    # Interrupted download is kept as a partial file
+    (fake_server / "foo.tar.gz.partial").write_text(content[:1000])
+    args = [
+        "--file-name",
+        "foo.tar.gz",
+        "--file-url",
+        "https://example.com/foo.tar.gz",
+        "--signature-url",
+        "https://example.com/foo.tar.gz.asc",
+    ]
+    assert run_download_file(temp_directory, *args).returncode == 18
+    assert (
+        temp_directory / "untrusted_foo.tar.gz.part"
+    ).read_text() == content[:1000]
+    assert not (temp_directory / "untrusted_foo.tar.gz").exists()
+
+    # and resumed next time
+    (fake_server / "foo.tar.gz.partial").unlink()
+    assert run_download_file(temp_directory, *args).returncode == 0
+    assert (temp_directory / "untrusted_foo.tar.gz").read_text() == content
+    assert (
+        temp_directory / "untrusted_foo.tar.gz.asc"
+    ).read_text() == "signature"
+    assert not list(temp_directory.glob("*.part"))
+    assert (fake_server / ".log").read_text().splitlines()[-2:] == [
+        "resume https://example.com/foo.tar.gz",
+        "https://example.com/foo.tar.gz.asc",
+    ]
+
+
+def test_download_file_resume_unsupported(fake_server, temp_directory):
+    content = get_random_string(4096)
+    (fake_server / "foo.tar.gz").write_text(content)
+    (fake_server / ".no-ranges").touch()
+    (temp_directory / "untrusted_foo.tar.gz.part").write_text("stale")
+
+    # Download starts again when the server does not support ranges
+    result = run_download_file(
+        temp_directory,
+        "--file-name",
+        "foo.tar.gz",
+        "--file-url",
+        "https://example.com/foo.tar.gz",
+    )
+    assert result.returncode == 0, result.stdout
+    assert (temp_directory / "untrusted_foo.tar.gz").read_text() == content
+    assert not (temp_directory / "untrusted_foo.tar.gz.part").exists()
+    assert (fake_server / ".log").read_text().splitlines() == [
+        "resume https://example.com/foo.tar.gz",
+        "https://example.com/foo.tar.gz",
+    ]
+
+    # Other errors are reported as they are
+    result = run_download_file(
+        temp_directory,
+        "--file-name",
+        "bar.tar.gz",
+        "--file-url",
+        "https://example.com/bar.tar.gz",
+    )
+    assert result.returncode == 22
+    assert "ERROR: Failed to download" in result.stdout
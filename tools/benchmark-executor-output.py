@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+#
+# The Qubes OS Project, http://www.qubes-os.org
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program. If not, see <https://www.gnu.org/licenses/>.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""
+Measure the throughput of executors output handling.
+
+A command writes lines which are read, sanitized and logged into a file, as
+for the output of a build. Reported CPU time is the one used by the builder
+itself, not by the command.
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+from logging import DEBUG, FileHandler
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from qubesbuilder.executors.local import LocalExecutor  # noqa: E402
+from qubesbuilder.log import FileFormatter, QubesBuilderLogger  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--lines", type=int, default=1000000, help="Number of lines."
+    )
+    parser.add_argument(
+        "--line-length", type=int, default=100, help="Length of lines."
+    )
+    parser.add_argument(
+        "--collect",
+        action="store_true",
+        help="Also collect output, like for qrexec calls.",
+    )
+    args = parser.parse_args()
+
+    # Lines with characters to sanitize
+    line = (b"x" * max(0, args.line_length - 3) + b"\r\x1b\n").decode()
+    command = [
+        sys.executable,
+        "-c",
+        "import sys\n"
+        f"line = {line.encode()!r}\n"
+        f"for _ in range({args.lines} // 1000):\n"
+        "    sys.stdout.buffer.write(line * 1000)\n",
+    ]
+
+    with tempfile.NamedTemporaryFile() as log_file:
+        handler = FileHandler(log_file.name)
+        handler.setFormatter(FileFormatter())
+        logger = QubesBuilderLogger.getChild("benchmark")
+        logger.setLevel(DEBUG)
+        logger.addHandler(handler)
+
+        executor = LocalExecutor()
+        executor.log = logger
+
+        start, start_cpu = time.monotonic(), time.process_time()
+        executor.execute(command, collect=args.collect)
+        elapsed, cpu = (
+            time.monotonic() - start,
+            time.process_time() - start_cpu,
+        )
+        handler.close()
+
+    lines = args.lines // 1000 * 1000
+    size = lines * len(line) / 1024 / 1024
+    print(
+        f"{lines} lines ({size:.1f} MiB) in {elapsed:.2f}s: "
+        f"{lines / elapsed:.0f} lines/s, {size / elapsed:.1f} MiB/s, "
+        f"{cpu:.2f}s of CPU time."
+    )
+
+
+if __name__ == "__main__":
+    main()